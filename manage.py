@@ -8,9 +8,72 @@ def test():
     call(['py.test', '-v', '-s'])
 
 
+def analytics(source, symbol=None, bucket=60):
+    """Print the trade statistics of `source`: a trade log file, an archive
+    directory or a database uri."""
+    import json
+    from xtrade.analytics import load_trades, load_trades_from_db, summarize
+
+    if '://' in source:
+        from xtrade.app import app
+        from xtrade.db import db
+
+        app.config.from_mapping(SQLALCHEMY_DATABASE_URI=source, SQLALCHEMY_TRACK_MODIFICATIONS=False)
+        db.init_app(app)
+        with app.app_context():
+            trades = load_trades_from_db(db, symbol)
+    else:
+        trades = load_trades(source, symbol)
+    print(json.dumps(summarize(trades, int(bucket) * 10 ** 9), indent=2, sort_keys=True))
+
+
+def replay(path):
+    """Replay an order stream of json lines, print the trades and the final book."""
+    import sys
+    from xtrade.replay import replay_file
+
+    replay_file(path, sys.stdout)
+
+
+def simulate(scenarios=100, orders=1000, workers=None):
+    """Run randomized scenarios across a process pool and print the stats."""
+    import json
+    import logging
+    from xtrade.simulation import Scenario, run_simulation
+
+    logging.disable(logging.WARNING)
+    summary = run_simulation([Scenario(seed, int(orders)) for seed in range(int(scenarios))],
+                             workers and int(workers))
+    print(json.dumps(summary, indent=2, sort_keys=True))
+
+
+def partitions(path, command, day, dest=None):
+    """Compact or detach (into `dest`) the partition of a past `day` (YYYYMMDD) under `path`."""
+    from xtrade.partition import Partitions
+
+    partitions = Partitions(path)
+    try:
+        if command == 'compact':
+            partitions.compact(day)
+        elif command == 'detach':
+            print(partitions.detach(day, dest))
+        else:
+            print('unknown command: %s' % (command,))
+    finally:
+        partitions.close()
+
+
 if __name__ == '__main__':
     import sys
     if len(sys.argv) == 2 and sys.argv[1] == 'test':
         test()
+    elif len(sys.argv) > 2 and sys.argv[1] == 'analytics':
+        analytics(*sys.argv[2:])
+    elif len(sys.argv) == 3 and sys.argv[1] == 'replay':
+        replay(sys.argv[2])
+    elif len(sys.argv) >= 2 and sys.argv[1] == 'simulate':
+        simulate(*sys.argv[2:])
+    elif len(sys.argv) > 4 and sys.argv[1] == 'partitions':
+        partitions(*sys.argv[2:])
     else:
         run_app()
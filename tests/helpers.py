@@ -0,0 +1,26 @@
+"""Shortcuts shared by the tests driving a TradeManager on the test thread."""
+from xtrade.event import NewOrderEvent
+from xtrade.manager import TradeManager, MemTradeStore
+from xtrade.order import MemOrderStore
+
+
+def new_manager(queue=None, trade_store=None, order_store=None, **kwargs):
+    """Return a TradeManager on in-memory stores by default, writing no log file."""
+    for name in ('trade_log_file', 'order_log_file', 'depth_log_file'):
+        kwargs.setdefault(name, None)
+    if trade_store is None:
+        trade_store = MemTradeStore()
+    if order_store is None:
+        order_store = MemOrderStore()
+    return TradeManager(queue, trade_store, order_store, **kwargs)
+
+
+def place_order(manager, type_, amount, price=None, symbol='WSCN', **kwargs):
+    """Create an order and process it at once, return its execution report."""
+    order = manager.order_store.create(type_, symbol, amount, price, **kwargs)
+    return manager.handle_event(NewOrderEvent(order.id))
+
+
+def new_order(manager, type_, amount, price=None, symbol='WSCN', **kwargs):
+    """Like `place_order`, return the order."""
+    return place_order(manager, type_, amount, price, symbol, **kwargs).order
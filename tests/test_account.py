@@ -0,0 +1,79 @@
+from unittest import TestCase
+
+from xtrade.account import Ledger, MemLedgerStore, InsufficientFunds
+from xtrade.event import NewOrderEvent, CancelOrderEvent, AmendOrderEvent
+from xtrade.order import MemOrderStore
+
+from helpers import new_manager
+
+
+class TestLedger(TestCase):
+    def setUp(self):
+        self.store = MemLedgerStore()
+        self.ledger = Ledger(self.store, flush_size=2)
+        self.ledger.deposit('alice', cash=100000)
+        self.ledger.deposit('bob', positions={'WSCN': 20})
+        self.order_store = MemOrderStore()
+        self.manager = new_manager(order_store=self.order_store, ledger=self.ledger)
+
+    def _new_order(self, account, type_, amount, price=None):
+        order = self.order_store.create(type_, 'WSCN', amount, price, account=account)
+        self.ledger.reserve(order)
+        self.manager.handle_event(NewOrderEvent(order.id))
+        return order
+
+    def test_reserve(self):
+        self._new_order('alice', 'buy', 5, 100)
+        alice = self.ledger.get('alice')
+        self.assertEqual((alice.cash, alice.reserved_cash), (100000, 50000))
+        with self.assertRaises(InsufficientFunds):
+            self._new_order('alice', 'buy', 6, 100)
+        self._new_order('bob', 'sell', 15, 105)
+        with self.assertRaises(InsufficientFunds):
+            self._new_order('bob', 'sell', 6, 105)
+        # market buys hold cash at the highest price of the symbol
+        with self.assertRaises(InsufficientFunds):
+            self._new_order('alice', 'market_buy', 5)
+
+    def test_fills_and_release(self):
+        sell = self._new_order('bob', 'sell', 10, 99)
+        buy = self._new_order('alice', 'buy', 6, 100)
+        alice, bob = self.ledger.get('alice'), self.ledger.get('bob')
+        self.assertEqual((alice.cash, alice.reserved_cash, alice.positions), (100000 - 6 * 9900, 0, {'WSCN': 6}))
+        self.assertEqual((bob.cash, bob.positions, bob.reserved), (6 * 9900, {'WSCN': 14}, {'WSCN': 4}))
+        self.manager.handle_event(CancelOrderEvent(sell.id))
+        self.assertEqual(bob.reserved, {'WSCN': 0})
+        self.assertFalse(buy.id in self.ledger._reservations)
+
+        # the two accounts changed in one batch
+        self.assertEqual(sorted(self.store.load(), key=lambda row: row['id']), [
+            {'id': 'alice', 'cash': 100000 - 6 * 9900, 'positions': {'WSCN': 6}},
+            {'id': 'bob', 'cash': 6 * 9900, 'positions': {'WSCN': 14}},
+        ])
+        self.assertEqual(Ledger(self.store).get('bob').positions, {'WSCN': 14})
+
+    def test_amend(self):
+        order = self._new_order('alice', 'buy', 5, 100)
+        with self.assertRaises(InsufficientFunds):
+            self.ledger.amend(order.id, amount=11)
+        self.assertEqual(self.ledger.get('alice').reserved_cash, 50000)
+        self.assertEqual(self.manager.handle_event(AmendOrderEvent(order.id, amount=11)), None)
+        self.assertEqual(self.manager.resting_orders('WSCN', 'buy')[0].amount, 5)
+        self.manager.handle_event(AmendOrderEvent(order.id, price=101))
+        self.assertEqual(self.ledger.get('alice').reserved_cash, 50500)
+
+    def test_amend_rejected_by_the_engine(self):
+        stop = self.order_store.create('stop_limit_buy', 'WSCN', 5, 100, 101, account='alice')
+        self.ledger.reserve(stop)
+        self.manager.handle_event(NewOrderEvent(stop.id))
+        self.assertEqual(self.manager.handle_event(AmendOrderEvent(stop.id, amount=1)), None)
+        self.assertEqual(self.ledger.get('alice').reserved_cash, 50000)
+
+    def test_flush_interval(self):
+        now = [0]
+        ledger = Ledger(self.store, flush_size=100, flush_interval=1.0, clock=lambda: now[0])
+        ledger.deposit('carol', cash=100)
+        self.assertEqual(len(self.store.load()), 0)
+        now[0] = 1.5
+        ledger.apply_fills([])
+        self.assertEqual([row['id'] for row in self.store.load()], ['carol'])
@@ -0,0 +1,74 @@
+import time
+from unittest import TestCase
+
+from xtrade.admission import TokenBucket, AdmissionController
+from xtrade.exc import EngineBusy, RateLimited
+from xtrade.message_queue import LocalQueue, QueueFull
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class TestTokenBucket(TestCase):
+    def test_consume(self):
+        clock = FakeClock()
+        bucket = TokenBucket(rate=2, capacity=2, clock=clock)
+        self.assertEqual(bucket.consume(), 0)
+        self.assertEqual(bucket.consume(), 0)
+        self.assertEqual(bucket.consume(), 0.5)
+        clock.now = 0.5
+        self.assertEqual(bucket.consume(), 0)
+
+
+class TestAdmissionController(TestCase):
+    def test_queue_depth(self):
+        queue = LocalQueue(maxsize=3)
+        admission = AdmissionController(queue, max_queue_depth=2, max_lag=None)
+        admission.admit('c1')
+        queue.put('e1')
+        queue.put('e2')
+        self.assertRaises(EngineBusy, admission.admit, 'c1')
+        queue.put('e3')
+        self.assertRaises(QueueFull, queue.put, 'e4')
+        queue.put('cancel', force=True)
+        self.assertEqual(admission.stats()['queue_depth'], 4)
+        self.assertEqual(admission.stats()['rejections']['queue_depth'], 1)
+        self.assertEqual(admission.stats()['admitted'], 1)
+
+    def test_lag(self):
+        queue = LocalQueue()
+        admission = AdmissionController(queue, max_queue_depth=None, max_lag=0.01)
+        admission.admit('c1')
+        queue.put('e1')
+        time.sleep(0.02)
+        with self.assertRaises(EngineBusy) as cm:
+            admission.admit('c1')
+        self.assertTrue(cm.exception.retry_after >= 1)
+        self.assertEqual(queue.get(), 'e1')
+        self.assertEqual(queue.lag, 0)
+
+    def test_rate_limit(self):
+        clock = FakeClock()
+        admission = AdmissionController(LocalQueue(), rate=1, burst=1, clock=clock)
+        admission.admit('c1')
+        self.assertRaises(RateLimited, admission.admit, 'c1')
+        admission.admit('c2')
+        clock.now = 1
+        admission.admit('c1')
+        self.assertEqual(admission.stats()['rejections']['rate_limit'], 1)
+
+    def test_idle_buckets_are_dropped(self):
+        clock = FakeClock()
+        admission = AdmissionController(LocalQueue(), rate=1, burst=2, clock=clock)
+        admission.admit('c1')
+        clock.now = 1
+        admission.admit('c2')
+        self.assertEqual(sorted(admission._buckets), ['c1', 'c2'])
+        clock.now = 2.5
+        admission.admit('c2')
+        self.assertEqual(sorted(admission._buckets), ['c2'])
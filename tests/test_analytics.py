@@ -0,0 +1,131 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+import numpy as np
+
+from xtrade import analytics
+from xtrade.analytics import Trades
+from xtrade.app import app
+from xtrade.db import db
+from xtrade.manager import DBTradeStore, Fill
+from xtrade.order import DBOrderStore
+
+from helpers import new_manager, new_order
+
+
+SECOND = 10 ** 9
+
+
+class TestAnalytics(TestCase):
+    def setUp(self):
+        self.trades = Trades(['A', 'B', 'A', 'A', 'B'],
+                             [3 * SECOND, 1 * SECOND, 0, 61 * SECOND, 2 * SECOND],
+                             [101, 50, 100, 102, 51],
+                             [10, 5, 30, 10, 5])
+
+    def test_by_symbol(self):
+        by_symbol = self.trades.by_symbol()
+        self.assertEqual(sorted(by_symbol), ['A', 'B'])
+        self.assertEqual(by_symbol['A'].price.tolist(), [100, 101, 102])
+        self.assertEqual(by_symbol['B'].amount.tolist(), [5, 5])
+
+    def test_stats(self):
+        trades = self.trades.by_symbol()['A']
+        self.assertAlmostEqual(analytics.vwap(trades), (3000 + 1010 + 1020) / 50.)
+        prices, volumes = analytics.volume_profile(trades)
+        self.assertEqual(prices.tolist(), [100, 101, 102])
+        self.assertEqual(volumes.tolist(), [30, 10, 10])
+        starts, volumes = analytics.bucket_volume(trades, 60 * SECOND)
+        self.assertEqual(starts.tolist(), [0, 60 * SECOND])
+        self.assertEqual(volumes.tolist(), [40, 10])
+        self.assertEqual(analytics.spread_stats(trades, 60 * SECOND)['max'], 1)
+        self.assertAlmostEqual(analytics.realized_volatility(trades, 60 * SECOND),
+                               abs(np.log(102. / 101)))
+        self.assertAlmostEqual(analytics.realized_volatility(trades),
+                               np.sqrt(np.log(101 / 100.) ** 2 + np.log(102. / 101) ** 2))
+
+    def test_summarize(self):
+        summary = analytics.summarize(self.trades)
+        self.assertEqual(summary['B']['volume'], 10)
+        self.assertEqual(summary['A']['trades'], 3)
+
+    def test_load_trades_from_log(self):
+        path = tempfile.mkdtemp()
+        try:
+            log_file = os.path.join(path, 'trade.log')
+            with open(log_file, 'w') as f:
+                f.write('2016-07-01 10:00:00.000001 100.5 10\n')
+                f.write('2016-07-01 10:00:01.5 101 20\n')
+            trades = analytics.load_trades(log_file, 'WSCN')
+            self.assertEqual(trades.price.tolist(), [100.5, 101])
+            self.assertEqual(trades.timestamp[1] - trades.timestamp[0], 1499999000)
+            self.assertEqual(trades.symbol.tolist(), ['WSCN', 'WSCN'])
+        finally:
+            shutil.rmtree(path)
+
+    def test_load_trades_from_log_in_nanoseconds(self):
+        path = tempfile.mkdtemp()
+        try:
+            log_file = os.path.join(path, 'trade.log')
+            with open(log_file, 'w') as f:
+                f.write('1467367200000001000 100.5 10\n')
+                f.write('1467367201500000000 101 20\n')
+            trades = analytics.load_trades(log_file, 'WSCN')
+            self.assertEqual(trades.amount.tolist(), [10, 20])
+            self.assertEqual(trades.timestamp[1] - trades.timestamp[0], 1499999000)
+            self.assertEqual(trades.timestamp.dtype, np.int64)
+            self.assertEqual(trades.timestamp[0], 1467367200000001000)
+
+            open(log_file, 'w').close()
+            self.assertEqual(len(analytics.load_trades(log_file, 'WSCN')), 0)
+        finally:
+            shutil.rmtree(path)
+
+    def test_load_trades_from_log_by_symbol(self):
+        path = tempfile.mkdtemp()
+        try:
+            log_file = os.path.join(path, 'trade.log')
+            manager = new_manager(trade_log_file=log_file)
+            new_order(manager, 'sell', 10, 100)
+            new_order(manager, 'buy', 4, 100)
+            with open(log_file, 'a') as f:
+                f.write('%s MU 10.5 4\n' % (manager._timestamp + 1,))
+            new_order(manager, 'buy', 4, 100)
+            trades = analytics.load_trades(log_file)
+            self.assertEqual(trades.symbol.tolist(), ['WSCN', 'MU', 'WSCN'])
+            self.assertEqual(analytics.summarize(trades)['WSCN']['volume'], 8)
+            self.assertEqual(analytics.load_trades(log_file, 'MU').amount.tolist(), [4])
+
+            with open(log_file, 'w') as f:
+                f.write('1467367200000001000 100.5 10\n')
+            self.assertRaises(ValueError, analytics.load_trades, log_file)
+        finally:
+            shutil.rmtree(path)
+
+
+class TestLoadTradesFromDB(TestCase):
+    def setUp(self):
+        self.ctx = app.app_context()
+        self.ctx.push()
+        app.config.from_mapping(SQLALCHEMY_DATABASE_URI='sqlite:///:memory:',
+                                SQLALCHEMY_TRACK_MODIFICATIONS=True)
+        db.init_app(app)
+        db.create_all()
+
+    def tearDown(self):
+        db.drop_all()
+        self.ctx.pop()
+
+    def test_load(self):
+        order_store = DBOrderStore(db)
+        buy = order_store.create('buy', 'WSCN', 30, price=101)
+        sell1 = order_store.create('sell', 'WSCN', 10, price=100)
+        sell2 = order_store.create('sell', 'WSCN', 20, price=101)
+        DBTradeStore(db).do_trades([Fill(buy, sell1, 100, 10, 20, 0), Fill(buy, sell2, 101, 20, 0, 0)])
+
+        trades = analytics.load_trades_from_db(db)
+        self.assertEqual(len(trades), 2)
+        self.assertEqual(sorted(trades.price.tolist()), [100, 101])
+        self.assertEqual(len(analytics.load_trades_from_db(db, 'MU')), 0)
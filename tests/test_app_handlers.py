@@ -1,12 +1,18 @@
 import json
+import threading
 from unittest import TestCase
 
-from xtrade.app import app, NewOrderEvent, CancelOrderEvent
+from xtrade.app import app, NewOrderEvent, CancelOrderEvent, AmendOrderEvent
 from xtrade.app import install_queue, install_trade_store, install_order_store, uninstall_all
-from xtrade.app import get_queue, get_order_store, get_trade_store
+from xtrade.app import get_queue, get_order_store, get_trade_store, install_admission, install_ledger
+from xtrade.account import Ledger
+from xtrade.admission import AdmissionController
+from xtrade.message_queue import LocalQueue
 from xtrade.order import MemOrderStore
 from xtrade.manager import MemTradeStore
 
+from helpers import new_manager
+
 
 class TestHandlers(TestCase):
     def setUp(self):
@@ -49,6 +55,55 @@ class TestHandlers(TestCase):
         self.assertTrue(isinstance(event, NewOrderEvent), event)
         self.assertEqual(event.order_id, order_id)
 
+    def test_do_trade_rejected_when_queue_is_deep(self):
+        install_admission(AdmissionController(self.queue, max_queue_depth=1, max_lag=None))
+        with app.test_client() as c:
+            data = json.dumps({
+                'symbol': 'WSCN',
+                'type': 'sell',
+                'amount': 10,
+                'price': 100,
+            })
+            resp = c.post('/trade.do', headers={'content-type': 'application/json'}, data=data)
+            self.assertEqual(resp.status_code, 200, resp.data)
+            resp = c.post('/trade.do', headers={'content-type': 'application/json'}, data=data)
+            self.assertEqual(resp.status_code, 503, resp.data)
+            self.assertEqual(resp.headers['Retry-After'], '1')
+
+            resp = c.get('/stats.do')
+            resp_data = json.loads(resp.data.decode())
+            self.assertEqual(resp_data['queue_depth'], 1)
+            self.assertEqual(resp_data['rejections']['queue_depth'], 1)
+
+    def test_do_trade_rate_limited(self):
+        install_admission(AdmissionController(self.queue, rate=0.01, burst=1))
+        with app.test_client() as c:
+            data = json.dumps({
+                'symbol': 'WSCN',
+                'type': 'sell',
+                'amount': 10,
+                'price': 100,
+            })
+            headers = {'content-type': 'application/json', 'X-Client-Id': 'c1'}
+            resp = c.post('/trade.do', headers=headers, data=data)
+            self.assertEqual(resp.status_code, 200, resp.data)
+            # the client is known by its address, not by what it claims to be
+            headers['X-Client-Id'] = 'c2'
+            resp = c.post('/trade.do', headers=headers, data=data)
+            self.assertEqual(resp.status_code, 429, resp.data)
+            self.assertTrue(int(resp.headers['Retry-After']) > 0)
+            resp = c.post('/trade.do', headers=headers, data=data, environ_base={'REMOTE_ADDR': '10.0.0.2'})
+            self.assertEqual(resp.status_code, 200, resp.data)
+
+    def test_do_trade_with_full_queue(self):
+        self.queue = install_queue(LocalQueue(maxsize=1))
+        self.queue.put(CancelOrderEvent(1))
+        with app.test_client() as c:
+            data = {'symbol': 'WSCN', 'type': 'sell', 'amount': 10, 'price': 100}
+            resp = c.post('/trade.do', headers={'content-type': 'application/json'}, data=json.dumps(data))
+            self.assertEqual(resp.status_code, 503, resp.data)
+        self.assertEqual(self.order_store._data, {})
+
     def test_do_trade_with_non_json_formatted_content(self):
         with app.test_client() as c:
             data = {
@@ -114,6 +169,58 @@ class TestHandlers(TestCase):
             resp_data = json.loads(resp.data.decode())
             self.assertTrue('1001' in resp_data['message'])
 
+    def test_do_trade_without_price(self):
+        with app.test_client() as c:
+            headers = {'content-type': 'application/json'}
+            for type_ in ('buy', 'ioc_sell', 'fok_buy', 'stop_limit_sell'):
+                data = {'symbol': 'WSCN', 'type': type_, 'amount': 10, 'stop_price': 99}
+                resp = c.post('/trade.do', headers=headers, data=json.dumps(data))
+                self.assertEqual(resp.status_code, 400, resp.data)
+                self.assertEqual(json.loads(resp.data.decode())['message'], 'miss key: price')
+            data = {'symbol': 'WSCN', 'type': 'market_buy', 'amount': 10}
+            resp = c.post('/trade.do', headers=headers, data=json.dumps(data))
+            self.assertEqual(resp.status_code, 200, resp.data)
+        self.assertEqual(self.queue.qsize(), 1)
+
+    def test_do_trade_stop_order(self):
+        with app.test_client() as c:
+            headers = {'content-type': 'application/json'}
+            data = {'symbol': 'WSCN', 'type': 'stop_sell', 'amount': 10}
+            resp = c.post('/trade.do', headers=headers, data=json.dumps(data))
+            self.assertEqual(resp.status_code, 400, resp.data)
+            self.assertTrue('stop_price' in json.loads(resp.data.decode())['message'])
+
+            data['stop_price'] = 99
+            resp = c.post('/trade.do', headers=headers, data=json.dumps(data))
+            self.assertEqual(resp.status_code, 200, resp.data)
+            order_id = json.loads(resp.data.decode())['order_id']
+            self.assertEqual(self.order_store.get(order_id).stop_price, 99)
+
+            data = {'symbol': 'WSCN', 'type': 'sell', 'amount': 10, 'price': 100, 'stop_price': 99}
+            resp = c.post('/trade.do', headers=headers, data=json.dumps(data))
+            self.assertEqual(resp.status_code, 400, resp.data)
+
+    def test_do_trade_with_account(self):
+        install_ledger(Ledger())
+        with app.test_client() as c:
+            headers = {'content-type': 'application/json'}
+            data = {'symbol': 'WSCN', 'type': 'buy', 'amount': 10, 'price': 100}
+            resp = c.post('/trade.do', headers=headers, data=json.dumps(data))
+            self.assertEqual(resp.status_code, 400, resp.data)
+
+            data['account'] = 'alice'
+            resp = c.post('/trade.do', headers=headers, data=json.dumps(data))
+            self.assertEqual(resp.status_code, 400, resp.data)
+            self.assertEqual(json.loads(resp.data.decode())['error'], 'InsufficientFunds')
+            self.assertEqual(self.order_store._data, {})
+
+            resp = c.post('/admin/deposit.do', headers=headers, data=json.dumps({'account': 'alice', 'cash': 100000}))
+            self.assertEqual(resp.status_code, 200, resp.data)
+            resp = c.post('/trade.do', headers=headers, data=json.dumps(data))
+            self.assertEqual(resp.status_code, 200, resp.data)
+            order_id = json.loads(resp.data.decode())['order_id']
+            self.assertEqual(self.order_store.get(order_id).account, 'alice')
+
     def test_cancel_order(self):
         self.order_store.create('sell', 'WSCN', 10, price=100)
         with app.test_client() as c:
@@ -133,6 +240,74 @@ class TestHandlers(TestCase):
         self.assertTrue(isinstance(event, CancelOrderEvent), event)
         self.assertEqual(event.order_id, 1)
 
+    def test_mass_cancel(self):
+        manager = new_manager(self.queue, self.trade_store, self.order_store, timeout=0.1)
+        for price in (98, 99):
+            order = self.order_store.create('buy', 'WSCN', 10, price=price)
+            manager.handle_event(NewOrderEvent(order.id))
+        manager.start()
+        with app.test_client() as c:
+            headers = {'content-type': 'application/json'}
+            resp = c.post('/mass_cancel.do', headers=headers, data=json.dumps({'side': 'buy'}))
+            self.assertEqual(resp.status_code, 400, resp.data)
+
+            resp = c.post('/mass_cancel.do', headers=headers, data=json.dumps({'symbol': 'WSCN', 'side': 'buy'}))
+            self.assertEqual(resp.status_code, 200, resp.data)
+            resp_data = json.loads(resp.data.decode())
+            self.assertEqual((resp_data['count'], resp_data['order_ids']), (2, [1, 2]))
+        self.assertTrue(self.trade_store.get(1)[-1].is_canceled)
+
+    def test_cancels_are_never_rejected(self):
+        self.queue = install_queue(LocalQueue(maxsize=1))
+        install_admission(AdmissionController(self.queue, max_queue_depth=None, max_lag=None, rate=0.01, burst=1))
+        manager = new_manager(self.queue, self.trade_store, self.order_store, timeout=0.1)
+        order = self.order_store.create('buy', 'WSCN', 10, price=98)
+        manager.handle_event(NewOrderEvent(order.id))
+        with app.test_client() as c:
+            headers = {'content-type': 'application/json'}
+            data = {'symbol': 'WSCN', 'type': 'sell', 'amount': 10, 'price': 100}
+            resp = c.post('/trade.do', headers=headers, data=json.dumps(data))
+            self.assertEqual(resp.status_code, 200, resp.data)
+            resp = c.post('/trade.do', headers=headers, data=json.dumps(data))
+            self.assertEqual(resp.status_code, 429, resp.data)
+
+            # the queue is full and the client out of tokens: the mass cancel still gets in
+            threading.Timer(0.1, manager.start).start()
+            resp = c.post('/mass_cancel.do', headers=headers, data=json.dumps({'symbol': 'WSCN'}))
+            self.assertEqual(resp.status_code, 200, resp.data)
+            resp_data = json.loads(resp.data.decode())
+            self.assertEqual((resp_data['count'], resp_data['order_ids']), (2, [1, 2]))
+
+    def test_amend_order(self):
+        self.order_store.create('sell', 'WSCN', 10, price=100)
+        with app.test_client() as c:
+            data = json.dumps({'order_id': 1, 'amount': 5, 'price': 101})
+            resp = c.post('/amend_order.do', headers={'content-type': 'application/json'}, data=data)
+            self.assertEqual(resp.status_code, 200, resp.data)
+            resp_data = json.loads(resp.data.decode())
+            self.assertTrue(resp_data['result'])
+
+            data = json.dumps({'order_id': 1, 'price': 120})
+            resp = c.post('/amend_order.do', headers={'content-type': 'application/json'}, data=data)
+            self.assertEqual(resp.status_code, 400, resp.data)
+            data = json.dumps({'order_id': 2, 'amount': 5})
+            resp = c.post('/amend_order.do', headers={'content-type': 'application/json'}, data=data)
+            self.assertEqual(resp.status_code, 400, resp.data)
+
+        event = self.queue.get()
+        self.assertTrue(isinstance(event, AmendOrderEvent), event)
+        self.assertEqual((event.order_id, event.amount, event.price), (1, 5, 101))
+
+    def test_amend_stop_order(self):
+        self.order_store.create('stop_sell', 'WSCN', 10, stop_price=99)
+        with app.test_client() as c:
+            headers = {'content-type': 'application/json'}
+            for data in ({'order_id': 1, 'amount': 5}, {'order_id': 1, 'price': 101}):
+                resp = c.post('/amend_order.do', headers=headers, data=json.dumps(data))
+                self.assertEqual(resp.status_code, 400, resp.data)
+                self.assertTrue('stop order' in json.loads(resp.data.decode())['message'])
+        self.assertEqual(self.queue.qsize(), 0)
+
     def test_cancel_order_with_order_not_found(self):
         with app.test_client() as c:
             data = json.dumps({
@@ -0,0 +1,78 @@
+from collections import OrderedDict
+import shutil
+import tempfile
+from unittest import TestCase
+
+from xtrade.archive import Archive, RetentionPolicy
+from xtrade.manager import MemTradeStore
+from xtrade.message_queue import LocalQueue
+from xtrade.order import MemOrderStore
+
+from helpers import new_manager
+
+
+class TestRetentionPolicy(TestCase):
+    def test_max_count(self):
+        finished = OrderedDict((i, 0) for i in range(5))
+        self.assertEqual(RetentionPolicy(max_count=2).expired(finished), [0, 1, 2])
+        self.assertEqual(list(finished), [3, 4])
+
+    def test_max_age(self):
+        now = [10]
+        policy = RetentionPolicy(max_age=5, clock=lambda: now[0])
+        finished = OrderedDict([(1, 1), (2, 5), (3, 9)])
+        self.assertEqual(policy.expired(finished), [1, 2])
+
+    def test_terminal_state(self):
+        finished = OrderedDict([(1, 1), (2, 5)])
+        self.assertEqual(RetentionPolicy().expired(finished), [1, 2])
+        self.assertEqual(finished, OrderedDict())
+
+
+class TestArchive(TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_put_and_get(self):
+        archive = Archive(self.path, segment_size=2)
+        archive.put('order', 1, {'id': 1})
+        self.assertEqual(archive.get('order', 1), {'id': 1})
+        archive.put('order', 2, {'id': 2})
+        archive.put('trades', 1, [{'id': 1}])
+        self.assertEqual(archive.get('order', 2), {'id': 2})
+        self.assertRaises(KeyError, archive.get, 'order', 3)
+        archive.close()
+
+        archive = Archive(self.path, segment_size=2)
+        self.assertEqual(archive.get('order', 1), {'id': 1})
+        self.assertEqual(archive.get('trades', 1), [{'id': 1}])
+        archive.put('order', 3, {'id': 3})
+        archive.put('order', 4, {'id': 4})
+        self.assertEqual(archive.get('order', 4), {'id': 4})
+        self.assertEqual(archive.get('order', 2), {'id': 2})
+
+    def test_stores_stay_bounded(self):
+        archive = Archive(self.path, segment_size=10)
+        order_store = MemOrderStore(RetentionPolicy(max_count=5), archive)
+        trade_store = MemTradeStore(RetentionPolicy(max_count=5), archive)
+        manager = new_manager(LocalQueue(), trade_store, order_store)
+        orders = []
+        for i in range(50):
+            orders.append(order_store.create('sell', 'WSCN', 10, price=100))
+            manager._process_order(orders[-1])
+            orders.append(order_store.create('buy', 'WSCN', 10, price=100))
+            manager._process_order(orders[-1])
+
+        self.assertEqual(len(order_store._data), 5)
+        self.assertEqual(len(trade_store._data), 5)
+        self.assertEqual(manager._order_map, {})
+        order = order_store.get(orders[0].id)
+        self.assertEqual(order.TYPE, 'sell')
+        self.assertEqual(order.price, 100)
+        self.assertEqual(order.timestamp, orders[0].timestamp)
+        trades = trade_store.get(orders[1].id)
+        self.assertEqual(len(trades), 1)
+        self.assertEqual(trades[0].status, 'all_done')
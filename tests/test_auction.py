@@ -0,0 +1,61 @@
+from unittest import TestCase
+
+from xtrade.auction import clearing_price
+from xtrade.event import AuctionEvent
+
+from helpers import new_manager, place_order
+
+
+class TestClearingPrice(TestCase):
+    def test_max_volume(self):
+        buys = {102: 5, 101: 10, 99: 10}
+        sells = {98: 4, 100: 8, 101: 6}
+        # demand at 100: 15, at 101: 15; supply at 100: 12, at 101: 18
+        self.assertEqual(clearing_price(buys, sells), (101, 15))
+
+    def test_imbalance_then_reference(self):
+        self.assertEqual(clearing_price({101: 10}, {99: 10}, reference_price=100), (100, 10))
+        self.assertEqual(clearing_price({101: 10}, {99: 10}, reference_price=103), (101, 10))
+        self.assertEqual(clearing_price({101: 10}, {99: 10}), (99, 10))
+
+    def test_market_orders(self):
+        self.assertEqual(clearing_price({}, {}, 5, 3, reference_price=100), (100, 3))
+        self.assertEqual(clearing_price({}, {100: 10}, market_buy=4), (100, 4))
+
+    def test_no_cross(self):
+        self.assertEqual(clearing_price({99: 10}, {100: 10}), (None, 0))
+        self.assertEqual(clearing_price({}, {}), (None, 0))
+
+
+class TestCallAuction(TestCase):
+    def setUp(self):
+        self.manager = new_manager()
+
+    def test_uncross(self):
+        self.manager.handle_event(AuctionEvent('WSCN', AuctionEvent.OPEN))
+        self.assertEqual(place_order(self.manager, 'sell', 5, 99).fills, [])
+        place_order(self.manager, 'sell', 10, 101)
+        place_order(self.manager, 'buy', 8, 102)
+        place_order(self.manager, 'buy', 4, 100)
+        place_order(self.manager, 'market_buy', 2)
+        self.assertEqual(place_order(self.manager, 'ioc_buy', 2, 105).canceled.status, 'all_cancel')
+        self.assertEqual(self.manager.snapshots.get('WSCN').bids, ((102, 8), (100, 4)))
+
+        report = self.manager.handle_event(AuctionEvent('WSCN', AuctionEvent.UNCROSS))
+        self.assertEqual((report.price, report.amount), (101, 10))
+        self.assertEqual({fill.price for fill in report.fills}, {101})
+        self.assertEqual(report.canceled, [])
+        snapshot = self.manager.snapshots.get('WSCN')
+        self.assertEqual((snapshot.bids, snapshot.asks, snapshot.last_price), (((100, 4),), ((101, 5),), 101))
+
+        # continuous matching again
+        self.assertEqual(place_order(self.manager, 'buy', 1, 101).amount, 1)
+
+    def test_market_orders_left_are_canceled(self):
+        self.manager.handle_event(AuctionEvent('WSCN', AuctionEvent.OPEN))
+        place_order(self.manager, 'market_sell', 5)
+        place_order(self.manager, 'buy', 3, 100)
+        report = self.manager.handle_event(AuctionEvent('WSCN', AuctionEvent.UNCROSS))
+        self.assertEqual((report.price, report.amount), (100, 3))
+        self.assertEqual([(t.status, t.amount) for t in report.canceled], [('left_cancel', 2)])
+        self.assertEqual(self.manager.resting_orders('WSCN', 'sell'), [])
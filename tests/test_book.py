@@ -0,0 +1,57 @@
+import json
+from unittest import TestCase
+
+from xtrade.app import app, install_book, uninstall_all
+from xtrade.event import CancelOrderEvent
+
+from helpers import new_manager, new_order
+
+
+class TestBookSnapshot(TestCase):
+    def setUp(self):
+        self.manager = new_manager()
+        install_book(self.manager.snapshots)
+
+    def tearDown(self):
+        uninstall_all()
+
+    def test_snapshot(self):
+        new_order(self.manager, 'sell', 10, 101)
+        new_order(self.manager, 'sell', 5, 101)
+        o3 = new_order(self.manager, 'sell', 10, 102)
+        new_order(self.manager, 'buy', 10, 99)
+        new_order(self.manager, 'buy', 10, 98)
+        new_order(self.manager, 'market_buy', 10)
+        before = self.manager.snapshots.get('WSCN')
+        self.assertEqual(before.bids, ((99, 10), (98, 10)))
+        self.assertEqual(before.asks, ((101, 5), (102, 10)))
+
+        new_order(self.manager, 'buy', 4, 102)
+        self.manager.handle_event(CancelOrderEvent(o3.id))
+        snapshot = self.manager.snapshots.get('WSCN')
+        self.assertEqual(snapshot.asks, ((101, 1),))
+        self.assertEqual(snapshot.last_price, 101)
+        self.assertTrue(snapshot.version > before.version)
+        # the snapshot taken before is left untouched
+        self.assertEqual(before.asks, ((101, 5), (102, 10)))
+
+    def test_endpoints(self):
+        new_order(self.manager, 'sell', 10, 101)
+        new_order(self.manager, 'sell', 10, 102)
+        new_order(self.manager, 'buy', 7, 100)
+        with app.test_client() as c:
+            resp = c.get('/depth?symbol=WSCN&levels=1')
+            self.assertEqual(resp.status_code, 200, resp.data)
+            resp_data = json.loads(resp.data.decode())
+            self.assertEqual(resp_data['bids'], [[100, 7]])
+            self.assertEqual(resp_data['asks'], [[101, 10]])
+
+            resp = c.get('/quote?symbol=WSCN')
+            resp_data = json.loads(resp.data.decode())
+            self.assertEqual((resp_data['bid'], resp_data['bid_amount']), (100, 7))
+            self.assertEqual((resp_data['ask'], resp_data['ask_amount']), (101, 10))
+
+            resp = c.get('/depth?symbol=XX')
+            self.assertEqual(resp.status_code, 400, resp.data)
+            resp = c.get('/depth?symbol=WSCN&levels=-1')
+            self.assertEqual(resp.status_code, 400, resp.data)
@@ -0,0 +1,76 @@
+import os
+import threading
+import time
+from unittest import TestCase
+
+from xtrade import columnar, partition
+from xtrade.clock import Sequencer, StepClock, WallClock, to_ns
+from xtrade.event import NewOrderEvent
+from xtrade.manager import MemTradeStore
+from xtrade.order import MemOrderStore
+
+from helpers import new_manager
+
+
+class StoppedClock(object):
+    def time_ns(self):
+        return 1000
+
+
+class TestSequencer(TestCase):
+    def test_gapless_and_monotonic(self):
+        sequencer = Sequencer(StoppedClock())
+        self.assertEqual([sequencer.next() for _ in range(3)], [(1, 1000), (2, 1001), (3, 1002)])
+        sequencer.advance(10, 2000)
+        self.assertEqual(sequencer.next(), (11, 2001))
+
+    def test_threads(self):
+        sequencer = Sequencer(StoppedClock())
+        results = []
+
+        def run():
+            results.extend(sequencer.next() for _ in range(1000))
+        threads = [threading.Thread(target=run) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(sorted(seq for seq, _ in results), list(range(1, 4001)))
+        self.assertEqual(len(set(timestamp for _, timestamp in results)), 4000)
+
+    def test_deterministic(self):
+        stamps = [[StepClock().sequencer.next() for _ in range(3)] for _ in range(2)]
+        self.assertEqual(stamps[0], stamps[1])
+
+    def test_priority_by_seq(self):
+        clock = StepClock()
+        store = MemOrderStore(clock=clock)
+        manager = new_manager(None, MemTradeStore(clock=clock), store, clock=clock)
+        orders = [store.create('sell', 'WSCN', 10, price=100) for _ in range(3)]
+        # priority follows the order the engine accepts them, not the one they were received
+        for order in reversed(orders):
+            manager.handle_event(NewOrderEvent(order.id))
+        self.assertEqual([order.seq for order in orders], [3, 2, 1])
+        self.assertEqual(manager.resting_orders('WSCN', 'sell'), orders[::-1])
+
+
+class TestWallClock(TestCase):
+    def setUp(self):
+        self.tz = os.environ.get('TZ')
+        os.environ['TZ'] = 'Asia/Shanghai'
+        time.tzset()
+
+    def tearDown(self):
+        if self.tz is None:
+            del os.environ['TZ']
+        else:
+            os.environ['TZ'] = self.tz
+        time.tzset()
+
+    def test_utc(self):
+        clock = WallClock()
+        self.assertTrue(abs(to_ns(clock.now()) - clock.time_ns()) < 10 ** 9)
+        # 2016-07-01 20:00 UTC, 2016-07-02 04:00 in Shanghai
+        timestamp = 1467403200 * 10 ** 9
+        self.assertEqual(columnar.get_day(timestamp), '20160701')
+        self.assertEqual(partition._day_of_ns(timestamp), '20160701')
@@ -0,0 +1,70 @@
+import shutil
+import tempfile
+from unittest import TestCase
+
+import numpy as np
+
+from xtrade.columnar import ColumnarTradeWriter, ColumnarTradeReader, STATUS_NAMES, get_day
+from xtrade.event import NewOrderEvent
+from xtrade.message_queue import LocalQueue
+from xtrade.order import MemOrderStore
+
+from helpers import new_manager
+
+
+DAY_NS = 86400 * 10 ** 9
+
+
+class TestColumnarArchive(TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_write_and_read(self):
+        start = 1700000000 * 10 ** 9
+        writer = ColumnarTradeWriter(self.root)
+        writer.write([(1, 10, 11, 'WSCN', 99.5, 10, start, 'all_done', 'partial_done'),
+                      (3, 12, 13, 'WSCN', 100.01, 20, start + 10, 'partial_done', 'all_done'),
+                      (5, 14, 15, 'MU', 10, 5, start + 20, 'all_done', 'all_done')])
+        writer.write([(7, 16, 17, 'WSCN', 101, 30, start + 30, 'all_done', 'all_done'),
+                      (9, 18, 19, 'WSCN', 102, 40, start + DAY_NS, 'all_done', 'all_done')])
+        writer.close()
+
+        reader = ColumnarTradeReader(self.root)
+        self.assertEqual(reader.days(), [get_day(start), get_day(start + DAY_NS)])
+        self.assertEqual(reader.symbols(get_day(start)), ['MU', 'WSCN'])
+
+        trades = reader.load(get_day(start), 'WSCN')
+        self.assertEqual(len(trades), 3)
+        self.assertTrue(isinstance(trades.price, np.memmap))
+        self.assertEqual(trades.price.tolist(), [9950, 10001, 10100])
+        self.assertEqual(trades.buy_status.tolist(), [2, 1, 2])
+        self.assertEqual(trades.sell_status.tolist(), [1, 2, 2])
+
+        sliced = trades.slice(start + 5, start + 30)
+        self.assertEqual(sliced.id.tolist(), [3])
+        self.assertTrue(np.shares_memory(sliced.amount, trades.amount))
+
+        days = list(reader.slice('WSCN', start + 10, start + DAY_NS + 1))
+        self.assertEqual([d.id.tolist() for d in days], [[3, 7], [9]])
+        self.assertEqual(list(reader.slice('XX')), [])
+
+    def test_manager_writes_fills(self):
+        order_store = MemOrderStore()
+        writer = ColumnarTradeWriter(self.root)
+        manager = new_manager(LocalQueue(), order_store=order_store, trade_archive=writer)
+        sell = order_store.create('sell', 'WSCN', 10, price=99.5)
+        manager.handle_event(NewOrderEvent(sell.id))
+        buy = order_store.create('buy', 'WSCN', 4, price=100)
+        manager.handle_event(NewOrderEvent(buy.id))
+
+        reader = ColumnarTradeReader(self.root)
+        trades = reader.load(reader.days()[0], 'WSCN')
+        self.assertEqual(trades.buy_order_id.tolist(), [buy.id])
+        self.assertEqual(trades.sell_order_id.tolist(), [sell.id])
+        self.assertEqual(trades.price.tolist(), [9950])
+        self.assertEqual(trades.amount.tolist(), [4])
+        self.assertEqual([STATUS_NAMES[s] for s in (trades.buy_status[0], trades.sell_status[0])],
+                         ['all_done', 'partial_done'])
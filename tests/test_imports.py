@@ -0,0 +1,41 @@
+import json
+import subprocess
+import sys
+from unittest import TestCase
+
+
+CORE_MODULES = ('xtrade.order', 'xtrade.manager', 'xtrade.event', 'xtrade.message_queue', 'xtrade.book',
+                'xtrade.account', 'xtrade.replay', 'xtrade.replication', 'xtrade.simulation', 'xtrade.partition')
+OPTIONAL_MODULES = ('flask', 'flask_sqlalchemy', 'sqlalchemy', 'numpy')
+IMPORT_BUDGET = 1.0  # seconds, a cold import of the core takes a few tens of milliseconds
+
+SCRIPT = '''
+import json, sys, time
+start = time.perf_counter()
+for name in %r:
+    __import__(name)
+elapsed = time.perf_counter() - start
+print(json.dumps({'elapsed': elapsed, 'loaded': [name for name in %r if name in sys.modules]}))
+''' % (CORE_MODULES, OPTIONAL_MODULES)
+
+
+class TestCoreImport(TestCase):
+    def _import_core(self):
+        # a fresh interpreter, nothing imported yet
+        output = subprocess.check_output([sys.executable, '-c', SCRIPT])
+        return json.loads(output.decode())
+
+    def test_core_without_optional_layers(self):
+        self.assertEqual(self._import_core()['loaded'], [])
+
+    def test_cold_import_time(self):
+        elapsed = min(self._import_core()['elapsed'] for _ in range(3))
+        self.assertLess(elapsed, IMPORT_BUDGET)
+
+    def test_db_stores_loaded_on_demand(self):
+        from xtrade import dbstore, manager, order, account
+        self.assertTrue(order.DBOrderStore is dbstore.DBOrderStore)
+        self.assertTrue(manager.DBTradeStore is dbstore.DBTradeStore)
+        self.assertTrue(account.DBLedgerStore is dbstore.DBLedgerStore)
+        with self.assertRaises(AttributeError):
+            order.NoSuchStore
@@ -1,10 +1,11 @@
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 import heapq
 from unittest import TestCase
 
 from xtrade.app import app
 from xtrade.db import db
-from xtrade.order import MemOrderStore, DBOrderStore
+from xtrade.exc import InvalidRequest
+from xtrade.order import MemOrderStore, DBOrderStore, get_expire_at
 
 
 class TestOrder(TestCase):
@@ -23,15 +24,16 @@ class TestOrder(TestCase):
         self.assertTrue(buy_order.can_buy(sell_order))
 
     def test_sort(self):
-        now = datetime.now()
         queue = []
 
         o1 = self.store.create('sell', 'mu', 10, price=100)
-        o1.timestamp = now.replace(year=2000)
         o2 = self.store.create('sell', 'mu', 10, price=100)
         o3 = self.store.create('sell', 'mu', 10, price=101)
         o4 = self.store.create('market_sell', 'mu', 10)
         o5 = self.store.create('market_sell', 'mu', 10)
+        # accepted by the engine in another order than received
+        for seq, order in enumerate((o2, o1, o3, o4, o5), 1):
+            order.seq = seq
         heapq.heappush(queue, o1)
         heapq.heappush(queue, o2)
         heapq.heappush(queue, o3)
@@ -39,10 +41,34 @@ class TestOrder(TestCase):
         heapq.heappush(queue, o5)
         self.assertEqual(heapq.heappop(queue), o4)
         self.assertEqual(heapq.heappop(queue), o5)
-        self.assertEqual(heapq.heappop(queue), o1)
         self.assertEqual(heapq.heappop(queue), o2)
+        self.assertEqual(heapq.heappop(queue), o1)
         self.assertEqual(heapq.heappop(queue), o3)
 
+    def test_sort_buy_orders(self):
+        queue = []
+
+        o1 = self.store.create('buy', 'mu', 10, price=100)
+        o2 = self.store.create('buy', 'mu', 10, price=100)
+        o3 = self.store.create('buy', 'mu', 10, price=101)
+        o4 = self.store.create('buy', 'mu', 10, price=99)
+        o5 = self.store.create('market_buy', 'mu', 10)
+        for seq, order in enumerate((o2, o1, o3, o4, o5), 1):
+            order.seq = seq
+            heapq.heappush(queue, order)
+        self.assertEqual([heapq.heappop(queue) for _ in range(5)], [o5, o3, o2, o1, o4])
+
+    def test_expire_at(self):
+        now = datetime(2016, 7, 1, 15, 30)
+        self.assertEqual(get_expire_at('GTC', now), None)
+        self.assertEqual(get_expire_at('DAY', now), datetime(2016, 7, 2))
+        self.assertEqual(get_expire_at('GTD', now, datetime(2016, 7, 5)), datetime(2016, 7, 5))
+        shanghai = timezone(timedelta(hours=8))
+        self.assertEqual(get_expire_at('GTD', now, datetime(2016, 7, 2, 8, tzinfo=shanghai)), datetime(2016, 7, 2))
+        for args in (('GTD',), ('GTD', datetime(2016, 7, 1)), ('IOC',)):
+            with self.assertRaises(InvalidRequest):
+                get_expire_at(args[0], now, *args[1:])
+
 
 class TestDBOrderStore(TestCase):
     def setUp(self):
@@ -69,6 +95,7 @@ class TestDBOrderStore(TestCase):
         self.assertEqual(order.symbol, 'mu')
         self.assertEqual(order.amount, 10)
         self.assertEqual(order.price, 100)
+        self.assertEqual(order.expire_at, None)
 
         # order id should be increased
         another_order = store.create('sell', symbol='mu', amount=10, price=100)
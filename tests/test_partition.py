@@ -0,0 +1,88 @@
+from datetime import datetime, timedelta
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from xtrade.clock import StepClock
+from xtrade.event import CancelOrderEvent
+from xtrade.partition import Partitions, PartitionedOrderStore, PartitionedTradeStore, PartitionError
+from xtrade.order import OrderNotFound
+
+from helpers import new_manager, new_order
+
+
+class TestPartitions(TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.clock = StepClock(datetime(2016, 7, 1, 23, 59, 50), timedelta(seconds=1))
+        self._open()
+
+    def tearDown(self):
+        self.partitions.close()
+        shutil.rmtree(self.path)
+
+    def _open(self):
+        self.partitions = Partitions(os.path.join(self.path, 'days'))
+        self.order_store = PartitionedOrderStore(self.partitions, self.clock)
+        self.trade_store = PartitionedTradeStore(self.partitions, self.clock)
+        self.manager = new_manager(None, self.trade_store, self.order_store, clock=self.clock)
+
+    def test_route_by_day(self):
+        sell = new_order(self.manager, 'sell', 10, 100)
+        while self.clock.now() < datetime(2016, 7, 2):
+            pass
+        buy = new_order(self.manager, 'buy', 4, 100)
+        self.assertEqual(self.partitions.days, ['20160701', '20160702'])
+        self.assertEqual(self.partitions.order_day(sell.id), '20160701')
+        self.assertEqual(self.partitions.order_day(buy.id), '20160702')
+
+        order = self.order_store.get(sell.id)
+        self.assertEqual((order.TYPE, order.amount, order.price, order.timestamp),
+                         ('sell', 10, 100, sell.timestamp))
+        # the seq given by the engine is saved with the order
+        self.assertEqual((order.seq, self.order_store.get(buy.id).seq), (sell.seq, buy.seq))
+        self.assertTrue(sell.seq < buy.seq)
+        self.assertEqual([(t.status, t.amount, t.symbol) for t in self.trade_store.get(sell.id)],
+                         [('partial_done', 4, 'WSCN')])
+        with self.assertRaises(OrderNotFound):
+            self.order_store.get(100)
+
+        # ids and routing survive a restart
+        self.partitions.close()
+        self._open()
+        self.assertEqual(self.order_store.get(buy.id).amount, 4)
+        self.assertEqual(self.order_store.create('sell', 'WSCN', 1, 100).id, buy.id + 1)
+
+    def test_range_queries(self):
+        for price in (99, 100, 101):
+            new_order(self.manager, 'sell', 1, price)
+        new_order(self.manager, 'buy', 3, 101)
+        trades = self.trade_store.trades('WSCN', datetime(2016, 7, 1), datetime(2016, 7, 3))
+        self.assertEqual([t.price for t in trades], [99, 99, 100, 100, 101, 101])
+        orders = self.order_store.orders('WSCN', datetime(2016, 7, 1), datetime(2016, 7, 1, 23, 59, 52))
+        self.assertEqual([o.price for o in orders], [99])
+        self.assertEqual(self.trade_store.trades('OTHER', datetime(2016, 7, 1), datetime(2016, 7, 3)), [])
+
+    def test_detach_and_compact_cold_days(self):
+        old = new_order(self.manager, 'sell', 10, 100)
+        while self.clock.now() < datetime(2016, 7, 2):
+            pass
+        new_order(self.manager, 'sell', 10, 101)
+        with self.assertRaises(PartitionError):
+            self.partitions.compact('20160702')
+        with self.assertRaises(PartitionError):
+            self.partitions.detach('20160702', os.path.join(self.path, 'cold'))
+        self.partitions.compact('20160701')
+        with self.assertRaises(PartitionError):
+            self.partitions.detach('20160701', os.path.join(self.path, 'cold'))
+        self.assertEqual(self.partitions.unfinished_orders('20160701'), [old.id])
+        self.manager.handle_event(CancelOrderEvent(old.id))
+        self.assertEqual(self.partitions.unfinished_orders('20160701'), [])
+
+        path = self.partitions.detach('20160701', os.path.join(self.path, 'cold'))
+        self.assertEqual(self.partitions.days, ['20160702'])
+        with self.assertRaises(OrderNotFound):
+            self.order_store.get(old.id)
+        self.partitions.attach(path)
+        self.assertEqual(self.order_store.get(old.id).price, 100)
@@ -0,0 +1,75 @@
+import json
+import threading
+import time
+from unittest import TestCase
+
+from xtrade.app import app, install_profiler, uninstall_all
+from xtrade.event import NewOrderEvent
+from xtrade.message_queue import LocalQueue
+from xtrade.order import MemOrderStore
+from xtrade.profiling import EngineProfiler, EventTrace
+
+from helpers import new_manager, place_order
+
+
+class TestEngineProfiler(TestCase):
+    def setUp(self):
+        self.queue = LocalQueue()
+        self.order_store = MemOrderStore()
+        self.profiler = EngineProfiler()
+        self.manager = new_manager(self.queue, order_store=self.order_store, timeout=0.05, profiler=self.profiler)
+        self.manager.start()
+
+    def tearDown(self):
+        uninstall_all()
+
+    def _feed(self, count):
+        def feed():
+            for i in range(count):
+                order = self.order_store.create('sell' if i % 2 else 'buy', 'WSCN', 10, price=100)
+                self.queue.put(NewOrderEvent(order.id))
+                time.sleep(0.002)
+        thread = threading.Thread(target=feed)
+        thread.start()
+        return thread
+
+    def test_deterministic(self):
+        feeder = self._feed(50)
+        report = self.profiler.profile('deterministic', 0.2)
+        feeder.join()
+        self.assertTrue('_process_order' in report, report)
+
+    def test_sampling(self):
+        report = self.profiler.profile('sampling', 0.1)
+        self.assertTrue('manager.py:run' in report, report)
+
+    def test_profile_endpoint(self):
+        install_profiler(self.profiler)
+        with app.test_client() as c:
+            data = json.dumps({'mode': 'sampling', 'duration': 0.05})
+            resp = c.post('/admin/profile.do', data=data)
+            self.assertEqual(resp.status_code, 200, resp.data)
+            self.assertTrue(b'manager.py:run' in resp.data, resp.data)
+
+            data = json.dumps({'mode': 'sampling', 'duration': 1000})
+            resp = c.post('/admin/profile.do', data=data)
+            self.assertEqual(resp.status_code, 400, resp.data)
+
+
+class TestSlowEventTrace(TestCase):
+    def test_trace(self):
+        trace = EventTrace('event')
+        trace.mark('lookup')
+        trace.mark('matching')
+        trace.mark('lookup')
+        self.assertEqual(list(trace.phases), ['lookup', 'matching'])
+        self.assertAlmostEqual(sum(trace.phases.values()), trace.total)
+
+    def test_slow_event_logged(self):
+        manager = new_manager(slow_event_threshold=0)
+        place_order(manager, 'sell', 10, 100)
+        with self.assertLogs('xtrade.manager', 'WARNING') as cm:
+            place_order(manager, 'buy', 10, 100)
+        self.assertTrue('NewOrderEvent<2>' in cm.output[0], cm.output)
+        for phase in ('lookup', 'matching', 'persistence', 'logging'):
+            self.assertTrue(phase in cm.output[0], cm.output)
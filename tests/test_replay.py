@@ -0,0 +1,50 @@
+import io
+import json
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from xtrade.replay import Replayer, replay_file
+
+
+RECORDS = [
+    {'type': 'sell', 'symbol': 'WSCN', 'amount': 10, 'price': 100},
+    {'type': 'buy', 'symbol': 'WSCN', 'amount': 10, 'price': 90},
+    {'type': 'sell', 'symbol': 'WSCN', 'amount': 20, 'price': 95},
+    {'action': 'order', 'type': 'buy', 'symbol': 'WSCN', 'amount': 10, 'price': 96},
+    {'type': 'ioc_buy', 'symbol': 'WSCN', 'amount': 20, 'price': 100},
+    {'action': 'cancel', 'order_id': 2},
+]
+
+
+class TestReplay(TestCase):
+    def test_replay(self):
+        replayer = Replayer()
+        trades = list(replayer.replay(RECORDS))
+        self.assertEqual([(t.order_id, t.amount, t.status) for t in trades], [
+            (4, 10, 'all_done'), (3, 10, 'partial_done'),
+            (5, 10, 'partial_done'), (3, 10, 'all_done'),
+            (5, 10, 'all_done'), (1, 10, 'all_done'),
+            (2, 10, 'all_cancel'),
+        ])
+        self.assertEqual(replayer.book(), {'WSCN': {'buy': [], 'sell': []}})
+
+    def test_replay_file_is_deterministic(self):
+        path = tempfile.mkdtemp()
+        try:
+            input_file = os.path.join(path, 'orders.jsonl')
+            with open(input_file, 'w') as f:
+                for record in RECORDS[:3]:
+                    f.write(json.dumps(record) + '\n')
+            outputs = []
+            for _ in range(2):
+                output = io.StringIO()
+                replay_file(input_file, output)
+                outputs.append(output.getvalue())
+            self.assertEqual(outputs[0], outputs[1])
+            book = json.loads(outputs[0].splitlines()[-1])['book']
+            self.assertEqual([o['id'] for o in book['WSCN']['sell']], [3, 1])
+            self.assertEqual([o['id'] for o in book['WSCN']['buy']], [2])
+        finally:
+            shutil.rmtree(path)
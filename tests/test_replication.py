@@ -0,0 +1,131 @@
+from datetime import datetime, timedelta
+import time
+from unittest import TestCase
+
+from xtrade.clock import StepClock
+from xtrade.event import NewOrderEvent, CancelOrderEvent, decode_event
+from xtrade.manager import MemTradeStore
+from xtrade.message_queue import LocalQueue
+from xtrade.order import MemOrderStore, encode_order
+from xtrade.replication import ReplicationPublisher, Replica
+
+from helpers import new_manager, new_order
+
+
+def book(manager):
+    return [[encode_order(o) for o in manager.resting_orders('WSCN', side)] for side in ('buy', 'sell')]
+
+
+class TestEventEncoding(TestCase):
+    def test_encode_and_decode(self):
+        event = decode_event(CancelOrderEvent(3).encode())
+        self.assertTrue(isinstance(event, CancelOrderEvent))
+        self.assertEqual(event.order_id, 3)
+
+
+class TestReplication(TestCase):
+    def setUp(self):
+        self.publisher = ReplicationPublisher()
+        self.order_store = MemOrderStore()
+        self.manager = new_manager(order_store=self.order_store, replicator=self.publisher)
+
+    def tearDown(self):
+        self.publisher.close()
+
+    def test_replica_follows_and_takes_over(self):
+        o1 = new_order(self.manager, 'sell', 10, 100)
+        # a replica connecting late is sent the events it missed
+        replica = Replica(self.publisher.address)
+        replica.start()
+        new_order(self.manager, 'buy', 10, 95)
+        new_order(self.manager, 'buy', 5, 100)
+        o4 = new_order(self.manager, 'sell', 20, 101)
+        self.manager.handle_event(CancelOrderEvent(o4.id))
+        new_order(self.manager, 'buy', 30, 96)
+        self.assertTrue(self.publisher.wait_for_ack(self.publisher.seq, timeout=5))
+        self.assertEqual(replica.seq, 6)
+        self.assertEqual(book(replica.manager), book(self.manager))
+        self.assertEqual(replica.trade_store.get(o1.id)[0].amount, 5)
+
+        queue = LocalQueue()
+        manager = replica.promote(queue)
+        order = replica.order_store.create('sell', 'WSCN', 5, 96)
+        self.assertEqual(order.id, 6)
+        queue.put(NewOrderEvent(order.id))
+        time.sleep(0.1)
+        self.assertEqual(replica.trade_store.get(order.id)[0].status, 'all_done')
+        self.assertEqual(manager.resting_orders('WSCN', 'buy')[0].amount, 25)
+
+    def test_two_replicas(self):
+        replicas = [Replica(self.publisher.address) for _ in range(2)]
+        for replica in replicas:
+            replica.start()
+        new_order(self.manager, 'sell', 10, 100)
+        new_order(self.manager, 'buy', 4, 100)
+        self.assertTrue(self.publisher.wait_for_ack(2, replicas=2, timeout=5))
+        for replica in replicas:
+            self.assertEqual(book(replica.manager), book(self.manager))
+
+    def test_replica_follows_the_seq_of_the_primary(self):
+        orders = [self.order_store.create('sell', 'WSCN', 10, 100) for _ in range(3)]
+        replica = Replica(self.publisher.address, clock=StepClock(datetime(2020, 1, 1)))
+        replica.start()
+        for order in reversed(orders):
+            self.manager.handle_event(NewOrderEvent(order.id))
+        self.assertTrue(self.publisher.wait_for_ack(self.publisher.seq, timeout=5))
+        self.assertEqual([o.id for o in replica.manager.resting_orders('WSCN', 'sell')],
+                         [o.id for o in reversed(orders)])
+        self.assertEqual(book(replica.manager), book(self.manager))
+
+    def test_expiry_comes_from_the_primary(self):
+        clock = StepClock(datetime(2016, 7, 1, 15), timedelta(seconds=1))
+        order_store = MemOrderStore(clock=clock)
+        manager = new_manager(None, MemTradeStore(clock=clock), order_store, clock=clock, replicator=self.publisher)
+        # far ahead of the primary: all the orders are due by its own clock
+        replica = Replica(self.publisher.address, clock=StepClock(datetime(2030, 1, 1)))
+        replica.start()
+        order = order_store.create('sell', 'WSCN', 10, 100, expire_at=datetime(2016, 7, 1, 15, 0, 10))
+        manager.handle_event(NewOrderEvent(order.id))
+        manager.handle_event(CancelOrderEvent(100))
+        self.assertTrue(self.publisher.wait_for_ack(self.publisher.seq, timeout=5))
+        self.assertEqual(book(replica.manager), book(manager))
+
+        while clock.now() < datetime(2016, 7, 1, 15, 0, 10):
+            pass
+        manager.handle_event('timeout')
+        self.assertTrue(self.publisher.wait_for_ack(self.publisher.seq, timeout=5))
+        self.assertEqual(book(manager), [[], []])
+        self.assertEqual(book(replica.manager), book(manager))
+        self.assertEqual(replica.trade_store.get(order.id)[-1].status, 'all_cancel')
+
+    def test_late_replica_starts_from_a_snapshot(self):
+        self.publisher.journal_size = 2
+        new_order(self.manager, 'sell', 10, 100)
+        new_order(self.manager, 'buy', 4, 100)
+        stop = self.order_store.create('stop_sell', 'WSCN', 5, None, 99)
+        self.manager.handle_event(NewOrderEvent(stop.id))
+        new_order(self.manager, 'buy', 10, 98)
+        new_order(self.manager, 'sell', 10, 101)
+        self.assertTrue(len(self.publisher._journal) <= 2)
+        replica = Replica(self.publisher.address)
+        replica.start()
+        self.assertTrue(self.publisher.wait_for_ack(self.publisher.seq, timeout=5))
+        self.assertEqual(book(replica.manager), book(self.manager))
+
+        # the stop order is triggered on both sides
+        new_order(self.manager, 'buy', 1, 99)
+        new_order(self.manager, 'sell', 1, 99)
+        self.assertTrue(self.publisher.wait_for_ack(self.publisher.seq, timeout=5))
+        self.assertEqual(book(replica.manager), book(self.manager))
+        self.assertEqual([t.status for t in replica.trade_store.get(stop.id)], ['all_done'])
+
+    def test_replica_reconnects(self):
+        replica = Replica(self.publisher.address, retry_interval=0.01)
+        replica.start()
+        new_order(self.manager, 'sell', 10, 100)
+        self.assertTrue(self.publisher.wait_for_ack(1, timeout=5))
+        for connection in self.publisher._connections:
+            connection.send(b'not json\n')
+        new_order(self.manager, 'buy', 4, 100)
+        self.assertTrue(self.publisher.wait_for_ack(2, timeout=5))
+        self.assertEqual(book(replica.manager), book(self.manager))
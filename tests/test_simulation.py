@@ -0,0 +1,28 @@
+from unittest import TestCase
+
+from xtrade.simulation import Scenario, Simulator, InvariantError, run_scenario, run_simulation
+
+
+class TestSimulation(TestCase):
+    def test_scenario_is_reproducible(self):
+        self.assertEqual(list(Scenario(7, orders=50).generate()), list(Scenario(7, orders=50).generate()))
+        self.assertNotEqual(list(Scenario(7, orders=50).generate()), list(Scenario(8, orders=50).generate()))
+
+    def test_run_scenario(self):
+        result = run_scenario(Scenario(1, orders=200))
+        self.assertEqual(result['error'], None)
+        self.assertTrue(result['fills'] > 0)
+
+    def test_crossed_book_detected(self):
+        simulator = Simulator(Scenario(1))
+        buy = simulator.order_store.create('buy', 'WSCN', 10, price=100)
+        sell = simulator.order_store.create('sell', 'WSCN', 10, price=99)
+        simulator.manager._add_order(buy)
+        simulator.manager._add_order(sell)
+        self.assertRaises(InvariantError, simulator.check_book)
+
+    def test_run_simulation(self):
+        summary = run_simulation([Scenario(seed, orders=100) for seed in range(4)], workers=2)
+        self.assertEqual(summary['scenarios'], 4)
+        self.assertEqual(summary['orders'], 400)
+        self.assertEqual(summary['failures'], [])
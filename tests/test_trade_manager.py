@@ -1,12 +1,17 @@
+from datetime import datetime, timedelta
 import time
 from unittest import TestCase
 
-from xtrade.manager import TradeManager, Trade, MemTradeStore, DBTradeStore
+from xtrade.manager import TradeManager, Trade, MemTradeStore, DBTradeStore, Fill
+from xtrade.clock import StepClock
 from xtrade.message_queue import LocalQueue
-from xtrade.event import NewOrderEvent, CancelOrderEvent
+from xtrade.event import NewOrderEvent, CancelOrderEvent, AmendOrderEvent, MassCancelEvent, AuctionEvent
 from xtrade.order import MemOrderStore as OrderStore, BuyOrder, SellOrder
 from xtrade.app import app
-from xtrade.db import db
+from xtrade.db import db, OrderModel
+from xtrade.dbstore import DBOrderStore
+
+from helpers import new_manager, new_order, place_order
 
 import logging
 logging.basicConfig(level=logging.DEBUG)
@@ -35,6 +40,28 @@ class TestDBTradeStore(TestCase):
         self.assertEqual(trade.id, 2)
         self.assertEqual(trade.status, 'all_done')
 
+    def test_do_trades(self):
+        store = DBTradeStore(db)
+        buy_order = BuyOrder(1, 'mu', 100, timestamp='', price=10)
+        fills = [
+            Fill(buy_order, SellOrder(2, 'mu', 30, timestamp='', price=9), 9, 30, 70, 0),
+            Fill(buy_order, SellOrder(3, 'mu', 80, timestamp='', price=10), 10, 70, 0, 10),
+        ]
+        trades = store.do_trades(fills)
+        self.assertEqual([t.id for t in trades], [1, 2, 3, 4])
+        self.assertEqual([t.status for t in trades],
+                         ['partial_done', 'all_done', 'all_done', 'partial_done'])
+        self.assertEqual(len(store.get(1)), 2)
+        self.assertEqual(store.next_id, 5)
+
+    def test_order_seq_saved(self):
+        order_store = DBOrderStore(db)
+        manager = new_manager(None, DBTradeStore(db), order_store)
+        sell = new_order(manager, 'sell', 10, 100)
+        buy = new_order(manager, 'buy', 4, 100)
+        self.assertEqual([order_store.get(o.id).seq for o in (sell, buy)], [sell.seq, buy.seq])
+        self.assertEqual(db.session.query(OrderModel).filter(OrderModel.seq.is_(None)).count(), 0)
+
 
 class TestTradeManager(TestCase):
     def setUp(self):
@@ -87,3 +114,282 @@ class TestTradeManager(TestCase):
         self.assertEqual(len(trades), 2)
         self.assertEqual(trades[0].status, 'partial_done')
         self.assertEqual(trades[1].status, 'left_cancel')
+
+
+class TestImmediateOrders(TestCase):
+    def setUp(self):
+        self.queue = LocalQueue()
+        self.trade_store = MemTradeStore()
+        self.order_store = OrderStore()
+        self.manager = new_manager(self.queue, self.trade_store, self.order_store)
+        self.manager.start()
+
+    def _put_orders(self, *orders):
+        for order in orders:
+            self.queue.put(NewOrderEvent(order.id))
+        time.sleep(0.1)
+
+    def test_ioc(self):
+        o1 = self.order_store.create('sell', 'WSCN', 10, price=95)
+        o2 = self.order_store.create('sell', 'WSCN', 10, price=101)
+        o3 = self.order_store.create('ioc_buy', 'WSCN', 15, price=100)
+        self._put_orders(o1, o2, o3)
+
+        trades = self.trade_store.get(o3.id)
+        self.assertEqual(len(trades), 2)
+        self.assertEqual(trades[0].amount, 10)
+        self.assertEqual(trades[0].status, 'partial_done')
+        self.assertEqual(trades[1].amount, 5)
+        self.assertEqual(trades[1].status, 'left_cancel')
+        self.assertEqual(self.trade_store.get(o2.id), [])
+        self.assertFalse(o3.id in self.manager._order_map)
+        self.assertEqual(self.manager._buy_queue_map['WSCN'], [])
+
+    def test_fok(self):
+        o1 = self.order_store.create('buy', 'WSCN', 10, price=100)
+        o2 = self.order_store.create('buy', 'WSCN', 10, price=95)
+        o3 = self.order_store.create('fok_sell', 'WSCN', 15, price=99)
+        self._put_orders(o1, o2, o3)
+
+        trades = self.trade_store.get(o3.id)
+        self.assertEqual(len(trades), 1)
+        self.assertEqual(trades[0].status, 'all_cancel')
+        self.assertEqual(self.trade_store.get(o1.id), [])
+
+        o4 = self.order_store.create('fok_sell', 'WSCN', 15, price=95)
+        self._put_orders(o4)
+        trades = self.trade_store.get(o4.id)
+        self.assertEqual([t.amount for t in trades], [10, 5])
+        self.assertEqual(trades[-1].status, 'all_done')
+        self.assertEqual(self.trade_store.get(o1.id)[0].status, 'all_done')
+        self.assertEqual(self.trade_store.get(o2.id)[0].status, 'partial_done')
+
+    def test_fok_buy_counts_the_crossing_levels_only(self):
+        orders = [self.order_store.create('sell', 'WSCN', 5, price=price) for price in (103, 101, 100, 101)]
+        fok = self.order_store.create('fok_buy', 'WSCN', 16, price=101)
+        self._put_orders(*(orders + [fok]))
+        self.assertEqual(self.trade_store.get(fok.id)[-1].status, 'all_cancel')
+
+        fok = self.order_store.create('fok_buy', 'WSCN', 15, price=101)
+        self._put_orders(fok)
+        self.assertEqual([t.amount for t in self.trade_store.get(fok.id)], [5, 5, 5])
+        self.assertEqual(self.manager._levels['WSCN'][1], {103: 5})
+
+    def test_market_order_left_is_canceled(self):
+        market = self.order_store.create('market_sell', 'WSCN', 10)
+        buy = self.order_store.create('buy', 'WSCN', 4, price=100)
+        self._put_orders(buy, market)
+        self.assertEqual([t.status for t in self.trade_store.get(market.id)], ['partial_done', 'left_cancel'])
+        self.assertEqual(self.manager.resting_orders('WSCN', 'sell'), [])
+        self.assertEqual(self.manager._market_amounts.get('WSCN', [0, 0]), [0, 0])
+
+    def test_fok_counts_the_market_orders_of_an_auction(self):
+        self.queue.put(AuctionEvent('WSCN', AuctionEvent.OPEN))
+        market = self.order_store.create('market_sell', 'WSCN', 10)
+        sell = self.order_store.create('sell', 'WSCN', 5, price=101)
+        self._put_orders(market, sell)
+        self.assertEqual([o.id for o in self.manager.resting_orders('WSCN', 'sell')], [market.id, sell.id])
+        fok = self.order_store.make('fok_buy', 'WSCN', 12, price=100)
+        self.assertEqual(self.manager._available_amount(fok), 10)
+        fok = self.order_store.make('fok_buy', 'WSCN', 12, price=101)
+        self.assertEqual(self.manager._available_amount(fok), 15)
+
+
+class CountingTradeStore(MemTradeStore):
+    def __init__(self):
+        super().__init__()
+        self.batches = 0
+
+    def _save_all(self, trades):
+        self.batches += 1
+        super()._save_all(trades)
+
+
+class TestSweep(TestCase):
+    def setUp(self):
+        self.trade_store = CountingTradeStore()
+        self.order_store = OrderStore()
+        self.manager = new_manager(LocalQueue(), self.trade_store, self.order_store)
+
+    def test_sweep_is_one_batch(self):
+        sells = [self.order_store.create('sell', 'WSCN', 10, price=95 + i) for i in range(5)]
+        for order in sells:
+            self.manager._process_order(order)
+        buy = self.order_store.create('buy', 'WSCN', 45, price=100)
+        report = self.manager._process_order(buy)
+
+        self.assertEqual(self.trade_store.batches, 1)
+        self.assertEqual([f.price for f in report.fills], [95, 96, 97, 98, 99])
+        self.assertEqual(report.amount, 45)
+        self.assertEqual(len(report.trades), 10)
+        trades = self.trade_store.get(buy.id)
+        self.assertEqual(trades[-1].status, 'all_done')
+        self.assertTrue(all(t.status == 'partial_done' for t in trades[:-1]))
+        self.assertEqual(self.trade_store.get(sells[-1].id)[0].status, 'partial_done')
+        self.assertEqual(self.manager._order_map[sells[-1].id].amount, 5)
+        self.assertFalse(buy.id in self.manager._order_map)
+
+
+class TestAmendOrder(TestCase):
+    def setUp(self):
+        self.trade_store = MemTradeStore()
+        self.order_store = OrderStore()
+        self.manager = new_manager(None, self.trade_store, self.order_store)
+
+    def test_reduce_keeps_priority(self):
+        o1 = new_order(self.manager, 'sell', 10, 100)
+        o2 = new_order(self.manager, 'sell', 10, 100)
+        trade = self.manager.handle_event(AmendOrderEvent(o1.id, amount=4))
+        self.assertEqual(trade.status, 'amended')
+        self.assertEqual(trade.amount, 4)
+        self.assertEqual([(o.id, o.amount) for o in self.manager.resting_orders('WSCN', 'sell')],
+                         [(o1.id, 4), (o2.id, 10)])
+        self.assertEqual(self.manager.snapshots.get('WSCN').asks, ((100, 14),))
+
+        buy = new_order(self.manager, 'buy', 6, 100)
+        self.assertEqual([t.amount for t in self.trade_store.get(o1.id)], [4, 4])
+        self.assertEqual(self.trade_store.get(o1.id)[-1].status, 'all_done')
+        self.assertEqual(self.trade_store.get(o2.id)[-1].amount, 2)
+        self.assertEqual(self.trade_store.get(buy.id)[-1].status, 'all_done')
+
+    def test_change_price_requeues(self):
+        o1 = new_order(self.manager, 'sell', 10, 100)
+        o2 = new_order(self.manager, 'sell', 10, 100)
+        self.manager.handle_event(AmendOrderEvent(o1.id, price=101))
+        self.manager.handle_event(AmendOrderEvent(o2.id, amount=20))
+        self.assertEqual([(o.id, o.amount, o.price) for o in self.manager.resting_orders('WSCN', 'sell')],
+                         [(o2.id, 20, 100), (o1.id, 10, 101)])
+
+        buy = new_order(self.manager, 'buy', 5, 99)
+        self.manager.handle_event(AmendOrderEvent(o1.id, price=99))
+        trades = self.trade_store.get(o1.id)
+        self.assertEqual([t.status for t in trades], ['amended', 'amended', 'partial_done'])
+        self.assertEqual(self.trade_store.get(buy.id)[0].status, 'all_done')
+        self.assertEqual(self.manager.snapshots.get('WSCN').asks, ((99, 5), (100, 20)))
+
+    def test_cancel_after_fill_and_increase(self):
+        o1 = new_order(self.manager, 'sell', 10, 100)
+        new_order(self.manager, 'buy', 4, 100)
+        self.manager.handle_event(AmendOrderEvent(o1.id, amount=20))
+        trade = self.manager.handle_event(CancelOrderEvent(o1.id))
+        self.assertEqual((trade.status, trade.amount), ('left_cancel', 20))
+
+    def test_amend_finished_order(self):
+        o1 = new_order(self.manager, 'sell', 10, 100)
+        self.manager.handle_event(CancelOrderEvent(o1.id))
+        self.assertEqual(self.manager.handle_event(AmendOrderEvent(o1.id, amount=5)), None)
+
+
+class TestStopOrders(TestCase):
+    def setUp(self):
+        self.trade_store = MemTradeStore()
+        self.order_store = OrderStore()
+        self.manager = new_manager(None, self.trade_store, self.order_store)
+
+    def test_stop_waits_for_trigger(self):
+        place_order(self.manager, 'buy', 10, 98)
+        report = place_order(self.manager, 'stop_sell', 5, stop_price=99)
+        self.assertEqual(report.trades, [])
+        self.assertEqual(self.manager.snapshots.get('WSCN').bids, ((98, 10),))
+
+        place_order(self.manager, 'buy', 1, 100)
+        report = place_order(self.manager, 'sell', 1, 100)
+        self.assertEqual(report.triggered, [])
+
+        report = place_order(self.manager, 'sell', 1, 98)
+        self.assertEqual(len(report.triggered), 1)
+        triggered = report.triggered[0]
+        self.assertEqual(triggered.order.TYPE, 'market_sell')
+        self.assertEqual([(t.amount, t.price) for t in triggered.trades if t.order_id == triggered.order.id],
+                         [(5, 98)])
+        self.assertEqual(self.manager.snapshots.get('WSCN').bids, ((98, 4),))
+
+    def test_stop_limit_rests_after_trigger(self):
+        stop = self.order_store.create('stop_limit_buy', 'WSCN', 5, 103, 101)
+        self.manager.handle_event(NewOrderEvent(stop.id))
+        place_order(self.manager, 'sell', 1, 101)
+        report = place_order(self.manager, 'buy', 1, 101)
+        self.assertEqual([r.order.id for r in report.triggered], [stop.id])
+        self.assertEqual(self.manager.snapshots.get('WSCN').bids, ((103, 5),))
+
+    def test_triggers_in_stop_price_order(self):
+        place_order(self.manager, 'buy', 10, 90)
+        far = self.order_store.create('stop_sell', 'WSCN', 1, None, 95)
+        near = self.order_store.create('stop_sell', 'WSCN', 1, None, 99)
+        for order in (far, near):
+            self.manager.handle_event(NewOrderEvent(order.id))
+        place_order(self.manager, 'buy', 1, 94)
+        report = place_order(self.manager, 'sell', 1, 94)
+        self.assertEqual([r.order.id for r in report.triggered], [near.id, far.id])
+
+    def test_cancel_stop(self):
+        stop = self.order_store.create('stop_buy', 'WSCN', 5, None, 101)
+        self.manager.handle_event(NewOrderEvent(stop.id))
+        trade = self.manager.handle_event(CancelOrderEvent(stop.id))
+        self.assertTrue(trade.is_canceled)
+        self.assertEqual(self.manager.handle_event(AmendOrderEvent(stop.id, amount=1)), None)
+        place_order(self.manager, 'sell', 1, 101)
+        report = place_order(self.manager, 'buy', 1, 101)
+        self.assertEqual(report.triggered, [])
+
+
+class TestMassCancel(TestCase):
+    def setUp(self):
+        self.trade_store = MemTradeStore()
+        self.order_store = OrderStore()
+        self.manager = new_manager(None, self.trade_store, self.order_store)
+
+    def test_by_symbol_and_side(self):
+        b1 = new_order(self.manager, 'buy', 10, 99)
+        b2 = new_order(self.manager, 'buy', 5, 98)
+        s1 = new_order(self.manager, 'sell', 10, 101)
+        stop = new_order(self.manager, 'stop_buy', 3, stop_price=102)
+        new_order(self.manager, 'sell', 4, 99)
+        event = MassCancelEvent('WSCN', 'buy')
+        trades = self.manager.handle_event(event)
+        self.assertEqual([(t.order_id, t.status, t.amount) for t in trades],
+                         [(b1.id, 'left_cancel', 6), (b2.id, 'all_cancel', 5), (stop.id, 'all_cancel', 3)])
+        self.assertEqual(event.wait(0), [b1.id, b2.id, stop.id])
+        self.assertEqual(self.manager.resting_orders('WSCN', 'buy'), [])
+        self.assertEqual([o.id for o in self.manager.resting_orders('WSCN', 'sell')], [s1.id])
+        self.assertEqual(self.manager.snapshots.get('WSCN').bids, ())
+        self.assertEqual(self.manager.handle_event(MassCancelEvent('WSCN', 'buy')), [])
+
+    def test_by_account(self):
+        a1 = new_order(self.manager, 'buy', 10, 99, account='alice')
+        new_order(self.manager, 'sell', 10, 101, account='bob')
+        a2 = new_order(self.manager, 'sell', 10, 102, account='alice')
+        trades = self.manager.handle_event(MassCancelEvent(account='alice'))
+        self.assertEqual([t.order_id for t in trades], [a1.id, a2.id])
+        self.assertEqual(len(self.manager.resting_orders('WSCN', 'sell')), 1)
+
+
+class TestExpiry(TestCase):
+    def setUp(self):
+        self.clock = StepClock(datetime(2016, 7, 1, 15), timedelta(seconds=1))
+        self.trade_store = MemTradeStore(clock=self.clock)
+        self.order_store = OrderStore(clock=self.clock)
+        self.manager = new_manager(None, self.trade_store, self.order_store, clock=self.clock)
+
+    def test_expire_on_tick(self):
+        gtd = new_order(self.manager, 'sell', 10, 101, expire_at=datetime(2016, 7, 1, 15, 0, 30))
+        gtd2 = new_order(self.manager, 'buy', 10, 99, expire_at=datetime(2016, 7, 1, 15, 0, 20))
+        day = new_order(self.manager, 'buy', 10, 98, expire_at=datetime(2016, 7, 2))
+        new_order(self.manager, 'sell', 4, 101)
+        new_order(self.manager, 'buy', 4, 101)
+        while self.clock.now() < datetime(2016, 7, 1, 15, 0, 40):
+            self.manager.handle_event('timeout')
+        self.assertEqual([t.status for t in self.trade_store.get(gtd.id)], ['partial_done', 'left_cancel'])
+        self.assertEqual(self.trade_store.get(gtd2.id)[-1].status, 'all_cancel')
+        self.assertEqual(self.trade_store.get(day.id), [])
+        self.assertEqual(self.manager.snapshots.get('WSCN').bids, ((98, 10),))
+        self.assertEqual(self.manager.snapshots.get('WSCN').asks, ((101, 4),))
+
+    def test_expired_orders_never_trade(self):
+        new_order(self.manager, 'sell', 10, 100, expire_at=datetime(2016, 7, 1, 15, 0, 5))
+        while self.clock.now() < datetime(2016, 7, 1, 15, 0, 10):
+            pass  # no event: nothing expired yet
+        self.assertEqual(len(self.manager._order_map), 1)
+        buy = new_order(self.manager, 'buy', 10, 100)
+        self.assertEqual(self.trade_store.get(buy.id), [])
+        self.assertEqual(self.manager._order_map, {buy.id: buy})
@@ -0,0 +1,213 @@
+"""Cash and positions of the accounts, kept in memory and checked before orders are accepted.
+
+Amounts of cash are integer cents. Accepting an order reserves what it may
+spend: the cash of a buy order at its limit price (the highest price of the
+symbol for market orders), the position of a sell order. The reservation is
+consumed by the fills and what is left is released once the order is done,
+so every check is a few dict lookups whatever the history of the account.
+"""
+import logging
+import threading
+import time
+
+from .exc import InvalidRequest
+from .symbol import get_symbol_price_range
+
+
+LOG = logging.getLogger(__name__)
+
+
+class InsufficientFunds(InvalidRequest):
+    pass
+
+
+def to_cents(price):
+    return int(round(price * 100))
+
+
+def encode_account(account):
+    return {'id': account.id, 'cash': account.cash, 'positions': dict(account.positions)}
+
+
+class Account(object):
+    def __init__(self, id_, cash=0, positions=None):
+        self.id = id_
+        self.cash = cash
+        self.positions = positions or {}  # symbol_id => amount
+        self.reserved_cash = 0
+        self.reserved = {}  # symbol_id => amount
+
+    @property
+    def available_cash(self):
+        return self.cash - self.reserved_cash
+
+    def available(self, symbol_id):
+        return self.positions.get(symbol_id, 0) - self.reserved.get(symbol_id, 0)
+
+    def __repr__(self):
+        return 'Account<%s, %s, %s>' % (self.id, self.cash, self.positions)
+
+
+class Reservation(object):
+    """What an order still holds: `amount` units, at `unit` cents each for a buy order."""
+
+    def __init__(self, account, symbol, is_buy, unit, amount):
+        self.account = account
+        self.symbol = symbol
+        self.is_buy = is_buy
+        self.unit = unit
+        self.amount = amount
+
+    def hold(self, amount):
+        if self.is_buy:
+            self.account.reserved_cash += self.unit * amount
+        else:
+            self.account.reserved[self.symbol] = self.account.reserved.get(self.symbol, 0) + amount
+
+    def check(self, amount):
+        if self.is_buy:
+            if self.account.available_cash < self.unit * amount:
+                raise InsufficientFunds('not enough cash in account %s: %s cents available, %s required' % (
+                    self.account.id, self.account.available_cash, self.unit * amount))
+        elif self.account.available(self.symbol) < amount:
+            raise InsufficientFunds('not enough %s in account %s: %s available, %s required' % (
+                self.symbol, self.account.id, self.account.available(self.symbol), amount))
+
+
+class Ledger(object):
+    """Accounts updated from the fills of the matching thread, read by the request handlers.
+
+    The accounts changed since the last `flush` are written to `store` in one
+    batch, every `flush_size` changes, every `flush_interval` seconds or when
+    `flush` is called.
+    """
+
+    def __init__(self, store=None, flush_size=100, flush_interval=1.0, clock=time.monotonic):
+        self.store = store or MemLedgerStore()
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self._clock = clock
+        self._flushed = clock()  # when the last flush happened
+        self._accounts = {}  # account_id => Account
+        self._reservations = {}  # order_id => Reservation
+        self._dirty = set()  # ids of the accounts changed since the last flush
+        self._lock = threading.Lock()
+        for data in self.store.load():
+            self._accounts[data['id']] = Account(data['id'], data['cash'], data['positions'])
+
+    def get(self, account_id):
+        return self._accounts.get(account_id)
+
+    def _account(self, account_id):
+        account = self._accounts.get(account_id)
+        if account is None:
+            account = self._accounts[account_id] = Account(account_id)
+        return account
+
+    def deposit(self, account_id, cash=0, positions=None):
+        """Add `cash` (cents) and the `positions` ({symbol_id: amount}) to an account."""
+        with self._lock:
+            account = self._account(account_id)
+            account.cash += cash
+            for symbol_id, amount in (positions or {}).items():
+                account.positions[symbol_id] = account.positions.get(symbol_id, 0) + amount
+            self._dirty.add(account_id)
+
+    def reserve(self, order):
+        """Hold what `order` may spend, raise `InsufficientFunds` if the account can't afford it."""
+        unit = 0
+        if order.is_buy:
+            # market orders may trade up to the highest price of the symbol
+            unit = to_cents(get_symbol_price_range(order.symbol)[1] if order.MARKET else order.price)
+        with self._lock:
+            reservation = Reservation(self._account(order.account), order.symbol, order.is_buy,
+                                      unit, order.amount)
+            reservation.check(order.amount)
+            reservation.hold(order.amount)
+            self._reservations[order.id] = reservation
+
+    def amend(self, order_id, amount=None, price=None):
+        """Resize the reservation of an order to its amended `amount` and `price`."""
+        with self._lock:
+            reservation = self._reservations.get(order_id)
+            if reservation is None:
+                return
+            amount = reservation.amount if amount is None else amount
+            unit = reservation.unit if price is None or not reservation.is_buy else to_cents(price)
+            reservation.hold(-reservation.amount)
+            amended = Reservation(reservation.account, reservation.symbol, reservation.is_buy, unit, amount)
+            try:
+                amended.check(amount)
+            except InsufficientFunds:
+                reservation.hold(reservation.amount)
+                raise
+            amended.hold(amount)
+            self._reservations[order_id] = amended
+
+    def release(self, order_ids):
+        """Give back what is still held by the orders done."""
+        with self._lock:
+            for order_id in order_ids:
+                reservation = self._reservations.pop(order_id, None)
+                if reservation is not None:
+                    reservation.hold(-reservation.amount)
+
+    def apply_fills(self, fills):
+        """Move the cash and the positions of `fills`, out of the reservations of their orders."""
+        with self._lock:
+            for fill in fills:
+                price = to_cents(fill.price)
+                for order, sign in ((fill.buy_order, 1), (fill.sell_order, -1)):
+                    if order.account is None:
+                        continue
+                    account = self._account(order.account)
+                    reservation = self._reservations.get(order.id)
+                    if reservation is not None:
+                        reservation.hold(-fill.amount)
+                        reservation.amount -= fill.amount
+                    account.cash -= sign * price * fill.amount
+                    account.positions[order.symbol] = account.positions.get(order.symbol, 0) + sign * fill.amount
+                    self._dirty.add(account.id)
+            due = len(self._dirty) >= self.flush_size or self._clock() - self._flushed >= self.flush_interval
+        if due:
+            self.flush()
+
+    def flush(self):
+        """Write the accounts changed since the last flush in one batch."""
+        with self._lock:
+            self._flushed = self._clock()
+            if not self._dirty:
+                return
+            rows = [encode_account(self._accounts[account_id]) for account_id in self._dirty]
+            self._dirty = set()
+        LOG.debug('flush %s accounts', len(rows))
+        self.store.save(rows)
+
+
+class LedgerStore(object):
+    def load(self):
+        """Return the saved accounts, encoded by `encode_account`."""
+        raise NotImplementedError()
+
+    def save(self, rows):
+        raise NotImplementedError()
+
+
+class MemLedgerStore(LedgerStore):
+    def __init__(self):
+        self._data = {}
+
+    def load(self):
+        return list(self._data.values())
+
+    def save(self, rows):
+        for row in rows:
+            self._data[row['id']] = row
+
+
+def __getattr__(name):
+    # the DB-backed store moved to `xtrade.dbstore`, only loaded when asked for
+    if name == 'DBLedgerStore':
+        from .dbstore import DBLedgerStore
+        return DBLedgerStore
+    raise AttributeError('module %r has no attribute %r' % (__name__, name))
@@ -0,0 +1,102 @@
+import threading
+import time
+
+from .exc import EngineBusy, RateLimited
+
+
+class TokenBucket(object):
+    def __init__(self, rate, capacity, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self._clock = clock
+        self._tokens = capacity
+        self.updated = clock()
+
+    def consume(self, tokens=1):
+        """Take `tokens` out of the bucket.
+
+        Return 0 if they are available, otherwise the seconds to wait before retrying.
+        """
+        now = self._clock()
+        self._tokens = min(self.capacity, self._tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self._tokens >= tokens:
+            self._tokens -= tokens
+            return 0
+        return (tokens - self._tokens) / self.rate
+
+
+class AdmissionController(object):
+    """Decide whether a new request may enter the engine queue.
+
+    Requests are rejected when:
+    * the queue holds `max_queue_depth` events or more
+    * the oldest pending event has waited `max_lag` seconds or more
+    * the client exhausted its token bucket (`rate` requests per second, `burst` at most)
+
+    A bucket left idle long enough to refill is the same as a new one: such buckets
+    are dropped every `burst / rate` seconds, so idle clients don't pile up.
+    """
+
+    def __init__(self, queue, max_queue_depth=1000, max_lag=1.0, rate=None, burst=None,
+                 retry_after=1, clock=time.monotonic):
+        self.queue = queue
+        self.max_queue_depth = max_queue_depth
+        self.max_lag = max_lag
+        self.rate = rate
+        self.burst = burst or rate
+        self.retry_after = retry_after
+        self._clock = clock
+        self._buckets = {}  # client_id => TokenBucket
+        self._swept = clock()
+        self._lock = threading.Lock()
+        self.admitted = 0
+        self.rejections = {'queue_depth': 0, 'lag': 0, 'rate_limit': 0}
+
+    def admit(self, client_id):
+        depth = self.queue.qsize()
+        if self.max_queue_depth is not None and depth >= self.max_queue_depth:
+            self._count('queue_depth')
+            raise EngineBusy('engine queue is full: %s pending' % (depth,), self.retry_after)
+        lag = self.queue.lag
+        if self.max_lag is not None and lag >= self.max_lag:
+            self._count('lag')
+            raise EngineBusy('engine is lagging: %.3fs behind' % (lag,), max(self.retry_after, lag))
+        if self.rate:
+            with self._lock:
+                self._sweep()
+                bucket = self._buckets.get(client_id)
+                if bucket is None:
+                    bucket = self._buckets[client_id] = TokenBucket(self.rate, self.burst, self._clock)
+                wait = bucket.consume()
+            if wait:
+                self._count('rate_limit')
+                raise RateLimited('too many requests from %s' % (client_id,), wait)
+        self._count()
+
+    def _sweep(self):
+        now = self._clock()
+        refill = self.burst / self.rate
+        if now - self._swept < refill:
+            return
+        self._swept = now
+        self._buckets = {client_id: bucket for client_id, bucket in self._buckets.items()
+                         if now - bucket.updated < refill}
+
+    def _count(self, reason=None):
+        with self._lock:
+            if reason is None:
+                self.admitted += 1
+            else:
+                self.rejections[reason] += 1
+
+    def stats(self):
+        with self._lock:
+            rejections = dict(self.rejections)
+            admitted = self.admitted
+        return {
+            'queue_depth': self.queue.qsize(),
+            'lag': self.queue.lag,
+            'admitted': admitted,
+            'rejections': rejections,
+        }
@@ -0,0 +1,187 @@
+"""Post-trade statistics computed over NumPy arrays.
+
+Trades are loaded in bulk from `TradeModel`, from `trade.log` or from the
+columnar archive, then every statistic is computed without a Python loop over
+the trades.
+"""
+import os
+
+import numpy as np
+
+
+LOG_DTYPE = np.dtype([('timestamp', np.int64), ('symbol', 'U32'), ('price', np.float64), ('amount', np.int64)])
+# the logs of older versions: no symbol, the timestamp in ns or as `<date> <time>`
+NS_LOG_DTYPE = np.dtype([('timestamp', np.int64), ('price', np.float64), ('amount', np.int64)])
+DATETIME_LOG_DTYPE = np.dtype([('date', 'U10'), ('time', 'U15'), ('price', np.float64), ('amount', np.int64)])
+
+
+class Trades(object):
+    """Trades as parallel arrays, sorted by timestamp (ns)."""
+
+    def __init__(self, symbol, timestamp, price, amount):
+        order = np.argsort(timestamp, kind='stable')
+        self.symbol = np.asarray(symbol)[order]
+        self.timestamp = np.asarray(timestamp, dtype=np.int64)[order]
+        self.price = np.asarray(price, dtype=np.float64)[order]
+        self.amount = np.asarray(amount, dtype=np.int64)[order]
+
+    def __len__(self):
+        return len(self.timestamp)
+
+    def by_symbol(self):
+        """Return {symbol: Trades} with the trades of each symbol."""
+        symbols, inverse = np.unique(self.symbol, return_inverse=True)
+        if len(symbols) == 1:
+            return {str(symbols[0]): self}
+        order = np.argsort(inverse, kind='stable')
+        bounds = np.searchsorted(inverse[order], np.arange(len(symbols) + 1))
+        result = {}
+        for i, symbol in enumerate(symbols):
+            idx = order[bounds[i]:bounds[i + 1]]
+            result[str(symbol)] = Trades(self.symbol[idx], self.timestamp[idx], self.price[idx],
+                                         self.amount[idx])
+        return result
+
+
+def load_trades_from_db(db, symbol=None):
+    """Load the fills from `TradeModel`, each counted once through its buy side."""
+    from .db import OrderModel, TradeModel
+
+    query = db.session.query(OrderModel.symbol, TradeModel.timestamp, TradeModel.price, TradeModel.amount)\
+        .join(OrderModel, OrderModel.id == TradeModel.order_id)\
+        .filter(TradeModel.order_type.like('%buy'))\
+        .filter(TradeModel.status.like('%done'))
+    if symbol is not None:
+        query = query.filter(OrderModel.symbol == symbol)
+    rows = query.all()
+    if not rows:
+        return Trades([], [], [], [])
+    symbols, timestamps, prices, amounts = zip(*rows)
+    timestamps = np.array(timestamps, dtype='datetime64[ns]').astype(np.int64)
+    return Trades(symbols, timestamps, prices, amounts)
+
+
+def load_trades_from_log(path, symbol=None):
+    """Load `trade.log`, made of `<timestamp> <symbol> <price> <amount>` lines, the trades of `symbol` if given.
+
+    The logs of older versions have no symbol: all their trades are taken as
+    trades of `symbol`, so such a log is for a single symbol.
+    """
+    with open(path) as f:
+        first = f.readline().split()
+    if not first:
+        return Trades([], [], [], [])
+    # parsed straight into numbers, without a string per token in between
+    if len(first) == 3:
+        rows = np.loadtxt(path, dtype=NS_LOG_DTYPE, ndmin=1)
+        timestamps = rows['timestamp']
+    elif '-' in first[0]:
+        rows = np.loadtxt(path, dtype=DATETIME_LOG_DTYPE, ndmin=1)
+        timestamps = np.char.add(np.char.add(rows['date'], 'T'), rows['time'])
+        timestamps = timestamps.astype('datetime64[ns]').astype(np.int64)
+    else:
+        rows = np.loadtxt(path, dtype=LOG_DTYPE, ndmin=1)
+        if symbol is not None:
+            rows = rows[rows['symbol'] == symbol]
+        return Trades(rows['symbol'], rows['timestamp'], rows['price'], rows['amount'])
+    if symbol is None:
+        raise ValueError('%s has no symbol column, the symbol of its trades is required' % (path,))
+    return Trades(np.full(len(rows), symbol), timestamps, rows['price'], rows['amount'])
+
+
+def load_trades_from_archive(root, symbol=None, start_ns=None, end_ns=None):
+    """Load trades from the columnar archive, see `xtrade.columnar`."""
+    from .columnar import ColumnarTradeReader, PRICE_SCALE
+
+    reader = ColumnarTradeReader(root)
+    days = reader.days()
+    symbols = [symbol] if symbol else sorted(set(s for day in days for s in reader.symbols(day)))
+    chunks = [trades for s in symbols for trades in reader.slice(s, start_ns, end_ns)]
+    if not chunks:
+        return Trades([], [], [], [])
+    return Trades(np.concatenate([np.full(len(c), c.symbol) for c in chunks]),
+                  np.concatenate([c.timestamp for c in chunks]),
+                  np.concatenate([c.price for c in chunks]) / PRICE_SCALE,
+                  np.concatenate([c.amount for c in chunks]))
+
+
+def load_trades(source, symbol=None):
+    """Load trades from an archive directory or a trade log file."""
+    if os.path.isdir(source):
+        return load_trades_from_archive(source, symbol)
+    return load_trades_from_log(source, symbol)
+
+
+def vwap(trades):
+    volume = trades.amount.sum()
+    if not volume:
+        return None
+    return float(np.dot(trades.price, trades.amount) / volume)
+
+
+def volume_profile(trades):
+    """Return (prices, volumes): the volume traded at each price, by ascending price."""
+    prices, inverse = np.unique(trades.price, return_inverse=True)
+    return prices, np.bincount(inverse, weights=trades.amount, minlength=len(prices)).astype(np.int64)
+
+
+def _buckets(trades, bucket_ns):
+    """Return (bucket starts, index of the first trade of each bucket)."""
+    bucket = trades.timestamp // bucket_ns
+    first = np.flatnonzero(np.r_[True, bucket[1:] != bucket[:-1]])
+    return bucket[first] * bucket_ns, first
+
+
+def bucket_volume(trades, bucket_ns):
+    """Return (bucket starts, volumes) for the buckets holding trades."""
+    if not len(trades):
+        return np.empty(0, np.int64), np.empty(0, np.int64)
+    starts, first = _buckets(trades, bucket_ns)
+    return starts, np.add.reduceat(trades.amount, first)
+
+
+def spread_stats(trades, bucket_ns):
+    """Statistics of the high-low spread inside each bucket.
+
+    Trades carry no quotes, so the spread is measured as the range of the traded prices.
+    """
+    if not len(trades):
+        return None
+    _, first = _buckets(trades, bucket_ns)
+    spread = np.maximum.reduceat(trades.price, first) - np.minimum.reduceat(trades.price, first)
+    return {'mean': float(spread.mean()), 'median': float(np.median(spread)),
+            'max': float(spread.max()), 'std': float(spread.std())}
+
+
+def realized_volatility(trades, bucket_ns=None):
+    """Square root of the sum of the squared log returns.
+
+    Returns are taken between the last prices of consecutive buckets, or
+    between consecutive trades if `bucket_ns` is None.
+    """
+    prices = trades.price
+    if bucket_ns is not None and len(trades):
+        _, first = _buckets(trades, bucket_ns)
+        prices = prices[np.r_[first[1:] - 1, len(prices) - 1]]
+    if len(prices) < 2:
+        return 0.0
+    returns = np.diff(np.log(prices))
+    return float(np.sqrt(np.dot(returns, returns)))
+
+
+def summarize(trades, bucket_ns=60 * 10 ** 9):
+    """Return all the statistics of each symbol as a json-serializable dict."""
+    result = {}
+    for symbol, trades_ in trades.by_symbol().items():
+        prices, volumes = volume_profile(trades_)
+        starts, bucket_volumes = bucket_volume(trades_, bucket_ns)
+        result[symbol] = {
+            'trades': len(trades_),
+            'volume': int(trades_.amount.sum()),
+            'vwap': vwap(trades_),
+            'volume_profile': dict(zip(prices.tolist(), volumes.tolist())),
+            'bucket_volume': dict(zip(starts.tolist(), bucket_volumes.tolist())),
+            'spread': spread_stats(trades_, bucket_ns),
+            'realized_volatility': realized_volatility(trades_, bucket_ns),
+        }
+    return result
@@ -1,19 +1,27 @@
+from datetime import datetime
 import logging
+import math
 import os
 import time
 
 from flask import request, jsonify, Flask, current_app
 
-from .event import NewOrderEvent, CancelOrderEvent
-from .exc import InvalidRequest, InvalidRequestBody
-from .manager import TradeManager, DBTradeStore
-from .message_queue import LocalQueue
-from .order import OrderStore, OrderNotFound
-from .symbol import get_symbol_price_range, SymbolNotFound
+from .account import Ledger
+from .admission import AdmissionController
+from .archive import decode_time
+from .event import NewOrderEvent, CancelOrderEvent, AmendOrderEvent, AuctionEvent, MassCancelEvent
+from .exc import InvalidRequest, InvalidRequestBody, Rejected, EngineBusy
+from .manager import TradeManager, TradeStore
+from .message_queue import LocalQueue, QueueFull
+from .order import OrderStore, OrderNotFound, get_order_class, get_expire_at
+from .profiling import EngineProfiler, ProfilerBusy
+from .symbol import get_symbol, get_symbol_price_range, SymbolNotFound
 
 
 app = Flask(__name__)
 
+MASS_CANCEL_TIMEOUT = 5  # seconds to wait for a mass cancel to be processed
+
 
 def get_queue():
     return current_app.extensions['_message_queue']
@@ -57,6 +65,60 @@ def uninstall_order_store():
     app.extensions.pop('_order_store')
 
 
+def get_admission():
+    # admission control is optional, requests are always accepted without it
+    return current_app.extensions.get('_admission')
+
+
+def install_admission(admission):
+    app.extensions['_admission'] = admission
+    return admission
+
+
+def uninstall_admission():
+    app.extensions.pop('_admission')
+
+
+def get_profiler():
+    return current_app.extensions.get('_profiler')
+
+
+def install_profiler(profiler):
+    app.extensions['_profiler'] = profiler
+    return profiler
+
+
+def uninstall_profiler():
+    app.extensions.pop('_profiler')
+
+
+def get_book():
+    return current_app.extensions['_book']
+
+
+def install_book(snapshots):
+    app.extensions['_book'] = snapshots
+    return snapshots
+
+
+def uninstall_book():
+    app.extensions.pop('_book')
+
+
+def get_ledger():
+    # without a ledger orders are accepted whatever their account
+    return current_app.extensions.get('_ledger')
+
+
+def install_ledger(ledger):
+    app.extensions['_ledger'] = ledger
+    return ledger
+
+
+def uninstall_ledger():
+    app.extensions.pop('_ledger')
+
+
 def uninstall_all():
     app.extensions = {}
 
@@ -68,8 +130,25 @@ def handle_invalid_type(e):
     return resp
 
 
+@app.errorhandler(Rejected)
+def handle_rejected(e):
+    resp = jsonify({'status': e.status_code, 'error': e.__class__.__name__, 'message': str(e),
+                    'retry_after': e.retry_after})
+    resp.status_code = e.status_code
+    resp.headers['Retry-After'] = str(int(math.ceil(e.retry_after)))
+    return resp
+
+
+def get_client_id():
+    # not a header the client could change at each request to get a fresh bucket
+    return request.remote_addr
+
+
 @app.route('/trade.do', methods=['POST'])
 def do_trade():
+    admission = get_admission()
+    if admission is not None:
+        admission.admit(get_client_id())
     try:
         data = request.get_json(force=True)
     except Exception:
@@ -81,20 +160,115 @@ def do_trade():
         symbol_id = data['symbol']
     except KeyError as e:
         raise InvalidRequest('miss key: %s' % (e,))
+    stop_price = data.get('stop_price', None)
+    account = data.get('account', None)
+    time_in_force = data.get('time_in_force', 'GTC')
+    expire_at = data.get('expire_at', None)
+    check_amount(amount)
+    klass = get_order_class(type_)
+    if price is None and not klass.MARKET:
+        raise InvalidRequest('miss key: price')
+    check_price(symbol_id, price)
+    if klass.STOP:
+        if stop_price is None:
+            raise InvalidRequest('miss key: stop_price')
+        check_price(symbol_id, stop_price)
+    elif stop_price is not None:
+        raise InvalidRequest('`stop_price` is only for stop orders')
+    if expire_at is not None:
+        expire_at = decode_time(expire_at)
+        if not isinstance(expire_at, datetime):
+            raise InvalidRequest('expected `expire_at` as an ISO 8601 time. got: %s' % (data['expire_at'],))
+    order_store = get_order_store()
+    expire_at = get_expire_at(time_in_force, order_store.clock.now(), expire_at)
+    ledger = get_ledger()
+    if ledger is not None and account is None:
+        raise InvalidRequest('miss key: account')
+    if get_queue().full():
+        # before the order is saved: an order the engine can't take is never stored
+        raise EngineBusy('engine queue is full')
+    order = order_store.make(type_, symbol_id, amount, price, stop_price, account, expire_at)
+    if ledger is not None:
+        ledger.reserve(order)
+    order_store.put(order)
+    # a concurrent request may have filled the queue since: a saved order is queued anyway
+    put_event(NewOrderEvent(order.id), force=True)
+    return jsonify({'order_id': order.id, 'result': True})
+
+
+def check_amount(amount):
     if not isinstance(amount, int) or amount <= 0 or amount >= 1000:
         raise InvalidRequest(
             'expected `amount` as an integer: 0 < amount < 1000. got: %s' % (amount,))
+
+
+def check_price(symbol_id, price):
     try:
         min_price, max_price = get_symbol_price_range(symbol_id)
     except SymbolNotFound:
         raise InvalidRequest('unknown symbol: %s' % (symbol_id,))
-    if price and (price < min_price or price > max_price):
+    if price is None:
+        return
+    if price < min_price or price > max_price:
         raise InvalidRequest('expected price between %s and %s, got: %s' % (min_price, max_price, price))
     if int(price * 100) != price * 100:
         raise InvalidRequest('price should have no more than two floating points. got: %s' % (price,))
-    order = get_order_store().create(type_, symbol_id, amount, price)
-    get_queue().put(NewOrderEvent(order.id))
-    return jsonify({'order_id': order.id, 'result': True})
+
+
+def put_event(event, force=False):
+    """Send `event` to the engine. A forced event is never rejected, even by a full queue."""
+    try:
+        get_queue().put(event, force)
+    except QueueFull:
+        raise EngineBusy('engine queue is full')
+
+
+@app.route('/amend_order.do', methods=['POST'])
+def amend_order():
+    """Change the `amount` and/or the `price` of a resting order.
+
+    Reducing the amount keeps the order's time priority, any other change
+    queues it again as a new arrival.
+    """
+    admission = get_admission()
+    if admission is not None:
+        admission.admit(get_client_id())
+    try:
+        data = request.get_json(force=True)
+    except Exception:
+        raise InvalidRequestBody('expected json-format body')
+    try:
+        order_id = data['order_id']
+    except KeyError as e:
+        raise InvalidRequest('miss key: %s' % (e,))
+    amount = data.get('amount')
+    price = data.get('price')
+    if amount is None and price is None:
+        raise InvalidRequest('expected `amount` or `price` to amend')
+    try:
+        order = get_order_store().get(order_id)
+    except OrderNotFound:
+        raise InvalidRequest('order not found: %s' % (order_id,))
+    if order.STOP:
+        raise InvalidRequest('a stop order can not be amended before it is triggered')
+    if amount is not None:
+        check_amount(amount)
+    if price is not None:
+        if order.MARKET:
+            raise InvalidRequest('the price of a market order can not be amended')
+        check_price(order.symbol, price)
+    # the reservation is resized by the engine, once the amendment is accepted
+    put_event(AmendOrderEvent(order_id, amount, price))
+    return jsonify({'order_id': order_id, 'result': True})
+
+
+@app.route('/stats.do', methods=['GET'])
+def stats():
+    admission = get_admission()
+    if admission is not None:
+        return jsonify(admission.stats())
+    queue = get_queue()
+    return jsonify({'queue_depth': queue.qsize(), 'lag': queue.lag})
 
 
 @app.route('/cancel_order.do', methods=['POST'])
@@ -108,7 +282,8 @@ def cancel_order():
         get_order_store().get(order_id)
     except OrderNotFound:
         raise InvalidRequest('order not found: %s' % (order_id,))
-    get_queue().put(CancelOrderEvent(order_id))
+    # cancels shed load: they bypass the admission control and the queue limit
+    put_event(CancelOrderEvent(order_id), force=True)
     result = False
     trade_store = get_trade_store()
     for i in range(10):
@@ -121,26 +296,202 @@ def cancel_order():
     return jsonify({'order_id': order_id, 'result': result})
 
 
+@app.route('/mass_cancel.do', methods=['POST'])
+def mass_cancel():
+    """Cancel all the orders of `symbol` and/or `account`, of one `side` if given, in one engine event.
+
+    Like a single cancel, it is never rejected by the admission control nor by a full queue.
+    """
+    try:
+        data = request.get_json(force=True)
+    except Exception:
+        raise InvalidRequestBody('expected json-format body')
+    symbol_id = data.get('symbol')
+    side = data.get('side')
+    account = data.get('account')
+    if symbol_id is None and account is None:
+        raise InvalidRequest('expected `symbol` or `account` to cancel')
+    if symbol_id is not None:
+        try:
+            get_symbol(symbol_id)
+        except SymbolNotFound:
+            raise InvalidRequest('unknown symbol: %s' % (symbol_id,))
+    if side not in (None, 'buy', 'sell'):
+        raise InvalidRequest('expected `side` as buy or sell. got: %s' % (side,))
+    event = MassCancelEvent(symbol_id, side, account)
+    put_event(event, force=True)
+    order_ids = event.wait(MASS_CANCEL_TIMEOUT)
+    if order_ids is None:
+        return jsonify({'result': False})
+    return jsonify({'result': True, 'count': len(order_ids), 'order_ids': order_ids})
+
+
+def get_snapshot():
+    symbol_id = request.args.get('symbol')
+    try:
+        get_symbol(symbol_id)
+    except SymbolNotFound:
+        raise InvalidRequest('unknown symbol: %s' % (symbol_id,))
+    return get_book().get(symbol_id)
+
+
+@app.route('/depth', methods=['GET'])
+def depth():
+    snapshot = get_snapshot()
+    levels = request.args.get('levels', '10')
+    if not levels.isdigit() or int(levels) <= 0:
+        raise InvalidRequest('expected `levels` as a positive integer. got: %s' % (levels,))
+    levels = int(levels)
+    return jsonify({
+        'symbol': snapshot.symbol,
+        'bids': snapshot.bids[:levels],
+        'asks': snapshot.asks[:levels],
+        'last_price': snapshot.last_price,
+        'version': snapshot.version,
+    })
+
+
+@app.route('/quote', methods=['GET'])
+def quote():
+    snapshot = get_snapshot()
+    bid, bid_amount = snapshot.best_bid
+    ask, ask_amount = snapshot.best_ask
+    return jsonify({
+        'symbol': snapshot.symbol,
+        'bid': bid,
+        'bid_amount': bid_amount,
+        'ask': ask,
+        'ask_amount': ask_amount,
+        'last_price': snapshot.last_price,
+        'version': snapshot.version,
+    })
+
+
+@app.route('/admin/deposit.do', methods=['POST'])
+def deposit():
+    """Credit an account with `cash` (cents) and/or `positions` ({symbol_id: amount})."""
+    ledger = get_ledger()
+    if ledger is None:
+        raise InvalidRequest('accounts are not enabled')
+    try:
+        data = request.get_json(force=True)
+    except Exception:
+        raise InvalidRequestBody('expected json-format body')
+    try:
+        account = data['account']
+    except KeyError as e:
+        raise InvalidRequest('miss key: %s' % (e,))
+    cash = data.get('cash', 0)
+    positions = data.get('positions', {})
+    if not isinstance(cash, int) or not isinstance(positions, dict):
+        raise InvalidRequest('expected `cash` as an integer and `positions` as an object')
+    for symbol_id, amount in positions.items():
+        try:
+            get_symbol(symbol_id)
+        except SymbolNotFound:
+            raise InvalidRequest('unknown symbol: %s' % (symbol_id,))
+        if not isinstance(amount, int):
+            raise InvalidRequest('expected position amounts as integers. got: %s' % (amount,))
+    ledger.deposit(account, cash, positions)
+    return jsonify({'account': account, 'result': True})
+
+
+@app.route('/admin/auction.do', methods=['POST'])
+def auction():
+    """Open the call auction of `symbol` (`phase` "open"), or uncross it (`phase` "uncross")."""
+    try:
+        data = request.get_json(force=True)
+    except Exception:
+        raise InvalidRequestBody('expected json-format body')
+    try:
+        symbol_id = data['symbol']
+        phase = data['phase']
+    except KeyError as e:
+        raise InvalidRequest('miss key: %s' % (e,))
+    try:
+        get_symbol(symbol_id)
+    except SymbolNotFound:
+        raise InvalidRequest('unknown symbol: %s' % (symbol_id,))
+    if phase not in (AuctionEvent.OPEN, AuctionEvent.UNCROSS):
+        raise InvalidRequest('expected `phase` as open or uncross. got: %s' % (phase,))
+    put_event(AuctionEvent(symbol_id, phase))
+    return jsonify({'symbol': symbol_id, 'phase': phase, 'result': True})
+
+
+@app.route('/admin/profile.do', methods=['POST'])
+def profile_engine():
+    """Profile the matching thread for `duration` seconds and return the report.
+
+    `mode` is "sampling" (collapsed stacks) or "deterministic" (pstats).
+    """
+    profiler = get_profiler()
+    if profiler is None:
+        raise InvalidRequest('profiling is not enabled')
+    try:
+        data = request.get_json(force=True)
+    except Exception:
+        raise InvalidRequestBody('expected json-format body')
+    mode = data.get('mode', 'sampling')
+    duration = data.get('duration', 5)
+    if mode not in ('sampling', 'deterministic'):
+        raise InvalidRequest('expected `mode` as sampling or deterministic. got: %s' % (mode,))
+    if not isinstance(duration, (int, float)) or duration <= 0 or duration > profiler.MAX_DURATION:
+        raise InvalidRequest('expected `duration`: 0 < duration <= %s. got: %s' % (
+            profiler.MAX_DURATION, duration))
+    try:
+        report = profiler.profile(mode, duration)
+    except ProfilerBusy:
+        raise EngineBusy('profiling already running')
+    return current_app.response_class(report, mimetype='text/plain')
+
+
 def run_app():
     logging.basicConfig(level=logging.DEBUG)
 
     app.config.from_object(os.environ.get('XTRADE_CONFIG') or 'config')
 
-    from .order import DBOrderStore
     from .db import db
+    from .dbstore import DBOrderStore, DBTradeStore, DBLedgerStore
 
     db.init_app(app)
     # todo: why this required?
     db.app = app
 
     db.create_all()
-    install_order_store(DBOrderStore(db))
-    order_store = DBOrderStore(db)
-    install_trade_store(DBTradeStore(db))
-    trade_store = DBTradeStore(db)
-
-    queue = install_queue()
-    manager = TradeManager(queue, trade_store, order_store)
+    partition_dir = app.config.get('XTRADE_PARTITION_DIR')
+    if partition_dir:
+        # orders and trades in one sqlite file per day, see `xtrade.partition`
+        from .partition import Partitions, PartitionedOrderStore, PartitionedTradeStore
+        partitions = Partitions(partition_dir)
+        order_store = install_order_store(PartitionedOrderStore(partitions))
+        trade_store = install_trade_store(PartitionedTradeStore(partitions))
+    else:
+        install_order_store(DBOrderStore(db))
+        order_store = DBOrderStore(db)
+        install_trade_store(DBTradeStore(db))
+        trade_store = DBTradeStore(db)
+    ledger = None
+    if app.config.get('XTRADE_ACCOUNTS'):
+        ledger = install_ledger(Ledger(DBLedgerStore(db), app.config.get('XTRADE_LEDGER_FLUSH_SIZE', 100),
+                                       app.config.get('XTRADE_LEDGER_FLUSH_INTERVAL', 1.0)))
+
+    queue = install_queue(LocalQueue(app.config.get('XTRADE_QUEUE_SIZE', 10000)))
+    install_admission(AdmissionController(
+        queue,
+        max_queue_depth=app.config.get('XTRADE_MAX_QUEUE_DEPTH', 5000),
+        max_lag=app.config.get('XTRADE_MAX_LAG', 1.0),
+        rate=app.config.get('XTRADE_CLIENT_RATE'),
+        burst=app.config.get('XTRADE_CLIENT_BURST')))
+    trade_archive = None
+    archive_dir = app.config.get('XTRADE_TRADE_ARCHIVE_DIR')
+    if archive_dir:
+        # the fills, column by column, for `xtrade.analytics`
+        from .columnar import ColumnarTradeWriter
+        trade_archive = ColumnarTradeWriter(archive_dir)
+    profiler = install_profiler(EngineProfiler())
+    manager = TradeManager(queue, trade_store, order_store, trade_archive=trade_archive, profiler=profiler,
+                           slow_event_threshold=app.config.get('XTRADE_SLOW_EVENT_THRESHOLD'), ledger=ledger)
+    install_book(manager.snapshots)
     manager.start()
     app.run()
 
@@ -0,0 +1,145 @@
+from collections import OrderedDict
+from datetime import datetime
+import gzip
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+def encode_time(timestamp):
+    if isinstance(timestamp, datetime):
+        return timestamp.isoformat()
+    return timestamp
+
+
+def decode_time(timestamp):
+    try:
+        return datetime.fromisoformat(timestamp)
+    except (TypeError, ValueError):
+        return timestamp
+
+
+class RetentionPolicy(object):
+    """Decide when finished orders leave memory.
+
+    * max_count: at most `max_count` finished orders stay resident
+    * max_age: finished orders are moved out `max_age` seconds after they finished
+    With neither of them, orders are moved out as soon as they finish.
+    """
+
+    def __init__(self, max_count=None, max_age=None, clock=time.monotonic):
+        self.max_count = max_count
+        self.max_age = max_age
+        self.clock = clock
+
+    def expired(self, finished):
+        """Pop and return the ids due out of `finished`, an OrderedDict of id => finish time."""
+        if self.max_count is None and self.max_age is None:
+            ids = list(finished)
+            finished.clear()
+            return ids
+        ids = []
+        deadline = None if self.max_age is None else self.clock() - self.max_age
+        while finished:
+            order_id, finished_at = next(iter(finished.items()))
+            too_many = self.max_count is not None and len(finished) > self.max_count
+            too_old = deadline is not None and finished_at <= deadline
+            if not (too_many or too_old):
+                break
+            finished.popitem(last=False)
+            ids.append(order_id)
+        return ids
+
+
+class Retention(object):
+    """Track finished keys of a store and hand out the ones to archive."""
+
+    def __init__(self, policy):
+        self.policy = policy
+        self._finished = OrderedDict()  # key => finish time
+
+    def finish(self, keys):
+        now = self.policy.clock()
+        for key in keys:
+            self._finished[key] = now
+        return self.policy.expired(self._finished)
+
+    def __len__(self):
+        return len(self._finished)
+
+
+class Archive(object):
+    """Append-only archive of finished records in gzip-compressed segments.
+
+    Records are buffered until `segment_size` of them are pending, then written
+    out as one segment. An sqlite index maps (kind, key) to its segment so a
+    lookup only reads one segment.
+    """
+    SEGMENT_NAME = 'segment-%08d.jsonl.gz'
+
+    def __init__(self, path, segment_size=1000):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.segment_size = segment_size
+        self._lock = threading.Lock()
+        self._index = sqlite3.connect(os.path.join(path, 'index.sqlite'), check_same_thread=False)
+        self._index.execute(
+            'CREATE TABLE IF NOT EXISTS records ('
+            'kind TEXT NOT NULL, key INTEGER NOT NULL, segment INTEGER NOT NULL, '
+            'PRIMARY KEY (kind, key))')
+        last_segment, = self._index.execute('SELECT MAX(segment) FROM records').fetchone()
+        self._segment = (last_segment or 0) + 1
+        self._pending = {}  # (kind, key) => record
+        self._cached_segment = None
+        self._cache = {}
+
+    def put(self, kind, key, record):
+        with self._lock:
+            self._pending[(kind, key)] = record
+            if len(self._pending) >= self.segment_size:
+                self._flush()
+
+    def get(self, kind, key):
+        with self._lock:
+            try:
+                return self._pending[(kind, key)]
+            except KeyError:
+                pass
+            row = self._index.execute(
+                'SELECT segment FROM records WHERE kind = ? AND key = ?', (kind, key)).fetchone()
+            if row is None:
+                raise KeyError((kind, key))
+            return self._load(row[0])[(kind, key)]
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def close(self):
+        self.flush()
+        self._index.close()
+
+    def _flush(self):
+        if not self._pending:
+            return
+        segment = self._segment
+        with gzip.open(os.path.join(self.path, self.SEGMENT_NAME % (segment,)), 'wt') as f:
+            for (kind, key), record in self._pending.items():
+                f.write(json.dumps([kind, key, record]))
+                f.write('\n')
+        self._index.executemany(
+            'INSERT OR REPLACE INTO records (kind, key, segment) VALUES (?, ?, ?)',
+            [(kind, key, segment) for kind, key in self._pending])
+        self._index.commit()
+        self._pending = {}
+        self._segment += 1
+
+    def _load(self, segment):
+        if segment != self._cached_segment:
+            with gzip.open(os.path.join(self.path, self.SEGMENT_NAME % (segment,)), 'rt') as f:
+                records = (json.loads(line) for line in f)
+                self._cache = {(kind, key): record for kind, key, record in records}
+            self._cached_segment = segment
+        return self._cache
@@ -0,0 +1,41 @@
+"""Clearing price of a call auction.
+
+The book collected during the call is reduced to its price levels. For each
+candidate price the executable volume is the smaller of the demand (the buy
+amount at that price or higher) and the supply (the sell amount at that price
+or lower), both cumulative sums over the sorted levels, so the cost depends on
+the number of levels and not on the number of orders.
+"""
+import numpy as np
+
+
+def clearing_price(buy_levels, sell_levels, market_buy=0, market_sell=0, reference_price=None):
+    """Return `(price, volume)` maximizing the volume executed, `(None, 0)` if nothing crosses.
+
+    `buy_levels` and `sell_levels` are `{price: amount}` of the limit orders,
+    `market_buy` and `market_sell` the amounts of the market orders, which
+    trade at any price. Among the prices of the maximum volume the one leaving
+    the smallest imbalance wins, then the closest to `reference_price`, then
+    the lowest.
+    """
+    prices = set(buy_levels) | set(sell_levels)
+    if reference_price is not None:
+        prices.add(reference_price)
+    if not prices:
+        return None, 0
+    prices = sorted(prices)
+    bids = np.array([buy_levels.get(price, 0) for price in prices], dtype=np.int64)
+    asks = np.array([sell_levels.get(price, 0) for price in prices], dtype=np.int64)
+    demand = np.cumsum(bids[::-1])[::-1] + market_buy
+    supply = np.cumsum(asks) + market_sell
+    volume = np.minimum(demand, supply)
+    best = volume.max()
+    if best <= 0:
+        return None, 0
+    candidates = np.flatnonzero(volume == best)
+    imbalance = np.abs(demand[candidates] - supply[candidates])
+    candidates = candidates[imbalance == imbalance.min()]
+    if reference_price is not None and len(candidates) > 1:
+        distance = np.abs(np.array(prices, dtype=np.float64)[candidates] - reference_price)
+        candidates = candidates[distance == distance.min()]
+    return prices[candidates[0]], int(best)
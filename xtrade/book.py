@@ -0,0 +1,48 @@
+class BookSnapshot(object):
+    """An immutable view of the price levels of one symbol.
+
+    `bids` and `asks` are tuples of (price, amount), best price first. Market
+    orders have no price and are not part of the levels.
+    """
+    __slots__ = ('symbol', 'bids', 'asks', 'last_price', 'version')
+
+    def __init__(self, symbol, bids=(), asks=(), last_price=None, version=0):
+        self.symbol = symbol
+        self.bids = bids
+        self.asks = asks
+        self.last_price = last_price
+        self.version = version
+
+    @property
+    def best_bid(self):
+        return self.bids[0] if self.bids else (None, 0)
+
+    @property
+    def best_ask(self):
+        return self.asks[0] if self.asks else (None, 0)
+
+
+class SnapshotPublisher(object):
+    """Hand the snapshots published by the matching thread to the readers.
+
+    The matching thread replaces the whole mapping on publish, never changing
+    the one a reader may hold, so readers need no lock.
+    """
+
+    def __init__(self):
+        self._snapshots = {}  # symbol_id => BookSnapshot
+        self._version = 0
+
+    def get(self, symbol_id):
+        snapshot = self._snapshots.get(symbol_id)
+        if snapshot is None:
+            return BookSnapshot(symbol_id)
+        return snapshot
+
+    def publish(self, snapshots):
+        self._version += 1
+        new_snapshots = dict(self._snapshots)
+        for snapshot in snapshots:
+            snapshot.version = self._version
+            new_snapshots[snapshot.symbol] = snapshot
+        self._snapshots = new_snapshots
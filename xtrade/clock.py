@@ -0,0 +1,83 @@
+"""Clocks of the engine.
+
+Datetimes are naive and in UTC everywhere: what `now` returns, what `to_ns`
+and `from_ns` convert, and what the stores and the requests take.
+"""
+from datetime import datetime, timedelta
+import threading
+import time
+
+
+EPOCH = datetime(1970, 1, 1)
+
+
+def to_ns(timestamp):
+    """Return a datetime as integer nanoseconds since `EPOCH`."""
+    return (timestamp - EPOCH) // timedelta(microseconds=1) * 1000
+
+
+def from_ns(timestamp_ns):
+    return EPOCH + timedelta(microseconds=timestamp_ns // 1000)
+
+
+class Sequencer(object):
+    """Stamp the events accepted by the engine, in a single call.
+
+    `next` returns a gapless sequence number, from 1, and a nanosecond timestamp
+    of `clock`, strictly increasing even if the clock stalls or steps back. The
+    engine stamps each event when it accepts it: the sequence number is what
+    orders are prioritized by, the timestamp is what trades and logs record.
+    Each clock has one, so a `StepClock` gives a deterministic one.
+    """
+
+    def __init__(self, clock):
+        self.clock = clock
+        self.seq = 0  # the last one handed out
+        self._last_ns = 0
+        self._lock = threading.Lock()
+
+    def next(self):
+        with self._lock:
+            self.seq += 1
+            timestamp = self.clock.time_ns()
+            if timestamp <= self._last_ns:
+                timestamp = self._last_ns + 1
+            self._last_ns = timestamp
+            return self.seq, timestamp
+
+    def advance(self, seq, timestamp=0):
+        """Skip past `seq` and `timestamp`, handed out by another sequencer, e.g. of the primary engine."""
+        with self._lock:
+            self.seq = max(self.seq, seq)
+            self._last_ns = max(self._last_ns, timestamp)
+
+
+class WallClock(object):
+    def __init__(self):
+        self.sequencer = Sequencer(self)
+
+    def now(self):
+        # UTC, from the same source as `time_ns`
+        return from_ns(self.time_ns())
+
+    def time_ns(self):
+        return time.time_ns()
+
+
+class StepClock(object):
+    """A deterministic clock, from `start` (UTC) moving forward by `step` every time it is read."""
+
+    def __init__(self, start=datetime(2016, 7, 1), step=timedelta(microseconds=1)):
+        self._now = start
+        self.step = step
+        self.sequencer = Sequencer(self)
+
+    def now(self):
+        self._now += self.step
+        return self._now
+
+    def time_ns(self):
+        return to_ns(self.now())
+
+
+WALL_CLOCK = WallClock()
@@ -0,0 +1,161 @@
+"""Columnar trade archive: one binary file per column, per day and per symbol.
+
+The layout is `<root>/<YYYYMMDD>/<symbol>/<column>.bin`, days in UTC, each file a flat array
+of fixed-width little-endian values, so a day of trades of one symbol can be
+memory-mapped as NumPy arrays and sliced without copying.
+"""
+import os
+
+import numpy as np
+
+from .clock import from_ns
+
+
+PRICE_SCALE = 100  # prices are stored as integers of 1/PRICE_SCALE
+
+COLUMNS = (
+    ('id', np.dtype('<i8')),  # of the buy side trade
+    ('buy_order_id', np.dtype('<i8')),
+    ('sell_order_id', np.dtype('<i8')),
+    ('price', np.dtype('<i8')),
+    ('amount', np.dtype('<i8')),
+    ('timestamp', np.dtype('<i8')),  # nanoseconds since the epoch
+    ('buy_status', np.dtype('u1')),
+    ('sell_status', np.dtype('u1')),
+)
+
+STATUS_CODES = {
+    'partial_done': 1,
+    'all_done': 2,
+    'left_cancel': 3,
+    'all_cancel': 4,
+}
+STATUS_NAMES = {code: name for name, code in STATUS_CODES.items()}
+
+
+def get_day(timestamp_ns):
+    return from_ns(timestamp_ns).strftime('%Y%m%d')
+
+
+def to_price(price):
+    return int(round(price * PRICE_SCALE))
+
+
+class ColumnarTradeWriter(object):
+    """Append trades to the column files.
+
+    Rows are `(id, buy_order_id, sell_order_id, symbol, price, amount, timestamp_ns, buy_status,
+    sell_status)`, `price` as a float and the statuses as trade status names.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self._day = None
+        self._files = {}  # symbol => [file]
+
+    def write(self, rows):
+        groups = {}  # (day, symbol) => [row]
+        for row in rows:
+            groups.setdefault((get_day(row[6]), row[3]), []).append(row)
+        for (day, symbol), rows_ in sorted(groups.items()):
+            files = self._open(day, symbol)
+            ids, buy_ids, sell_ids, _, prices, amounts, timestamps, buy_statuses, sell_statuses = zip(*rows_)
+            values = (ids, buy_ids, sell_ids, [to_price(p) for p in prices], amounts, timestamps,
+                      [STATUS_CODES[s] for s in buy_statuses], [STATUS_CODES[s] for s in sell_statuses])
+            for f, (_, dtype), column in zip(files, COLUMNS, values):
+                f.write(np.asarray(column, dtype=dtype).tobytes())
+            for f in files:
+                f.flush()
+
+    def close(self):
+        for files in self._files.values():
+            for f in files:
+                f.close()
+        self._files = {}
+
+    def _open(self, day, symbol):
+        if day != self._day:
+            self.close()
+            self._day = day
+        try:
+            return self._files[symbol]
+        except KeyError:
+            pass
+        path = os.path.join(self.root, day, symbol)
+        os.makedirs(path, exist_ok=True)
+        files = self._files[symbol] = [open(os.path.join(path, name + '.bin'), 'ab') for name, _ in COLUMNS]
+        return files
+
+
+class TradeColumns(object):
+    """Trades of one symbol in one day, one array per column."""
+
+    def __init__(self, symbol, day, columns):
+        self.symbol = symbol
+        self.day = day
+        self.columns = columns  # column name => array
+        for name, array in columns.items():
+            setattr(self, name, array)
+
+    def __len__(self):
+        return len(self.timestamp)
+
+    @property
+    def float_price(self):
+        return self.price / PRICE_SCALE
+
+    def slice(self, start_ns=None, end_ns=None):
+        """Return the trades in [start_ns, end_ns) as views of the same arrays."""
+        start = 0 if start_ns is None else np.searchsorted(self.timestamp, start_ns, 'left')
+        end = len(self) if end_ns is None else np.searchsorted(self.timestamp, end_ns, 'left')
+        return TradeColumns(self.symbol, self.day,
+                            {name: array[start:end] for name, array in self.columns.items()})
+
+
+class ColumnarTradeReader(object):
+    def __init__(self, root):
+        self.root = root
+
+    def days(self):
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(os.listdir(self.root))
+
+    def symbols(self, day):
+        path = os.path.join(self.root, day)
+        if not os.path.isdir(path):
+            return []
+        return sorted(os.listdir(path))
+
+    def load(self, day, symbol):
+        """Memory-map the trades of `symbol` in `day`."""
+        path = os.path.join(self.root, day, symbol)
+        sizes = {}
+        for name, dtype in COLUMNS:
+            try:
+                sizes[name] = os.path.getsize(os.path.join(path, name + '.bin')) // dtype.itemsize
+            except OSError:
+                sizes[name] = 0
+        # a crash may leave the columns of different lengths
+        length = min(sizes.values())
+        columns = {}
+        for name, dtype in COLUMNS:
+            if length:
+                columns[name] = np.memmap(os.path.join(path, name + '.bin'), dtype=dtype, mode='r',
+                                          shape=(length,))
+            else:
+                columns[name] = np.empty(0, dtype=dtype)
+        return TradeColumns(symbol, day, columns)
+
+    def slice(self, symbol, start_ns=None, end_ns=None):
+        """Yield the trades of `symbol` in [start_ns, end_ns), one TradeColumns per day."""
+        first_day = None if start_ns is None else get_day(start_ns)
+        last_day = None if end_ns is None else get_day(end_ns)
+        for day in self.days():
+            if (first_day and day < first_day) or (last_day and day > last_day):
+                continue
+            if symbol not in self.symbols(day):
+                continue
+            trades = self.load(day, symbol).slice(start_ns, end_ns)
+            if len(trades):
+                yield trades
@@ -11,7 +11,11 @@ class OrderModel(db.Model):
     amount = db.Column(db.Integer, nullable=False)
     type = db.Column(db.String(10), nullable=False)
     price = db.Column(db.Float, nullable=True)  # None for market-*
-    timestamp = db.Column(db.String(20), nullable=False)
+    stop_price = db.Column(db.Float, nullable=True)  # None but for stop-*
+    account = db.Column(db.String(32), nullable=True)
+    expire_at = db.Column(db.DateTime, nullable=True)  # None for good till canceled
+    seq = db.Column(db.BigInteger)  # time priority, null until the engine accepts the order
+    timestamp = db.Column(db.BigInteger, nullable=False)  # nanoseconds
 
 
 class TradeModel(db.Model):
@@ -19,8 +23,17 @@ class TradeModel(db.Model):
 
     id = db.Column(db.Integer, primary_key=True)
     order_id = db.Column(db.Integer, nullable=False)
+    symbol = db.Column(db.String(10), nullable=True)
     order_type = db.Column(db.String(10), nullable=False)
     price = db.Column(db.Float, nullable=False)
     amount = db.Column(db.Integer, nullable=False)
     status = db.Column(db.String(20), nullable=False)
-    timestamp = db.Column(db.String(20), nullable=False)
+    timestamp = db.Column(db.BigInteger, nullable=False)  # nanoseconds
+
+
+class AccountModel(db.Model):
+    __tablename__ = 'accounts'
+
+    id = db.Column(db.String(32), primary_key=True)
+    cash = db.Column(db.BigInteger, nullable=False)  # cents
+    positions = db.Column(db.Text, nullable=False)  # json: {symbol_id: amount}
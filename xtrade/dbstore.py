@@ -0,0 +1,93 @@
+"""Stores backed by the database, see `xtrade.db`.
+
+Kept apart from the matching core so that `xtrade.order`, `xtrade.manager` and
+`xtrade.account` import without Flask nor SQLAlchemy.
+"""
+import json
+
+from .account import LedgerStore
+from .db import OrderModel, TradeModel, AccountModel
+from .manager import TradeStore, Trade
+from .order import OrderStore, get_order_class
+
+
+class DBOrderStore(OrderStore):
+    def __init__(self, db):
+        self.db = db
+
+    @property
+    def next_id(self):
+        order = self.db.session.query(OrderModel).order_by(OrderModel.id.desc()).first()
+        current_id = order and order.id or 0
+        return current_id + 1
+
+    def get(self, order_id):
+        order_model = self.db.session.query(OrderModel).filter(OrderModel.id == order_id).one()
+        klass = get_order_class(order_model.type)
+        return klass(order_id, order_model.symbol, order_model.amount,
+                     order_model.timestamp, order_model.price, order_model.stop_price, order_model.account,
+                     order_model.expire_at, order_model.seq)
+
+    def accept(self, order):
+        self.db.session.query(OrderModel).filter(OrderModel.id == order.id).update({'seq': order.seq})
+        self.db.session.commit()
+
+    def _save(self, order):
+        self.db.session.add(
+            OrderModel(id=order.id, symbol=order.symbol, amount=order.amount,
+                       type=order.TYPE, price=order.price, timestamp=order.timestamp,
+                       stop_price=order.stop_price, account=order.account, expire_at=order.expire_at,
+                       seq=order.seq))
+        self.db.session.commit()
+
+
+class DBTradeStore(TradeStore):
+    def __init__(self, db):
+        self.db = db
+
+    def get(self, order_id):
+        trades = self.db.session.query(TradeModel).filter(TradeModel.order_id == order_id).all()
+        return [self._decode(t) for t in trades]
+
+    def _decode(self, trade_model):
+        return Trade(trade_model.id, trade_model.order_id, trade_model.order_type,
+                     trade_model.price, trade_model.amount, trade_model.status, trade_model.timestamp,
+                     trade_model.symbol)
+
+    def _encode(self, trade):
+        return TradeModel(id=trade.id, order_id=trade.order_id, order_type=trade.order_type,
+                          price=trade.price, amount=trade.amount, status=trade.status,
+                          timestamp=trade.timestamp, symbol=trade.symbol)
+
+    def _save(self, trade):
+        self.db.session.add(self._encode(trade))
+        self.db.session.commit()
+
+    def _save_all(self, trades):
+        self.db.session.add_all([self._encode(trade) for trade in trades])
+        self.db.session.commit()
+
+    @property
+    def next_id(self):
+        trade = self.db.session.query(TradeModel).order_by(TradeModel.id.desc()).first()
+        current_id = trade and trade.id or 0
+        return current_id + 1
+
+    def _next_ids(self, count):
+        first_id = self.next_id
+        return range(first_id, first_id + count)
+
+
+class DBLedgerStore(LedgerStore):
+    def __init__(self, db):
+        self.db = db
+
+    def load(self):
+        return [{'id': model.id, 'cash': model.cash, 'positions': json.loads(model.positions)}
+                for model in self.db.session.query(AccountModel)]
+
+    def save(self, rows):
+        for row in rows:
+            self.db.session.merge(AccountModel(id=row['id'], cash=row['cash'],
+                                               positions=json.dumps(row['positions'], sort_keys=True)))
+        self.db.session.commit()
@@ -1,11 +1,24 @@
+import threading
+
+
 class Event(object):
-    pass
+    # stamped by the engine when it accepts the event, see `xtrade.clock.Sequencer`
+    seq = None
+    timestamp = None  # nanoseconds
+
+    def encode(self):
+        """Return the event as a json-serializable dict, see `decode_event`."""
+        return {'type': self.__class__.__name__,
+                'data': {k: v for k, v in vars(self).items() if not k.startswith('_')}}
 
 
 class OrderEvent(Event):
     def __init__(self, order_id):
         self.order_id = order_id
 
+    def __repr__(self):
+        return '%s<%s>' % (self.__class__.__name__, self.order_id)
+
 
 class NewOrderEvent(OrderEvent):
     pass
@@ -15,3 +28,76 @@ class CancelOrderEvent(OrderEvent):
     pass
 
 
+class AmendOrderEvent(OrderEvent):
+    """Change the amount and/or the price of a resting order, None to keep it."""
+
+    def __init__(self, order_id, amount=None, price=None):
+        super().__init__(order_id)
+        self.amount = amount
+        self.price = price
+
+
+class MassCancelEvent(Event):
+    """Cancel all the orders of a `symbol` and/or an `account`, of one `side` ('buy' or 'sell') or both.
+
+    The ids of the orders canceled are handed back through `wait`.
+    """
+    _done = None  # not there once decoded, nobody waits for a replicated event
+
+    def __init__(self, symbol=None, side=None, account=None):
+        self.symbol = symbol
+        self.side = side
+        self.account = account
+        self._done = threading.Event()
+        self._result = None
+
+    def set_result(self, order_ids):
+        if self._done is not None:
+            self._result = order_ids
+            self._done.set()
+
+    def wait(self, timeout=None):
+        """Return the ids of the orders canceled, None if not processed within `timeout` seconds."""
+        if self._done.wait(timeout):
+            return self._result
+        return None
+
+    def __repr__(self):
+        return '%s<%s, %s, %s>' % (self.__class__.__name__, self.symbol, self.side, self.account)
+
+
+class ExpireEvent(Event):
+    """Cancel the orders whose expiry time has come, decided by the primary engine."""
+
+    def __init__(self, order_ids):
+        self.order_ids = order_ids
+
+    def __repr__(self):
+        return '%s<%s>' % (self.__class__.__name__, len(self.order_ids))
+
+
+class AuctionEvent(Event):
+    """Start (`phase` "open") or close (`phase` "uncross") the call auction of a symbol."""
+    OPEN = 'open'
+    UNCROSS = 'uncross'
+
+    def __init__(self, symbol, phase):
+        self.symbol = symbol
+        self.phase = phase
+
+    def __repr__(self):
+        return '%s<%s, %s>' % (self.__class__.__name__, self.symbol, self.phase)
+
+
+def _event_types(cls=Event):
+    for klass in cls.__subclasses__():
+        yield klass
+        for sub_klass in _event_types(klass):
+            yield sub_klass
+
+
+def decode_event(data):
+    klass = {klass.__name__: klass for klass in _event_types()}[data['type']]
+    event = klass.__new__(klass)
+    event.__dict__.update(data['data'])
+    return event
@@ -6,4 +6,18 @@ class InvalidRequestBody(InvalidRequest):
     pass
 
 
+class Rejected(Exception):
+    """The request is valid but can not be accepted right now."""
+    status_code = 503
 
+    def __init__(self, message, retry_after=1):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class EngineBusy(Rejected):
+    status_code = 503
+
+
+class RateLimited(Rejected):
+    status_code = 429
@@ -1,33 +1,30 @@
-from datetime import datetime
 import heapq
 import logging
 import threading
 
-from .event import NewOrderEvent, CancelOrderEvent
+from .account import InsufficientFunds
+from .archive import Retention, encode_time, decode_time
+from .book import BookSnapshot, SnapshotPublisher
+from .clock import WALL_CLOCK
+from .event import (Event, NewOrderEvent, CancelOrderEvent, AmendOrderEvent, AuctionEvent, MassCancelEvent,
+                    ExpireEvent)
+from .order import encode_order, decode_order
+from .profiling import EventTrace
 from .symbol import get_symbol_price_range, get_symbol_price
-from .db import TradeModel
 
 
 LOG = logging.getLogger(__name__)
 
-_id = 0
-
-
-def get_trade_id():
-    global _id
-    _id += 1
-    return _id
-
-
 class Trade(object):
-    def __init__(self, id_, order_id, order_type, price, amount, status):
+    def __init__(self, id_, order_id, order_type, price, amount, status, timestamp=None, symbol=None):
         self.id = id_
         self.order_id = order_id
         self.order_type = order_type
         self.price = price
         self.amount = amount
         self.status = status
-        self.timestamp = datetime.now()
+        self.timestamp = timestamp or WALL_CLOCK.time_ns()  # nanoseconds
+        self.symbol = symbol
 
     @property
     def is_done(self):
@@ -42,88 +39,204 @@ class Trade(object):
             self.__class__.__name__, self.order_id, self.order_type, self.price, self.amount, self.status)
 
 
+def encode_trade(trade):
+    return {'id': trade.id, 'order_id': trade.order_id, 'order_type': trade.order_type, 'price': trade.price,
+            'amount': trade.amount, 'status': trade.status, 'timestamp': encode_time(trade.timestamp),
+            'symbol': trade.symbol}
+
+
+def decode_trade(data):
+    return Trade(data['id'], data['order_id'], data['order_type'], data['price'], data['amount'], data['status'],
+                 decode_time(data['timestamp']), data.get('symbol'))
+
+
+class Fill(object):
+    """One match between a BuyOrder and a SellOrder.
+
+    `buy_left` and `sell_left` are the amounts left of each order after this fill.
+    """
+    def __init__(self, buy_order, sell_order, price, amount, buy_left, sell_left, timestamp=None):
+        self.buy_order = buy_order
+        self.sell_order = sell_order
+        self.price = price
+        self.amount = amount
+        self.buy_left = buy_left
+        self.sell_left = sell_left
+        self.timestamp = timestamp  # nanoseconds
+
+    def __repr__(self):
+        return "%s<%s, %s, %s, %s>" % (
+            self.__class__.__name__, self.buy_order.id, self.sell_order.id, self.price, self.amount)
+
+
+class ExecutionReport(object):
+    """All the fills caused by one incoming order."""
+    def __init__(self, order, timestamp, seq=None):
+        self.order = order
+        self.fills = []
+        self.trades = []
+        self.canceled = None  # the cancel trade of what is left, for orders never resting
+        self.triggered = []  # reports of the stop orders released after this one
+        self.finished = []  # ids of the orders done by this report
+        self.timestamp = timestamp  # nanoseconds
+        self.seq = seq  # of the event, see `xtrade.clock.Sequencer`
+
+    def add_fill(self, order, other, price, amount, amount_left):
+        other_left = other.amount - amount
+        if order.is_buy:
+            fill = Fill(order, other, price, amount, amount_left, other_left, self.timestamp)
+        else:
+            fill = Fill(other, order, price, amount, other_left, amount_left, self.timestamp)
+        self.fills.append(fill)
+        return fill
+
+    @property
+    def amount(self):
+        return sum(fill.amount for fill in self.fills)
+
+
+class AuctionReport(ExecutionReport):
+    """All the fills of the uncrossing of a call auction, at the single clearing `price`."""
+    def __init__(self, symbol, price, timestamp, seq=None):
+        super().__init__(None, timestamp, seq)
+        self.symbol = symbol
+        self.price = price
+        self.canceled = []  # the cancel trades of the market orders left
+
+
 class TradeStore(object):
+    clock = WALL_CLOCK
 
     def get(self, order_id):
         raise NotImplementedError()
 
     def do_trade(self, order, price, amount):
+        trade = self._make_trade(self.next_id, order, price, amount, order.amount - amount)
+        self._save(trade)
+        return trade
+
+    def do_trades(self, fills):
+        """Save the trades of both sides of all the `fills` as one batch."""
+        ids = iter(self._next_ids(len(fills) * 2))
+        trades = []
+        for fill in fills:
+            trades.append(self._make_trade(next(ids), fill.buy_order, fill.price, fill.amount, fill.buy_left,
+                                           fill.timestamp))
+            trades.append(self._make_trade(next(ids), fill.sell_order, fill.price, fill.amount, fill.sell_left,
+                                           fill.timestamp))
+        self._save_all(trades)
+        return trades
+
+    def amend_order(self, order, timestamp=None):
+        """Record the amount and price `order` was amended to."""
+        trade = Trade(self.next_id, order.id, order.TYPE, order.price, order.amount, 'amended',
+                      timestamp or self.clock.time_ns(), order.symbol)
+        self._save(trade)
+        return trade
+
+    def _make_trade(self, id_, order, price, amount, amount_left, timestamp=None):
         status = 'all_done'
-        if order.amount > amount:
+        if amount_left:
             status = 'partial_done'
-        trade = Trade(self.next_id, order.id, order.TYPE, price, amount, status)
+        return Trade(id_, order.id, order.TYPE, price, amount, status, timestamp or self.clock.time_ns(),
+                     order.symbol)
+
+    def cancel_order(self, order, filled, timestamp=None):
+        """Record what is left of `order` as canceled, `filled` being the amount it traded before."""
+        trade = self._make_cancel(self.next_id, order, filled, timestamp)
         self._save(trade)
         return trade
 
-    def cancel_order(self, order, orig_amount):
+    def cancel_orders(self, orders, timestamp=None):
+        """Save the cancel trades of all the `(order, filled)` of `orders` as one batch."""
+        trades = [self._make_cancel(id_, order, filled, timestamp)
+                  for id_, (order, filled) in zip(self._next_ids(len(orders)), orders)]
+        self._save_all(trades)
+        return trades
+
+    def _make_cancel(self, id_, order, filled, timestamp=None):
         status = 'left_cancel'
-        if order.amount >= orig_amount:
+        if not filled:
             status = 'all_cancel'
-        trade = Trade(self.next_id, order.id, order.TYPE, order.price, order.amount, status)
-        self._save(trade)
-        return trade
+        return Trade(id_, order.id, order.TYPE, order.price, order.amount, status,
+                     timestamp or self.clock.time_ns(), order.symbol)
+
+    def finish(self, order_ids):
+        """Called once the orders are done: no more trade will happen to them."""
+        pass
 
     def _save(self, trade):
         raise NotImplementedError()
 
+    def _save_all(self, trades):
+        for trade in trades:
+            self._save(trade)
+
     @property
     def next_id(self):
         raise NotImplementedError()
 
+    def _next_ids(self, count):
+        return [self.next_id for _ in range(count)]
 
-class MemTradeStore(TradeStore):
-
-    def __init__(self):
-        self._data = {}  # order_id => [Trade]
-
-    def get(self, order_id):
-        return self._data.get(order_id, [])
-
-    def _save(self, trade):
-        self._data.setdefault(trade.order_id, []).append(trade)
 
-    @property
-    def next_id(self):
-        return get_trade_id()
+class MemTradeStore(TradeStore):
+    """Keep the trades in memory.
 
+    With a `retention` policy the trades of finished orders are moved out of
+    memory into `archive`, where they can still be found by order id.
+    """
 
-class DBTradeStore(TradeStore):
-    def __init__(self, db):
-        self.db = db
+    def __init__(self, retention=None, archive=None, clock=None):
+        self._data = {}  # order_id => [Trade]
+        self._id = 0
+        self._retention = retention and Retention(retention)
+        self._archive = archive
+        if clock is not None:
+            self.clock = clock
 
     def get(self, order_id):
-        trades = self.db.session.query(TradeModel).filter(TradeModel.order_id == order_id).all()
-        return [self._decode(t) for t in trades]
-
-    def _decode(self, trade_model):
-        return Trade(trade_model.id, trade_model.order_id, trade_model.order_type,
-                     trade_model.price, trade_model.amount, trade_model.status)
+        try:
+            return self._data[order_id]
+        except KeyError:
+            pass
+        if self._archive is not None:
+            try:
+                return [decode_trade(t) for t in self._archive.get('trades', order_id)]
+            except KeyError:
+                pass
+        return []
 
-    def _encode(self, trade):
-        return TradeModel(id=trade.id, order_id=trade.order_id, order_type=trade.order_type,
-                          price=trade.price, amount=trade.amount, status=trade.status,
-                          timestamp=trade.timestamp)
+    def finish(self, order_ids):
+        if self._retention is None:
+            return
+        for order_id in self._retention.finish(order_ids):
+            trades = self._data.pop(order_id, None)
+            if trades is not None and self._archive is not None:
+                self._archive.put('trades', order_id, [encode_trade(t) for t in trades])
 
     def _save(self, trade):
-        self.db.session.add(self._encode(trade))
-        self.db.session.commit()
+        self._data.setdefault(trade.order_id, []).append(trade)
 
     @property
     def next_id(self):
-        trade = self.db.session.query(TradeModel).order_by(TradeModel.id.desc()).first()
-        current_id = trade and trade.id or 0
-        return current_id + 1
+        self._id += 1
+        return self._id
 
 
 class TradeManager(threading.Thread):
+    COMPACT_THRESHOLD = 1000
+
     def __init__(self, message_queue, trade_store, order_store, timeout=1,
-                 trade_log_file='trade.log', order_log_file='order.log', depth_log_file='depth.log'):
+                 trade_log_file='trade.log', order_log_file='order.log', depth_log_file='depth.log',
+                 trade_archive=None, clock=None, profiler=None, slow_event_threshold=None,
+                 replicator=None, snapshots=None, snapshot_depth=100, ledger=None):
         super().__init__()
         self.daemon = True
-        self._buy_queue_map = {}  # symbol_id => []
-        self._sell_queue_map = {}  # symbol_id => []
-        self._symbol_price_map = {}  # symbol_id => price
-        self._order_map = {}  # unfinished orders: order_id => order
+        self._reset_book()
+        self._changed = set()  # symbols changed since the last snapshot
+        self._seq = None  # seq and timestamp of the event being processed
+        self._timestamp = None
         self.msg_queue = message_queue  # read_only
         self.trade_store = trade_store  # write_only
         self.order_store = order_store  # read_only
@@ -131,28 +244,196 @@ class TradeManager(threading.Thread):
         self.trade_log_file = trade_log_file
         self.order_log_file = order_log_file
         self.depth_log_file = depth_log_file
+        self.trade_archive = trade_archive  # write_only, see `xtrade.columnar.ColumnarTradeWriter`
+        self.clock = clock or WALL_CLOCK
+        self.profiler = profiler  # see `xtrade.profiling.EngineProfiler`
+        if profiler is not None:
+            profiler.thread = self
+        self.slow_event_threshold = slow_event_threshold  # seconds, log the events slower than it
+        self._trace = None
+        self.replicator = replicator  # see `xtrade.replication.ReplicationPublisher`
+        if replicator is not None:
+            replicator.manager = self
+        self.snapshots = snapshots or SnapshotPublisher()  # read_only for the others
+        self.snapshot_depth = snapshot_depth
+        self.ledger = ledger  # see `xtrade.account.Ledger`
+        self.following = False  # True for a replica: orders only expire by the ExpireEvents of the primary
+
+    def _reset_book(self):
+        self._buy_queue_map = {}  # symbol_id => []
+        self._sell_queue_map = {}  # symbol_id => []
+        self._symbol_price_map = {}  # symbol_id => price
+        self._order_map = {}  # unfinished orders: order_id => order
+        self._stale = 0  # canceled orders still in the queues
+        self._levels = {}  # symbol_id => ({price: amount} of buy orders, {price: amount} of sell orders)
+        # stop orders by trigger price, the nearest first:
+        # symbol_id => ([(stop_price, seq, order)] of buy orders, [(-stop_price, seq, order)] of sell orders)
+        self._stop_queue_map = {}
+        self._stop_seq = 0
+        self._auctions = set()  # symbols in a call auction: orders are collected, not matched
+        self._market_amounts = {}  # symbol_id => [buy amount, sell amount] of market orders resting in an auction
+        # unfinished orders by symbol and by account, for mass cancels
+        self._indexed = {}  # order_id => (symbol_id, account)
+        self._filled = {}  # order_id => amount traded so far, of the unfinished orders
+        self._symbol_orders = {}  # symbol_id => {order_id}
+        self._account_orders = {}  # account => {order_id}
+        self._expiries = []  # [(expire_at, order_id)] of the resting orders not good till canceled
+
+    def dump(self):
+        """Return the state of the book between two events as a json-serializable dict, see `load`."""
+        stops = sorted((entry for queues in self._stop_queue_map.values() for queue in queues for entry in queue
+                        if self._order_map.get(entry[2].id) is entry[2]), key=lambda entry: entry[1])
+        return {
+            # stop orders last, in the order they were added to the trigger book
+            'orders': [encode_order(order) for order in self._order_map.values() if not order.STOP] +
+                      [encode_order(order) for _, _, order in stops],
+            'filled': sorted(self._filled.items()),
+            'prices': self._symbol_price_map,
+            'auctions': sorted(self._auctions),
+            'seq': self._seq,
+            'timestamp': self._timestamp,
+        }
+
+    def load(self, state):
+        """Replace the book by `state`, returned by `dump`."""
+        changed = set(self._levels) | set(self._symbol_price_map)
+        self._reset_book()
+        for data in state['orders']:
+            order = decode_order(data)
+            self._index_order(order)
+            if order.STOP:
+                self._add_stop(order)
+            else:
+                self._add_order(order)
+        self._filled = dict(state['filled'])
+        self._symbol_price_map = dict(state['prices'])
+        self._auctions = set(state['auctions'])
+        if state['seq'] is not None:
+            self.clock.sequencer.advance(state['seq'], state['timestamp'])
+        self._changed |= changed | set(self._levels) | set(self._symbol_price_map)
+        self._publish_snapshots()
 
     def run(self):
         while True:
-            try:
-                event = self._get_event()
-                if isinstance(event, NewOrderEvent):
-                    order = self._get_order(event.order_id)
-                    self._add_order(order)
-                    self._running_trade(order.symbol)
-                elif isinstance(event, CancelOrderEvent):
-                    self._remove_order(event.order_id)
-                elif event == 'timeout':
-                    LOG.debug('timeout')
-                else:
-                    LOG.warning('unknonw event: %s', event)
-            except Exception as e:
-                LOG.exception(e)
-            finally:
+            self.handle_event(self._get_event())
+
+    def handle_event(self, event):
+        """Process one event on the calling thread and return its result."""
+        session = self.profiler and self.profiler.enter()
+        if self.slow_event_threshold is not None:
+            self._trace = EventTrace(event)
+        try:
+            if self._expiries and not self.following:
+                # before matching, so that no expired order trades
+                self._expire_due()
+            if isinstance(event, Event):
+                self._stamp(event)
+            if isinstance(event, NewOrderEvent):
+                order = self._get_order(event.order_id)
+                order.seq = event.seq
+                self._mark('lookup')
+                self.order_store.accept(order)
+                self._mark('persistence')
+                self._replicate(event, order)
+                report = self._process_order(order)
+                report.triggered = self._release_stops(order.symbol)
+                return report
+            elif isinstance(event, CancelOrderEvent):
+                self._replicate(event)
+                return self._remove_order(event.order_id)
+            elif isinstance(event, AmendOrderEvent):
+                self._replicate(event)
+                return self._amend_order(event)
+            elif isinstance(event, MassCancelEvent):
+                self._replicate(event)
+                trades = self._mass_cancel(event)
+                event.set_result([trade.order_id for trade in trades])
+                return trades
+            elif isinstance(event, ExpireEvent):
+                self._replicate(event)
+                return self._expire_orders(event)
+            elif isinstance(event, AuctionEvent):
+                self._replicate(event)
+                if event.phase == AuctionEvent.OPEN:
+                    LOG.info('%s: call auction opened', event.symbol)
+                    self._auctions.add(event.symbol)
+                    return None
+                return self._uncross(event.symbol)
+            elif event == 'timeout':
+                # the orders due are expired above, even with no event coming
+                LOG.debug('timeout')
+                if self.ledger is not None:
+                    self.ledger.flush()
+            else:
+                LOG.warning('unknonw event: %s', event)
+        except Exception as e:
+            LOG.exception(e)
+        finally:
+            if self.depth_log_file:
                 try:
                     self._write_depth_log()
                 except Exception as e:
                     LOG.error('error when write depth log: %s', e, exc_info=True)
+                self._mark('logging')
+            if self._changed:
+                self._publish_snapshots()
+            if self.profiler is not None:
+                self.profiler.exit(session)
+            self._check_trace()
+
+    def _stamp(self, event):
+        """Give `event` its seq and timestamp, or follow those given by the primary engine."""
+        if event.seq is None:
+            event.seq, event.timestamp = self.clock.sequencer.next()
+        else:
+            self.clock.sequencer.advance(event.seq, event.timestamp)
+        self._seq, self._timestamp = event.seq, event.timestamp
+
+    def _tick(self):
+        """Return a new timestamp within the current event, for an order it triggers."""
+        self._timestamp += 1
+        self.clock.sequencer.advance(self._seq, self._timestamp)
+        return self._timestamp
+
+    def _replicate(self, event, order=None):
+        if self.replicator is not None:
+            self.replicator.publish(event, order)
+
+    def _mark(self, phase):
+        if self._trace is not None:
+            self._trace.mark(phase)
+
+    def _check_trace(self):
+        trace, self._trace = self._trace, None
+        if trace is not None and trace.total >= self.slow_event_threshold:
+            LOG.warning('slow event %s', trace)
+
+    def _publish_snapshots(self):
+        """Publish a new snapshot of the price levels of the symbols changed."""
+        snapshots = []
+        for symbol_id in self._changed:
+            buy_levels, sell_levels = self._levels.get(symbol_id, ({}, {}))
+            snapshots.append(BookSnapshot(
+                symbol_id,
+                tuple(heapq.nlargest(self.snapshot_depth, buy_levels.items())),
+                tuple(heapq.nsmallest(self.snapshot_depth, sell_levels.items())),
+                self._symbol_price_map.get(symbol_id)))
+        self._changed = set()
+        self.snapshots.publish(snapshots)
+
+    def _change_level(self, order, amount):
+        """Add `amount`, negative to remove, to the price level of a resting order."""
+        self._changed.add(order.symbol)
+        if order.MARKET:
+            # market orders only rest during a call auction
+            self._market_amounts.setdefault(order.symbol, [0, 0])[order.is_sell] += amount
+            return
+        levels = self._levels.setdefault(order.symbol, ({}, {}))[order.is_sell]
+        amount += levels.get(order.price, 0)
+        if amount:
+            levels[order.price] = amount
+        else:
+            del levels[order.price]
 
     def _get_order(self, order_id):
         """Get the original order."""
@@ -167,6 +448,7 @@ class TradeManager(threading.Thread):
 
     def _add_order(self, order):
         self._order_map[order.id] = order
+        self._change_level(order, order.amount)
         if order.is_sell:
             sell_queue = self._sell_queue_map.setdefault(order.symbol, [])
             heapq.heappush(sell_queue, order)
@@ -182,46 +464,415 @@ class TradeManager(threading.Thread):
             LOG.warning('Order<%s> already finished', order_id)
             return
         LOG.info('%s canceled', order)
-        orig_order = self._get_order(order_id)
-        trade = self.trade_store.cancel_order(order, orig_order.amount)
-        self._write_order_log(trade)
+        trade = self.trade_store.cancel_order(order, self._filled.get(order_id, 0), self._timestamp)
+        self._mark('persistence')
+        self._write_order_log([trade])
+        self._mark('logging')
+        self._finish_orders([order_id])
+        if self._rests(order):
+            if not order.STOP:
+                self._change_level(order, -order.amount)
+            self._stale += 1
+            if self._stale > max(len(self._order_map), self.COMPACT_THRESHOLD):
+                self._compact_queues()
+        return trade
+
+    def _rests(self, order):
+        """Return True if what is left of `order` after matching stays in the book.
+
+        Market orders only rest in a call auction, until the uncrossing: out of
+        it what they can't fill at once is canceled, like IOC orders.
+        """
+        return order.RESTING and (order.STOP or not order.MARKET or order.symbol in self._auctions)
+
+    def _amend_order(self, event):
+        """Amend a resting order in a single event.
+
+        Reducing the amount keeps the order's time priority, any other change
+        takes it out of the book and queues it again as a new arrival.
+        """
+        order = self._order_map.get(event.order_id)
+        if order is None or not order.RESTING or order.STOP:
+            LOG.warning('Order<%s> not in the book, can not be amended', event.order_id)
+            return None
+        amount = order.amount if event.amount is None else event.amount
+        price = order.price if event.price is None else event.price
+        if amount <= 0 or (order.MARKET and price != order.price):
+            LOG.warning('%s: invalid amendment, amount: %s, price: %s', order, amount, price)
+            return None
+        if self.ledger is not None:
+            try:
+                self.ledger.amend(order.id, amount, event.price)
+            except InsufficientFunds as e:
+                LOG.warning('%s: amendment rejected, %s', order, e)
+                return None
+        self._change_level(order, -order.amount)
+        keep_priority = price == order.price and amount <= order.amount
+        if keep_priority:
+            # the same seq keeps the place in the queue
+            amended = order.reduce(order.amount - amount)
+            self._add_order(amended)
+        else:
+            amended = order.__class__(order.id, order.symbol, amount, self._timestamp, price,
+                                      account=order.account, expire_at=order.expire_at, seq=self._seq)
+        # the order left in the queue is skipped from now on
+        self._stale += 1
+        LOG.info('%s amended to %s', order, amended)
+        trade = self.trade_store.amend_order(amended, self._timestamp)
+        self._write_order_log([trade])
+        if not keep_priority:
+            self._process_order(amended)
+            self._release_stops(amended.symbol)
+        return trade
+
+    def _index_order(self, order):
+        if order.id in self._indexed:
+            return
+        self._indexed[order.id] = (order.symbol, order.account)
+        if order.expire_at is not None and order.RESTING:
+            heapq.heappush(self._expiries, (order.expire_at, order.id))
+        self._symbol_orders.setdefault(order.symbol, set()).add(order.id)
+        if order.account is not None:
+            self._account_orders.setdefault(order.account, set()).add(order.id)
+
+    def _mass_cancel(self, event):
+        """Cancel all the orders of `event.symbol` and/or `event.account`, on `event.side` if given.
+
+        Only the orders indexed under the symbol or the account are visited, and
+        their cancel trades are saved as one batch.
+        """
+        if event.account is not None:
+            order_ids = self._account_orders.get(event.account, ())
+        else:
+            order_ids = self._symbol_orders.get(event.symbol, ())
+        orders = []
+        for order_id in sorted(order_ids):
+            order = self._order_map.get(order_id)
+            if order is None:
+                continue
+            if event.symbol is not None and order.symbol != event.symbol:
+                continue
+            if event.side is not None and order.is_buy != (event.side == 'buy'):
+                continue
+            orders.append(order)
+        LOG.info('%s: %s orders canceled', event, len(orders))
+        return self._cancel_orders(orders)
 
-    def _running_trade(self, symbol_id):
-        """Check all the BuyOrders and the SellOrders until no trade is available."""
+    def _expire_due(self):
+        """Expire the orders whose expiry time has come, as an ExpireEvent of its own.
+
+        The event is replicated like any other, so the replicas expire the same
+        orders at the same point of the event stream, whatever their clock.
+        """
+        now = self.clock.now()
+        order_ids = []
+        while self._expiries and self._expiries[0][0] <= now:
+            _, order_id = heapq.heappop(self._expiries)
+            if order_id in self._order_map:
+                order_ids.append(order_id)
+        if order_ids:
+            event = ExpireEvent(order_ids)
+            self._stamp(event)
+            self._replicate(event)
+            self._expire_orders(event)
+
+    def _expire_orders(self, event):
+        """Cancel the orders of `event` still in the book, in one batch."""
+        orders = [self._order_map[order_id] for order_id in event.order_ids if order_id in self._order_map]
+        LOG.info('%s orders expired', len(orders))
+        return self._cancel_orders(orders)
+
+    def _cancel_orders(self, orders):
+        """Take the resting `orders` out of the book and save their cancel trades as one batch."""
+        if not orders:
+            return []
+        for order in orders:
+            del self._order_map[order.id]
+            if not order.STOP:
+                self._change_level(order, -order.amount)
+        self._stale += len(orders)
+        self._mark('matching')
+        trades = self.trade_store.cancel_orders([(order, self._filled.get(order.id, 0)) for order in orders],
+                                                self._timestamp)
+        self._mark('persistence')
+        self._write_order_log(trades)
+        self._mark('logging')
+        self._finish_orders([order.id for order in orders])
+        if self._stale > max(len(self._order_map), self.COMPACT_THRESHOLD):
+            self._compact_queues()
+        return trades
+
+    def _finish_orders(self, order_ids):
+        for order_id in order_ids:
+            symbol_id, account = self._indexed.pop(order_id, (None, None))
+            self._filled.pop(order_id, None)
+            if symbol_id is not None:
+                self._symbol_orders[symbol_id].discard(order_id)
+            if account is not None:
+                self._account_orders[account].discard(order_id)
+        self.order_store.finish(order_ids)
+        self.trade_store.finish(order_ids)
+        if self.ledger is not None:
+            self.ledger.release(order_ids)
+
+    def _compact_queues(self):
+        """Drop the canceled orders left in the queues."""
+        for queue_map in (self._buy_queue_map, self._sell_queue_map):
+            for queue in queue_map.values():
+                queue[:] = [order for order in queue if self._order_map.get(order.id) is order]
+                heapq.heapify(queue)
+        for queues in self._stop_queue_map.values():
+            for queue in queues:
+                queue[:] = [entry for entry in queue if self._order_map.get(entry[2].id) is entry[2]]
+                heapq.heapify(queue)
+        self._expiries[:] = [entry for entry in self._expiries if entry[1] in self._order_map]
+        heapq.heapify(self._expiries)
+        self._stale = 0
+
+    def _add_stop(self, order):
+        """Put a stop order into the trigger book of its symbol."""
+        self._order_map[order.id] = order
+        self._stop_seq += 1
+        buy_stops, sell_stops = self._stop_queue_map.setdefault(order.symbol, ([], []))
+        if order.is_buy:
+            heapq.heappush(buy_stops, (order.stop_price, self._stop_seq, order))
+        else:
+            heapq.heappush(sell_stops, (-order.stop_price, self._stop_seq, order))
+
+    def _pop_triggered(self, symbol_id):
+        """Pop the next stop order reached by the last price of `symbol_id`, or None."""
+        price = self._symbol_price_map.get(symbol_id)
+        queues = self._stop_queue_map.get(symbol_id)
+        if price is None or queues is None:
+            return None
+        buy_stops, sell_stops = queues
+        for queue, key in ((buy_stops, price), (sell_stops, -price)):
+            while queue and queue[0][0] <= key:
+                _, _, order = heapq.heappop(queue)
+                if self._order_map.get(order.id) is order:
+                    return order
+        return None
+
+    def _release_stops(self, symbol_id):
+        """Release the stop orders crossed by the last price into matching, in trigger order.
+
+        Only the crossed orders are visited; the trades they make may trigger more of them.
+        """
+        reports = []
+        while True:
+            order = self._pop_triggered(symbol_id)
+            if order is None:
+                return reports
+            LOG.info('%s triggered at %s', order, self._symbol_price_map[symbol_id])
+            # part of the event that triggered it, right after it
+            reports.append(self._process_order(order.trigger(self._seq, self._tick())))
+
+    def _process_order(self, order):
+        """Match an incoming order against the book as one unit of work.
+
+        What is left of the order rests in the book, or is canceled if the order
+        type never rests.
+        """
+        report = ExecutionReport(order, self._timestamp, self._seq)
+        self._index_order(order)
+        if order.STOP:
+            self._add_stop(order)
+            return report
+        if order.symbol in self._auctions:
+            # collected until the uncrossing, what would never rest is canceled at once
+            if order.RESTING:
+                self._add_order(order)
+            else:
+                self._order_map[order.id] = order
+                report.canceled = self._remove_order(order.id)
+            return report
+        self._order_map[order.id] = order
+        if order.ALL_OR_NONE and self._available_amount(order) < order.amount:
+            LOG.info('%s: not enough liquidity, rejected', order)
+            order_left = order
+        else:
+            order_left = self._sweep(order, report)
+        self._mark('matching')
+        if report.fills:
+            self._save_report(report)
+            self._finish_orders(report.finished)
+        if order_left is None:
+            pass
+        elif self._rests(order):
+            self._add_order(order_left)
+        else:
+            report.canceled = self._remove_order(order_left.id)
+        return report
+
+    def _uncross(self, symbol_id):
+        """Close the call auction of `symbol_id`: fill all the crossing orders at one price, in one batch.
+
+        The price maximizing the volume is found from the price levels, see
+        `xtrade.auction.clearing_price`, then the orders are filled from the
+        top of each side. The market orders left are canceled.
+        """
+        from .auction import clearing_price
+
+        buy_levels, sell_levels = self._levels.get(symbol_id, ({}, {}))
+        market_buy, market_sell = self._market_amounts.get(symbol_id, (0, 0))
+        reference_price = self._symbol_price_map.get(symbol_id)
+        if reference_price is None:
+            reference_price = get_symbol_price(symbol_id)
+        price, volume = clearing_price(buy_levels, sell_levels, market_buy, market_sell, reference_price)
+        LOG.info('%s: call auction uncrossed at %s, volume: %s', symbol_id, price, volume)
+        report = AuctionReport(symbol_id, price, self._timestamp, self._seq)
         buy_queue = self._buy_queue_map.setdefault(symbol_id, [])
         sell_queue = self._sell_queue_map.setdefault(symbol_id, [])
-        while buy_queue and sell_queue:
-            buy_order = self._pop_order(buy_queue)
-            if buy_order is None:
+        if volume:
+            self._symbol_price_map[symbol_id] = price
+            self._cross(buy_queue, sell_queue, price, volume, report)
+            self._mark('matching')
+            self._save_report(report)
+            self._finish_orders(report.finished)
+        for queue in (buy_queue, sell_queue):
+            while True:
+                order = self._pop_order(queue)
+                if order is None:
+                    break
+                if not order.MARKET:
+                    self._push_order(queue, order)
+                    break
+                report.canceled.append(self._remove_order(order.id))
+        # after the market orders left are taken out of the auction amounts
+        self._auctions.discard(symbol_id)
+        report.triggered = self._release_stops(symbol_id)
+        return report
+
+    def _cross(self, buy_queue, sell_queue, price, volume, report):
+        """Fill `volume` at `price` from the top of both queues, by priority."""
+        buy = sell = None
+        while volume:
+            buy = buy or self._pop_order(buy_queue)
+            sell = sell or self._pop_order(sell_queue)
+            amount = min(volume, buy.amount, sell.amount)
+            volume -= amount
+            report.fills.append(Fill(buy, sell, price, amount, buy.amount - amount, sell.amount - amount,
+                                     report.timestamp))
+            buy = self._reduce_resting(buy, amount, report)
+            sell = self._reduce_resting(sell, amount, report)
+        for order, queue in ((buy, buy_queue), (sell, sell_queue)):
+            if order is not None:
+                self._push_order(queue, order)
+
+    def _reduce_resting(self, order, amount, report):
+        """Take `amount` out of a resting order popped from its queue, return what is left of it."""
+        self._change_level(order, -amount)
+        order_id = order.id
+        order = order.reduce(amount)
+        if order is None:
+            self._order_map.pop(order_id)
+            report.finished.append(order_id)
+        else:
+            self._order_map[order_id] = order
+        return order
+
+    def resting_orders(self, symbol_id, side):
+        """Return the orders resting on the `side` ('buy' or 'sell') of `symbol_id`, by priority."""
+        queue_map = self._buy_queue_map if side == 'buy' else self._sell_queue_map
+        return sorted(order for order in queue_map.get(symbol_id, []) if self._order_map.get(order.id) is order)
+
+    @property
+    def symbols(self):
+        return sorted(set(self._buy_queue_map) | set(self._sell_queue_map))
+
+    def _opposite_queue(self, order):
+        if order.is_sell:
+            return self._buy_queue_map.setdefault(order.symbol, [])
+        return self._sell_queue_map.setdefault(order.symbol, [])
+
+    def _can_trade(self, order, other):
+        if order.is_buy:
+            return order.can_buy(other)
+        return other.can_buy(order)
+
+    def _available_amount(self, order):
+        """Return the amount on the opposite side `order` can trade with, up to `order.amount`.
+
+        Summed from the price levels, not the orders, plus the market orders
+        resting on the opposite side, which match any limit.
+        """
+        available = self._market_amounts.get(order.symbol, (0, 0))[order.is_buy]
+        levels = self._levels.get(order.symbol, ({}, {}))[order.is_buy]
+        for price, amount in levels.items():
+            if available >= order.amount:
                 break
-            sell_order = self._pop_order(sell_queue)
-            if sell_order is None:
-                self._push_order(buy_queue, buy_order)
+            if (price > order.price) if order.is_buy else (price < order.price):
+                continue
+            available += amount
+        return available
+
+    def _sweep(self, order, report):
+        """Trade `order` against the opposite side until it is filled or no price matches.
+
+        Only the resting orders touched are updated in the book, the aggressor is
+        reduced once at the end and the fills are collected into `report`.
+        Return what is left of `order`, or None if it's all done.
+        """
+        queue = self._opposite_queue(order)
+        amount_left = order.amount
+        while amount_left:
+            other = self._pop_order(queue)
+            if other is None:
                 break
-            buy_order, sell_order = self._do_trade(buy_order, sell_order)
-            LOG.debug('buy: %s, sell: %s', buy_order, sell_order)
-            if buy_order and sell_order:
-                LOG.debug('no transaction available')
-                self._push_order(buy_queue, buy_order)
-                self._push_order(sell_queue, sell_order)
+            if not self._can_trade(order, other):
+                LOG.debug('no transaction available: %s, %s', order, other)
+                self._push_order(queue, other)
                 break
-            elif buy_order:
-                self._push_order(buy_queue, buy_order)
-                continue
-            elif sell_order:
-                self._push_order(sell_queue, sell_order)
-                continue
-            else:
-                # the amount just equal
-                pass
+            amount = min(amount_left, other.amount)
+            amount_left -= amount
+            price = self._get_order_trade_price(order, other)
+            # fixme: freeze the `symbol` when the highest or the lowest limit reached
+            self._symbol_price_map[order.symbol] = price
+            report.add_fill(order, other, price, amount, amount_left)
+            other = self._reduce_resting(other, amount, report)
+            if other is not None:
+                self._push_order(queue, other)
+        if not amount_left:
+            self._order_map.pop(order.id)
+            report.finished.append(order.id)
+            return None
+        if amount_left != order.amount:
+            order = order.reduce(order.amount - amount_left)
+            self._order_map[order.id] = order
+        return order
+
+    def _get_order_trade_price(self, order, other):
+        if order.is_buy:
+            return self.get_trade_price(order, other)
+        return self.get_trade_price(other, order)
+
+    def _save_report(self, report):
+        """Persist and log all the fills of `report` in one batch."""
+        LOG.debug('%s: %s fills, amount: %s', report.order, len(report.fills), report.amount)
+        report.trades = self.trade_store.do_trades(report.fills)
+        for fill in report.fills:
+            for order in (fill.buy_order, fill.sell_order):
+                self._filled[order.id] = self._filled.get(order.id, 0) + fill.amount
+        if self.trade_archive is not None:
+            # one row per fill, the trades of both sides come in pairs: buy then sell
+            self.trade_archive.write(
+                (buy.id, fill.buy_order.id, fill.sell_order.id, fill.buy_order.symbol, fill.price,
+                 fill.amount, fill.timestamp, buy.status, sell.status)
+                for fill, buy, sell in zip(report.fills, report.trades[::2], report.trades[1::2]))
+        if self.ledger is not None:
+            self.ledger.apply_fills(report.fills)
+        self._mark('persistence')
+        self._write_trade_log(report.fills)
+        self._write_order_log(report.trades)
+        self._mark('logging')
 
     def _pop_order(self, queue):
         """Pop an order from the queue, which is meant to be of highest priority.
         """
         while queue:
             order = heapq.heappop(queue)
-            if order.id not in self._order_map:
-                LOG.debug('%s: ignored, already canceled.', order)
+            if self._order_map.get(order.id) is not order:
+                LOG.debug('%s: ignored, already canceled or amended.', order)
                 continue
             return order
 
@@ -229,36 +880,6 @@ class TradeManager(threading.Thread):
         """Push an order back into the queue."""
         heapq.heappush(queue, order)
 
-    def _do_trade(self, buy_order, sell_order):
-        """Trade happen when the price of BuyOrder is higher than that of the SellOrder.
-        """
-        if not buy_order.can_buy(sell_order):
-            LOG.debug('%s less than %s', buy_order, sell_order)
-            return buy_order, sell_order
-        buy_order_id, sell_order_id = buy_order.id, sell_order.id
-        amount = min(sell_order.amount, buy_order.amount)
-        price = self.get_trade_price(buy_order, sell_order)
-        # fixme: freeze the `symbol` when the highest or the lowest limit reached
-        # price changed
-        self._symbol_price_map[buy_order.symbol] = price
-        self._write_trade_log(price, amount)
-        LOG.debug('Trade available. amount: %s, price: %s', amount, price)
-        buy_trade = self.trade_store.do_trade(buy_order, price, amount)
-        buy_order = buy_order.reduce(amount)
-        self._write_order_log(buy_trade)
-        if buy_trade.is_done:
-            self._order_map.pop(buy_order_id)
-        else:
-            self._order_map[buy_order_id] = buy_order
-        sell_trade = self.trade_store.do_trade(sell_order, price, amount)
-        sell_order = sell_order.reduce(amount)
-        self._write_order_log(sell_trade)
-        if sell_trade.is_done:
-            self._order_map.pop(sell_order_id)
-        else:
-            self._order_map[sell_order.id] = sell_order
-        return buy_order, sell_order
-
     def get_trade_price(self, buy_order, sell_order):
         """Return the price for this trade."""
         min_price, max_price = get_symbol_price_range(sell_order.symbol)
@@ -268,15 +889,20 @@ class TradeManager(threading.Thread):
             return buy_order.price
         return self._symbol_price_map.get(sell_order.symbol, get_symbol_price(sell_order.symbol))
 
-    def _write_trade_log(self, price, amount):
+    def _write_trade_log(self, fills):
+        if not self.trade_log_file:
+            return
         with open(self.trade_log_file, 'a') as f:
-            f.write('%s %s %s\n' % (datetime.now(), price, amount))
+            f.writelines('%s %s %s %s\n' % (fill.timestamp, fill.buy_order.symbol, fill.price, fill.amount)
+                         for fill in fills)
 
-    def _write_order_log(self, order_trade):
+    def _write_order_log(self, order_trades):
+        if not self.order_log_file:
+            return
         with open(self.order_log_file, 'a') as f:
-            f.write(
+            f.writelines(
                 '%(timestamp)s %(order_id)s %(order_type)s %(price)s '
-                '%(amount)s %(status)s\n' % order_trade.__dict__)
+                '%(amount)s %(status)s\n' % order_trade.__dict__ for order_trade in order_trades)
 
     def _write_depth_log(self):
         def write_log(title_, queue_):
@@ -299,3 +925,11 @@ class TradeManager(threading.Thread):
 
         with open(self.depth_log_file, 'a') as f:
             f.write('\n\n')
+
+
+def __getattr__(name):
+    # the DB-backed store moved to `xtrade.dbstore`, only loaded when asked for
+    if name == 'DBTradeStore':
+        from .dbstore import DBTradeStore
+        return DBTradeStore
+    raise AttributeError('module %r has no attribute %r' % (__name__, name))
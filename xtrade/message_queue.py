@@ -1,23 +1,62 @@
 import queue
+import threading
+import time
+
+
+class QueueFull(Exception):
+    pass
 
 
 class MessageQueue(object):
     def get(self):
         raise NotImplementedError()
 
-    def put(self, event):
+    def put(self, event, force=False):
+        """Enqueue `event`, raise QueueFull if the queue is full, unless `force`."""
         raise NotImplementedError()
 
+    def qsize(self):
+        raise NotImplementedError()
 
-class LocalQueue(MessageQueue):
-    def __init__(self):
-        self._queue = queue.Queue()
-
-    def get(self, timeout=None):
-        return self._queue.get(timeout=timeout)
+    def full(self):
+        raise NotImplementedError()
 
-    def put(self, event):
-        self._queue.put(event)
+    @property
+    def lag(self):
+        """Seconds the oldest pending event has been waiting."""
+        raise NotImplementedError()
 
 
+class LocalQueue(MessageQueue):
+    def __init__(self, maxsize=0):
+        self.maxsize = maxsize
+        # unbounded: `maxsize` is checked in `put`, so that a forced event always gets in
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
 
+    def get(self, timeout=None):
+        _, event = self._queue.get(timeout=timeout)
+        return event
+
+    def put(self, event, force=False):
+        if force or not self.maxsize:
+            self._queue.put((time.monotonic(), event))
+            return
+        with self._lock:
+            if self._queue.qsize() >= self.maxsize:
+                raise QueueFull(self.maxsize)
+            self._queue.put((time.monotonic(), event))
+
+    def qsize(self):
+        return self._queue.qsize()
+
+    def full(self):
+        return bool(self.maxsize) and self._queue.qsize() >= self.maxsize
+
+    @property
+    def lag(self):
+        with self._queue.mutex:
+            if not self._queue.queue:
+                return 0
+            enqueued, _ = self._queue.queue[0]
+        return time.monotonic() - enqueued
@@ -1,7 +1,8 @@
-from datetime import datetime
+from datetime import datetime, time, timedelta, timezone
 import sys
 
-from .db import db, OrderModel
+from .archive import Retention, encode_time, decode_time
+from .clock import WALL_CLOCK
 from .exc import InvalidRequest
 
 
@@ -16,7 +17,50 @@ class OrderNotFound(Exception):
     pass
 
 
+def encode_order(order):
+    return {'id': order.id, 'type': order.TYPE, 'symbol': order.symbol, 'amount': order.amount,
+            'timestamp': encode_time(order.timestamp), 'price': order._price, 'stop_price': order.stop_price,
+            'account': order.account, 'expire_at': encode_time(order.expire_at), 'seq': order.seq}
+
+
+def decode_order(data):
+    klass = _support_types[data['type']]
+    return klass(data['id'], data['symbol'], data['amount'], decode_time(data['timestamp']), data['price'],
+                 data.get('stop_price'), data.get('account'), decode_time(data.get('expire_at')), data.get('seq'))
+
+
+def get_expire_at(time_in_force, now, expire_at=None):
+    """Return when an order placed at `now` expires, None if it is good till canceled.
+
+    `time_in_force` is GTC (good till canceled), DAY (until the end of the day)
+    or GTD (good till `expire_at`). A timezone-aware `expire_at` is returned as
+    naive UTC.
+    """
+    if time_in_force == 'GTC':
+        return None
+    if time_in_force == 'DAY':
+        return datetime.combine(now.date() + timedelta(days=1), time.min)
+    if time_in_force != 'GTD':
+        raise InvalidRequest('expected `time_in_force` as GTC, DAY or GTD. got: %s' % (time_in_force,))
+    if expire_at is None:
+        raise InvalidRequest('miss key: expire_at')
+    if expire_at.tzinfo is not None:
+        # naive UTC, like all the datetimes of the engine
+        expire_at = expire_at.astimezone(timezone.utc).replace(tzinfo=None)
+    if expire_at <= now:
+        raise InvalidRequest('`expire_at` already passed: %s' % (encode_time(expire_at),))
+    return expire_at
+
+
+def get_order_class(type_):
+    try:
+        return _support_types[type_]
+    except KeyError:
+        raise InvalidOrderType(type_)
+
+
 class OrderStore(object):
+    clock = WALL_CLOCK
 
     @classmethod
     def instance(cls):
@@ -32,21 +76,34 @@ class OrderStore(object):
     def get(self, order_id):
         raise NotImplementedError()
 
-    def create(self, type_, symbol, amount, price=None):
-        order = self._factory(type_, symbol, amount, price)
+    def create(self, type_, symbol, amount, price=None, stop_price=None, account=None, expire_at=None):
+        order = self._factory(type_, symbol, amount, price, stop_price, account, expire_at)
         self._save(order)
         return order
 
+    def make(self, type_, symbol, amount, price=None, stop_price=None, account=None, expire_at=None):
+        """Return a new order with its id, not saved until `put`."""
+        return self._factory(type_, symbol, amount, price, stop_price, account, expire_at)
+
+    def put(self, order):
+        """Save an order made by `make`, or created elsewhere, e.g. replicated from another engine."""
+        self._save(order)
+
+    def accept(self, order):
+        """Called when the engine accepts `order`: save the seq it was given."""
+        pass
+
+    def finish(self, order_ids):
+        """Called once the orders are done: no more trade will happen to them."""
+        pass
+
     def _save(self, order):
         raise NotImplementedError()
 
-    def _factory(self, type_, symbol, amount, price=None):
-        if type_ not in _support_types:
-            raise InvalidOrderType(type_)
-        now = datetime.now()
+    def _factory(self, type_, symbol, amount, price=None, stop_price=None, account=None, expire_at=None):
+        klass = get_order_class(type_)
         order_id = self.next_id
-        klass = _support_types[type_]
-        return klass(order_id, symbol, amount, now, price)
+        return klass(order_id, symbol, amount, self.clock.time_ns(), price, stop_price, account, expire_at)
 
     @property
     def next_id(self):
@@ -54,19 +111,46 @@ class OrderStore(object):
 
 
 class MemOrderStore(OrderStore):
+    """Keep the orders in memory.
+
+    With a `retention` policy the finished orders are moved out of memory into
+    `archive`, where they can still be found by id.
+    """
 
-    def __init__(self):
+    def __init__(self, retention=None, archive=None, clock=None):
         self._data = {}
         self._id = 0
+        self._retention = retention and Retention(retention)
+        self._archive = archive
+        if clock is not None:
+            self.clock = clock
 
     def _save(self, order):
         self._data[order.id] = order
 
+    def put(self, order):
+        super().put(order)
+        self._id = max(self._id, order.id)
+
     def get(self, order_id):
         try:
             return self._data[order_id]
         except KeyError:
-            raise OrderNotFound(order_id)
+            pass
+        if self._archive is not None:
+            try:
+                return decode_order(self._archive.get('order', order_id))
+            except KeyError:
+                pass
+        raise OrderNotFound(order_id)
+
+    def finish(self, order_ids):
+        if self._retention is None:
+            return
+        for order_id in self._retention.finish(order_ids):
+            order = self._data.pop(order_id, None)
+            if order is not None and self._archive is not None:
+                self._archive.put('order', order_id, encode_order(order))
 
     @property
     def next_id(self):
@@ -74,39 +158,26 @@ class MemOrderStore(OrderStore):
         return self._id
 
 
-class DBOrderStore(OrderStore):
-    def __init__(self, db):
-        self.db = db
-
-    @property
-    def next_id(self):
-        order = self.db.session.query(OrderModel).order_by(OrderModel.id.desc()).first()
-        current_id = order and order.id or 0
-        return current_id + 1
-
-    def get(self, order_id):
-        order_model = self.db.session.query(OrderModel).filter(OrderModel.id == order_id).one()
-        klass = _support_types[order_model.type]
-        return klass(order_id, order_model.symbol, order_model.amount,
-                     order_model.timestamp, order_model.price)
-
-    def _save(self, order):
-        self.db.session.add(
-            OrderModel(id=order.id, symbol=order.symbol, amount=order.amount,
-                       type=order.TYPE, price=order.price, timestamp=order.timestamp))
-        self.db.session.commit()
-
-
 class Order(object):
     TYPE = ''
-    
-    def __init__(self, id_, symbol, amount, timestamp, price=None):
+    RESTING = True  # False: never rest in the book, what is left after matching is canceled
+    ALL_OR_NONE = False  # True: fill the whole amount at once or nothing
+    MARKET = False  # True: no limit price
+    STOP = False  # True: waits in the trigger book until the last price reaches `stop_price`
+    TRIGGER_TYPE = None  # type of the order a stop order becomes once triggered
+
+    def __init__(self, id_, symbol, amount, timestamp, price=None, stop_price=None, account=None,
+                 expire_at=None, seq=None):
         self.id = id_
         self.symbol = symbol
         self.amount = amount
-        self.timestamp = timestamp
+        self.timestamp = timestamp  # nanoseconds, when received
+        self.seq = seq  # time priority, given by the engine when it accepts the order
         self._price = price
-        
+        self.stop_price = stop_price
+        self.account = account  # owner, checked against `xtrade.account.Ledger` when there is one
+        self.expire_at = expire_at  # None: good till canceled
+
     @property
     def price(self):
         return self._price
@@ -116,7 +187,14 @@ class Order(object):
         if self.amount == amount:
             return None
         amount = self.amount - amount
-        return self.__class__(self.id, self.symbol, amount, self.timestamp, self.price)
+        return self.__class__(self.id, self.symbol, amount, self.timestamp, self.price, self.stop_price,
+                              self.account, self.expire_at, self.seq)
+
+    def trigger(self, seq, timestamp):
+        """Return the order a stop order becomes, arriving with `seq` at `timestamp`."""
+        klass = _support_types[self.TRIGGER_TYPE]
+        return klass(self.id, self.symbol, self.amount, timestamp, self._price, self.stop_price, self.account,
+                     self.expire_at, seq)
 
     def __str__(self):
         return "%s<%s, %s, %s>" % (self.__class__.__name__, self.price, self.amount, self.timestamp)
@@ -144,13 +222,14 @@ class SellOrder(Order):
 
         Comparing based on the following:
         * price: lower price win
-        * timestamp: if price is the same, the first one win
+        * seq: if price is the same, the first one accepted win
+        * timestamp: between the orders of the same event, the first one received or triggered win
         """
         if self.price < other.price:
             return True
         elif self.price > other.price:
             return False
-        return self.timestamp <= other.timestamp
+        return (self.seq, self.timestamp) < (other.seq, other.timestamp)
 SellOrder.register()
 
 
@@ -162,16 +241,14 @@ class BuyOrder(Order):
 
         Comparing based on the following:
         * price: higher price win
-        * timestamp: if price is the same, the first one win
+        * seq: if price is the same, the first one accepted win
+        * timestamp: between the orders of the same event, the first one received or triggered win
         """
         if self.price > other.price:
-            return -1
+            return True
         elif self.price < other.price:
-            return 1
-        if self.timestamp <= other.timestamp:
-            return -1
-        else:
-            return 1
+            return False
+        return (self.seq, self.timestamp) < (other.seq, other.timestamp)
 
     def can_buy(self, sell_order):
         assert isinstance(sell_order, SellOrder),\
@@ -182,6 +259,7 @@ BuyOrder.register()
 
 class MarketSellOrder(SellOrder):
     TYPE = 'market_sell'
+    MARKET = True
 
     @property
     def price(self):
@@ -191,9 +269,69 @@ MarketSellOrder.register()
 
 class MarketBuyOrder(BuyOrder):
     TYPE = 'market_buy'
+    MARKET = True
 
     @property
     def price(self):
         return sys.maxsize
 MarketBuyOrder.register()
 
+
+class IOCSellOrder(SellOrder):
+    TYPE = 'ioc_sell'
+    RESTING = False
+IOCSellOrder.register()
+
+
+class IOCBuyOrder(BuyOrder):
+    TYPE = 'ioc_buy'
+    RESTING = False
+IOCBuyOrder.register()
+
+
+class FOKSellOrder(IOCSellOrder):
+    TYPE = 'fok_sell'
+    ALL_OR_NONE = True
+FOKSellOrder.register()
+
+
+class FOKBuyOrder(IOCBuyOrder):
+    TYPE = 'fok_buy'
+    ALL_OR_NONE = True
+FOKBuyOrder.register()
+
+
+class StopSellOrder(MarketSellOrder):
+    TYPE = 'stop_sell'
+    STOP = True
+    TRIGGER_TYPE = 'market_sell'
+StopSellOrder.register()
+
+
+class StopBuyOrder(MarketBuyOrder):
+    TYPE = 'stop_buy'
+    STOP = True
+    TRIGGER_TYPE = 'market_buy'
+StopBuyOrder.register()
+
+
+class StopLimitSellOrder(SellOrder):
+    TYPE = 'stop_limit_sell'
+    STOP = True
+    TRIGGER_TYPE = 'sell'
+StopLimitSellOrder.register()
+
+
+class StopLimitBuyOrder(BuyOrder):
+    TYPE = 'stop_limit_buy'
+    STOP = True
+    TRIGGER_TYPE = 'buy'
+StopLimitBuyOrder.register()
+
+
+def __getattr__(name):
+    # the DB-backed store moved to `xtrade.dbstore`, only loaded when asked for
+    if name == 'DBOrderStore':
+        from .dbstore import DBOrderStore
+        return DBOrderStore
+    raise AttributeError('module %r has no attribute %r' % (__name__, name))
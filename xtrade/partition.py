@@ -0,0 +1,302 @@
+"""Orders and trades stored in one SQLite file per trading day.
+
+`<root>/<YYYYMMDD>.sqlite` holds the orders created and the trades made that
+day, in UTC. Timestamps are integer nanoseconds and both tables are indexed by
+(symbol, timestamp), so a range query only reads the days it spans, through
+their index. Only the partition of the last day is written to: older days can be
+compacted or detached (moved out of the root, once all their orders are
+finished) without touching it. Lookups by
+id are routed with the range of order ids of each day, kept in memory.
+"""
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+
+from .clock import to_ns, from_ns
+from .manager import TradeStore, Trade
+from .order import OrderStore, OrderNotFound, get_order_class
+
+
+LOG = logging.getLogger(__name__)
+
+SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS orders ('
+    'id INTEGER PRIMARY KEY, symbol TEXT NOT NULL, type TEXT NOT NULL, amount INTEGER NOT NULL, '
+    'price REAL, stop_price REAL, account TEXT, expire_at INTEGER, seq INTEGER, timestamp INTEGER NOT NULL)',
+    'CREATE INDEX IF NOT EXISTS orders_symbol_timestamp ON orders (symbol, timestamp)',
+    'CREATE TABLE IF NOT EXISTS trades ('
+    'id INTEGER PRIMARY KEY, order_id INTEGER NOT NULL, symbol TEXT, order_type TEXT NOT NULL, '
+    'price REAL NOT NULL, amount INTEGER NOT NULL, status TEXT NOT NULL, timestamp INTEGER NOT NULL)',
+    'CREATE INDEX IF NOT EXISTS trades_symbol_timestamp ON trades (symbol, timestamp)',
+    'CREATE INDEX IF NOT EXISTS trades_order_id ON trades (order_id)',
+)
+
+ORDER_COLUMNS = 'id, symbol, type, amount, price, stop_price, account, expire_at, seq, timestamp'
+FINAL_STATUSES = ('all_done', 'left_cancel', 'all_cancel')  # no more trade happens after them
+TRADE_COLUMNS = 'id, order_id, symbol, order_type, price, amount, status, timestamp'
+
+
+class PartitionError(Exception):
+    pass
+
+
+def get_day(timestamp):
+    return timestamp.strftime('%Y%m%d')
+
+
+def _day_of_ns(timestamp_ns):
+    return get_day(from_ns(timestamp_ns))
+
+
+class Partitions(object):
+    """The day partitions under `path`, shared by `PartitionedOrderStore` and `PartitionedTradeStore`."""
+    FILE_NAME = '%s.sqlite'
+
+    def __init__(self, path):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self._lock = threading.RLock()
+        self._connections = {}  # day => sqlite3.Connection
+        self._order_ids = {}  # day => [first, last] id of the orders of the day
+        self._last_ids = {'orders': 0, 'trades': 0}
+        for name in sorted(os.listdir(path)):
+            day, ext = os.path.splitext(name)
+            if ext == '.sqlite' and day.isdigit():
+                self._open(day)
+
+    @property
+    def days(self):
+        return sorted(self._connections)
+
+    @property
+    def hot_day(self):
+        """The last day, the only one written to."""
+        days = self.days
+        return days[-1] if days else None
+
+    def _open(self, day):
+        connection = sqlite3.connect(os.path.join(self.path, self.FILE_NAME % (day,)), check_same_thread=False)
+        for statement in SCHEMA:
+            connection.execute(statement)
+        self._connections[day] = connection
+        first_id, last_id = connection.execute('SELECT MIN(id), MAX(id) FROM orders').fetchone()
+        if first_id is not None:
+            self._order_ids[day] = [first_id, last_id]
+        for table in self._last_ids:
+            last_id, = connection.execute('SELECT MAX(id) FROM %s' % (table,)).fetchone()
+            self._last_ids[table] = max(self._last_ids[table], last_id or 0)
+        return connection
+
+    def next_ids(self, table, count):
+        with self._lock:
+            first_id = self._last_ids[table] + 1
+            self._last_ids[table] += count
+        return range(first_id, first_id + count)
+
+    def write(self, table, columns, rows):
+        """Insert `rows`, tuples of `columns` ending with the timestamp, into the partitions of their day."""
+        if not rows:
+            return
+        by_day = {}
+        for row in rows:
+            by_day.setdefault(_day_of_ns(row[-1]), []).append(row)
+        statement = 'INSERT INTO %s (%s) VALUES (%s)' % (table, columns, ', '.join('?' * len(rows[0])))
+        with self._lock:
+            for day, day_rows in sorted(by_day.items()):
+                if day < (self.hot_day or day):
+                    LOG.warning('%s rows written to the past day %s', len(day_rows), day)
+                connection = self._connections.get(day) or self._open(day)
+                with connection:
+                    connection.executemany(statement, day_rows)
+                if table == 'orders':
+                    ids = self._order_ids.setdefault(day, [day_rows[0][0], day_rows[0][0]])
+                    ids[0] = min([ids[0]] + [row[0] for row in day_rows])
+                    ids[1] = max([ids[1]] + [row[0] for row in day_rows])
+
+    def update(self, table, assignments, where, params, days):
+        """Run `UPDATE table SET assignments WHERE where` in all the `days`."""
+        statement = 'UPDATE %s SET %s WHERE %s' % (table, assignments, where)
+        with self._lock:
+            for day in days:
+                connection = self._connections.get(day)
+                if connection is not None:
+                    with connection:
+                        connection.execute(statement, params)
+
+    def order_day(self, order_id):
+        """Return the day of an order, None if it is in no partition attached."""
+        with self._lock:
+            for day, (first_id, last_id) in self._order_ids.items():
+                if first_id <= order_id <= last_id:
+                    return day
+        return None
+
+    def select(self, table, columns, where, params, days=None, order_by='id'):
+        """Return the rows of `table` matching `where` in all the `days`, by default all of them."""
+        statement = 'SELECT %s FROM %s WHERE %s ORDER BY %s' % (columns, table, where, order_by)
+        rows = []
+        with self._lock:
+            for day in sorted(self._connections if days is None else days):
+                connection = self._connections.get(day)
+                if connection is not None:
+                    rows.extend(connection.execute(statement, params))
+        return rows
+
+    def select_range(self, table, columns, symbol_id, start, end):
+        """Return the rows of `symbol_id` with `start` <= timestamp < `end` (UTC datetimes)."""
+        start_day, end_day = get_day(start), get_day(end)
+        days = [day for day in self.days if start_day <= day <= end_day]
+        return self.select(table, columns, 'symbol = ? AND timestamp >= ? AND timestamp < ?',
+                           (symbol_id, to_ns(start), to_ns(end)), days, 'timestamp, id')
+
+    def unfinished_orders(self, day):
+        """Return the ids of the orders created in `day` with no final trade in any day attached."""
+        with self._lock:
+            connection = self._connections.get(day)
+            if connection is None or day not in self._order_ids:
+                return []
+            order_ids = set(order_id for order_id, in connection.execute('SELECT id FROM orders'))
+            # the trades of an order are made from the day it was created on
+            statement = ('SELECT DISTINCT order_id FROM trades WHERE order_id BETWEEN ? AND ? AND status IN (%s)'
+                         % (', '.join('?' * len(FINAL_STATUSES)),))
+            params = tuple(self._order_ids[day]) + FINAL_STATUSES
+            for other_day in self.days:
+                if other_day >= day:
+                    order_ids.difference_update(
+                        order_id for order_id, in self._connections[other_day].execute(statement, params))
+        return sorted(order_ids)
+
+    def _check_cold(self, day):
+        if day not in self._connections:
+            raise PartitionError('no partition attached for %s' % (day,))
+        if day == self.hot_day:
+            raise PartitionError('%s is the hot partition' % (day,))
+
+    def compact(self, day):
+        """Rebuild the file of a past day to reclaim its free pages."""
+        with self._lock:
+            self._check_cold(day)
+        # a connection of its own: a cold partition is never written to, readers are not blocked
+        connection = sqlite3.connect(os.path.join(self.path, self.FILE_NAME % (day,)))
+        try:
+            connection.execute('ANALYZE')
+            connection.execute('VACUUM')
+        finally:
+            connection.close()
+
+    def detach(self, day, dest):
+        """Move the file of a past day into the directory `dest`, return its new path.
+
+        Refused while orders of that day may still trade or be canceled.
+        """
+        with self._lock:
+            self._check_cold(day)
+            unfinished = self.unfinished_orders(day)
+            if unfinished:
+                raise PartitionError('%s has %s unfinished orders' % (day, len(unfinished)))
+            self._connections.pop(day).close()
+            self._order_ids.pop(day, None)
+        os.makedirs(dest, exist_ok=True)
+        return shutil.move(os.path.join(self.path, self.FILE_NAME % (day,)), dest)
+
+    def attach(self, path):
+        """Move back a partition file detached before."""
+        day, _ = os.path.splitext(os.path.basename(path))
+        with self._lock:
+            if day in self._connections:
+                raise PartitionError('a partition is already attached for %s' % (day,))
+            shutil.move(path, os.path.join(self.path, self.FILE_NAME % (day,)))
+            self._open(day)
+
+    def close(self):
+        with self._lock:
+            for connection in self._connections.values():
+                connection.close()
+            self._connections = {}
+
+
+def _encode_order(order):
+    expire_at = order.expire_at and to_ns(order.expire_at)
+    return (order.id, order.symbol, order.TYPE, order.amount, order._price, order.stop_price, order.account,
+            expire_at, order.seq, order.timestamp)
+
+
+def _decode_order(row):
+    id_, symbol, type_, amount, price, stop_price, account, expire_at, seq, timestamp = row
+    klass = get_order_class(type_)
+    return klass(id_, symbol, amount, timestamp, price, stop_price, account, expire_at and from_ns(expire_at), seq)
+
+
+def _encode_trade(trade):
+    return (trade.id, trade.order_id, trade.symbol, trade.order_type, trade.price, trade.amount, trade.status,
+            trade.timestamp)
+
+
+def _decode_trade(row):
+    id_, order_id, symbol, order_type, price, amount, status, timestamp = row
+    return Trade(id_, order_id, order_type, price, amount, status, timestamp, symbol)
+
+
+class PartitionedOrderStore(OrderStore):
+    def __init__(self, partitions, clock=None):
+        self.partitions = partitions
+        if clock is not None:
+            self.clock = clock
+
+    @property
+    def next_id(self):
+        return self.partitions.next_ids('orders', 1)[0]
+
+    def get(self, order_id):
+        day = self.partitions.order_day(order_id)
+        rows = day and self.partitions.select('orders', ORDER_COLUMNS, 'id = ?', (order_id,), [day])
+        if not rows:
+            raise OrderNotFound(order_id)
+        return _decode_order(rows[0])
+
+    def accept(self, order):
+        day = self.partitions.order_day(order.id)
+        if day is not None:
+            self.partitions.update('orders', 'seq = ?', 'id = ?', (order.seq, order.id), [day])
+
+    def orders(self, symbol_id, start, end):
+        """Return the orders of `symbol_id` created between `start` and `end`."""
+        return [_decode_order(row) for row in
+                self.partitions.select_range('orders', ORDER_COLUMNS, symbol_id, start, end)]
+
+    def _save(self, order):
+        self.partitions.write('orders', ORDER_COLUMNS, [_encode_order(order)])
+
+
+class PartitionedTradeStore(TradeStore):
+    def __init__(self, partitions, clock=None):
+        self.partitions = partitions
+        if clock is not None:
+            self.clock = clock
+
+    def get(self, order_id):
+        # the trades of an order are made from the day it was created on
+        day = self.partitions.order_day(order_id)
+        days = None if day is None else [d for d in self.partitions.days if d >= day]
+        return [_decode_trade(row) for row in
+                self.partitions.select('trades', TRADE_COLUMNS, 'order_id = ?', (order_id,), days)]
+
+    def trades(self, symbol_id, start, end):
+        """Return the trades of `symbol_id` made between `start` and `end`."""
+        return [_decode_trade(row) for row in
+                self.partitions.select_range('trades', TRADE_COLUMNS, symbol_id, start, end)]
+
+    def _save(self, trade):
+        self._save_all([trade])
+
+    def _save_all(self, trades):
+        self.partitions.write('trades', TRADE_COLUMNS, [_encode_trade(trade) for trade in trades])
+
+    @property
+    def next_id(self):
+        return self.partitions.next_ids('trades', 1)[0]
+
+    def _next_ids(self, count):
+        return self.partitions.next_ids('trades', count)
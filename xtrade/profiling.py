@@ -0,0 +1,158 @@
+"""Profile the matching thread on demand, without restarting it."""
+import collections
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+
+
+class ProfilerBusy(Exception):
+    pass
+
+
+class DeterministicSession(object):
+    """cProfile the events processed by the matching thread until `duration` expires.
+
+    The profile is enabled and disabled by the matching thread itself, around
+    every event, since cProfile only sees the thread it is enabled in.
+    """
+
+    def __init__(self, duration, sort='cumulative', limit=50):
+        self.deadline = time.monotonic() + duration
+        self.duration = duration
+        self.sort = sort
+        self.limit = limit
+        self.done = threading.Event()
+        self._profile = cProfile.Profile()
+        self._enabled = False
+
+    def enter(self):
+        if time.monotonic() >= self.deadline:
+            self.done.set()
+            return
+        self._profile.enable()
+        self._enabled = True
+
+    def exit(self):
+        if self._enabled:
+            self._profile.disable()
+            self._enabled = False
+        if time.monotonic() >= self.deadline:
+            self.done.set()
+
+    def run(self, grace):
+        if not self.done.wait(self.duration + grace):
+            return 'matching thread did not answer in time\n'
+        out = io.StringIO()
+        try:
+            stats = pstats.Stats(self._profile, stream=out)
+        except TypeError:
+            return 'no event processed\n'
+        stats.sort_stats(self.sort).print_stats(self.limit)
+        return out.getvalue()
+
+
+class SamplingSession(object):
+    """Sample the stack of the matching thread every `interval` seconds.
+
+    The report is made of collapsed stacks, `root;...;leaf count` per line, as
+    read by flame graph tools.
+    """
+
+    def __init__(self, thread, duration, interval=0.005):
+        self.thread = thread
+        self.duration = duration
+        self.interval = interval
+
+    def enter(self):
+        pass
+
+    def exit(self):
+        pass
+
+    def run(self, grace):
+        counts = collections.Counter()
+        deadline = time.monotonic() + self.duration
+        while time.monotonic() < deadline:
+            frame = sys._current_frames().get(self.thread.ident)
+            if frame is not None:
+                counts[self._collapse(frame)] += 1
+            time.sleep(self.interval)
+        return ''.join('%s %s\n' % (stack, count) for stack, count in counts.most_common())
+
+    def _collapse(self, frame):
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append('%s:%s' % (os.path.basename(code.co_filename), code.co_name))
+            frame = frame.f_back
+        return ';'.join(reversed(stack))
+
+
+class EngineProfiler(object):
+    """Let another thread profile the matching thread for a bounded window.
+
+    The matching thread calls `enter` and `exit` around every event, which
+    costs one attribute read when no profiling is running.
+    """
+    MAX_DURATION = 60
+
+    def __init__(self, thread=None, grace=2):
+        self.thread = thread
+        self.grace = grace  # extra seconds to wait for the matching thread
+        self._lock = threading.Lock()
+        self._session = None
+
+    def profile(self, mode='sampling', duration=5, **kwargs):
+        """Profile for `duration` seconds, return the report as text."""
+        duration = min(duration, self.MAX_DURATION)
+        if mode == 'deterministic':
+            session = DeterministicSession(duration, **kwargs)
+        elif mode == 'sampling':
+            session = SamplingSession(self.thread, duration, **kwargs)
+        else:
+            raise ValueError('unknown profiling mode: %s' % (mode,))
+        with self._lock:
+            if self._session is not None:
+                raise ProfilerBusy()
+            self._session = session
+        try:
+            return session.run(self.grace)
+        finally:
+            self._session = None
+
+    def enter(self):
+        session = self._session
+        if session is not None:
+            session.enter()
+        return session
+
+    def exit(self, session):
+        if session is not None:
+            session.exit()
+
+
+class EventTrace(object):
+    """Time spent in each phase of processing one event."""
+
+    def __init__(self, event):
+        self.event = event
+        self.start = self._last = time.perf_counter()
+        self.phases = collections.OrderedDict()
+
+    def mark(self, phase):
+        """Count the time since the last mark into `phase`."""
+        now = time.perf_counter()
+        self.phases[phase] = self.phases.get(phase, 0) + now - self._last
+        self._last = now
+
+    @property
+    def total(self):
+        return self._last - self.start
+
+    def __str__(self):
+        return '%s: %.3fms (%s)' % (self.event, self.total * 1000, ', '.join(
+            '%s: %.3fms' % (phase, elapsed * 1000) for phase, elapsed in self.phases.items()))
@@ -0,0 +1,118 @@
+"""Replay an order stream straight into the matching logic.
+
+The input is made of JSON lines, one per request:
+
+    {"action": "order", "type": "buy", "symbol": "WSCN", "amount": 10, "price": 100}
+    {"action": "cancel", "order_id": 1}
+    {"action": "amend", "order_id": 1, "amount": 5, "price": 101}
+    {"action": "order", "type": "stop_sell", "symbol": "WSCN", "amount": 10, "stop_price": 95}
+    {"action": "auction", "symbol": "WSCN", "phase": "open"}
+    {"action": "mass_cancel", "symbol": "WSCN", "side": "buy"}
+    {"action": "order", "type": "sell", "symbol": "WSCN", "amount": 10, "price": 101, "time_in_force": "DAY"}
+
+`action` defaults to "order". Order ids are given in the order of the stream,
+starting from 1, the same way `MemOrderStore` does.
+"""
+import json
+import logging
+
+from .archive import decode_time
+from .clock import StepClock
+from .event import NewOrderEvent, CancelOrderEvent, AmendOrderEvent, AuctionEvent, MassCancelEvent
+from .manager import TradeManager, MemTradeStore, encode_trade
+from .order import MemOrderStore, encode_order, get_expire_at
+
+
+LOG = logging.getLogger(__name__)
+
+
+class Replayer(object):
+    """Drive a TradeManager on the calling thread, without queue nor logs.
+
+    Timestamps come from `clock`, a `StepClock` by default, so the same input
+    always produces the same output.
+    """
+
+    def __init__(self, order_store=None, trade_store=None, clock=None):
+        self.clock = clock or StepClock()
+        self.order_store = order_store or MemOrderStore(clock=self.clock)
+        self.trade_store = trade_store or MemTradeStore(clock=self.clock)
+        self.manager = TradeManager(None, self.trade_store, self.order_store, trade_log_file=None,
+                                    order_log_file=None, depth_log_file=None, clock=self.clock)
+
+    def apply(self, record):
+        """Apply one request, return the trades it caused."""
+        action = record.get('action', 'order')
+        if action == 'order':
+            expire_at = None
+            if 'time_in_force' in record:
+                expire_at = get_expire_at(record['time_in_force'], self.clock.now(),
+                                          decode_time(record.get('expire_at')))
+            order = self.order_store.create(record['type'], record['symbol'], record['amount'],
+                                            record.get('price'), record.get('stop_price'), record.get('account'),
+                                            expire_at)
+            report = self.manager.handle_event(NewOrderEvent(order.id))
+            if report is None:
+                return []
+            return report_trades(report)
+        elif action == 'cancel':
+            trade = self.manager.handle_event(CancelOrderEvent(record['order_id']))
+            return [trade] if trade else []
+        elif action == 'amend':
+            trade = self.manager.handle_event(
+                AmendOrderEvent(record['order_id'], record.get('amount'), record.get('price')))
+            return [trade] if trade else []
+        elif action == 'mass_cancel':
+            return self.manager.handle_event(
+                MassCancelEvent(record.get('symbol'), record.get('side'), record.get('account')))
+        elif action == 'auction':
+            report = self.manager.handle_event(AuctionEvent(record['symbol'], record['phase']))
+            if report is None:
+                return []
+            return report_trades(report)
+        LOG.warning('unknown action: %s', action)
+        return []
+
+    def replay(self, records):
+        """Apply all the requests, yield the trades as they happen."""
+        for record in records:
+            for trade in self.apply(record):
+                yield trade
+
+    def book(self):
+        """Return the resting orders of each symbol."""
+        return {
+            symbol: {side: [encode_order(o) for o in self.manager.resting_orders(symbol, side)]
+                     for side in ('buy', 'sell')}
+            for symbol in self.manager.symbols
+        }
+
+
+def report_trades(report):
+    """Return the trades of an execution report, then those of the stop orders it triggered."""
+    canceled = report.canceled
+    if not isinstance(canceled, list):
+        canceled = [canceled] if canceled else []
+    trades = report.trades + canceled
+    for triggered in report.triggered:
+        trades.extend(report_trades(triggered))
+    return trades
+
+
+def read_records(f):
+    for line in f:
+        line = line.strip()
+        if line:
+            yield json.loads(line)
+
+
+def replay_file(path, output):
+    """Replay the JSON lines of `path`, write the trades then the final book to `output`."""
+    replayer = Replayer()
+    with open(path) as f:
+        for trade in replayer.replay(read_records(f)):
+            output.write(json.dumps({'trade': encode_trade(trade)}, sort_keys=True))
+            output.write('\n')
+    output.write(json.dumps({'book': replayer.book()}, sort_keys=True))
+    output.write('\n')
+    return replayer
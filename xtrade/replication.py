@@ -0,0 +1,251 @@
+"""Replicate the input events of a primary TradeManager to hot-standby replicas.
+
+The primary publishes every event, with a gapless sequence number, before
+processing it. Each replica applies them in order to its own book through its
+own TradeManager and acknowledges the sequence numbers, so it can be promoted
+to primary at any time with an identical book.
+
+The wire format is one json document per line, over TCP:
+
+    replica -> primary: {"hello": <last seq applied>}
+    primary -> replica: {"seq": <seq>, "snapshot": {...}}, only if the replica is behind the journal
+    primary -> replica: {"seq": <seq>, "event": {...}, "order": {...}}
+    replica -> primary: {"ack": <seq>}
+"""
+import json
+import logging
+import queue
+import socket
+import threading
+import time
+
+from .event import decode_event
+from .manager import TradeManager, MemTradeStore
+from .order import MemOrderStore, encode_order, decode_order
+
+
+LOG = logging.getLogger(__name__)
+
+
+class ReplicationError(Exception):
+    pass
+
+
+def _encode(record):
+    return (json.dumps(record) + '\n').encode()
+
+
+class _Connection(object):
+    """A replica connected to the primary, written to by its own thread."""
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.acked = 0
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._send_all, daemon=True)
+        self._thread.start()
+
+    def send(self, line):
+        self._queue.put(line)
+
+    def close(self):
+        self._queue.put(None)
+
+    def _send_all(self):
+        while True:
+            line = self._queue.get()
+            if line is None:
+                break
+            try:
+                self.sock.sendall(line)
+            except OSError as e:
+                LOG.warning('replica lost: %s', e)
+                break
+
+
+class ReplicationPublisher(object):
+    """Stream the sequenced events of the primary to the replicas.
+
+    The last events are kept in a journal, so a replica connecting late, or
+    again, is first sent what it missed. Once the journal holds `journal_size`
+    events it is replaced by a snapshot of the book of `manager`, the
+    TradeManager publishing, and a replica behind the journal starts from the
+    snapshot.
+    """
+
+    def __init__(self, address=('127.0.0.1', 0), journal_size=10000):
+        self._server = socket.create_server(address)
+        self.address = self._server.getsockname()
+        self.seq = 0
+        self.journal_size = journal_size
+        self.manager = None  # set by the TradeManager
+        self._journal = []  # encoded events, the one of seq `n` at `n - self._first`
+        self._first = 1
+        self._snapshot = None  # encoded snapshot of the book after the event of seq `self._first - 1`
+        self._connections = []
+        self._lock = threading.Lock()
+        self._acked = threading.Condition()
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def publish(self, event, order=None):
+        """Send `event`, and the `order` it refers to, to all the replicas. Return its seq."""
+        record = {'event': event.encode()}
+        if order is not None:
+            record['order'] = encode_order(order)
+        with self._lock:
+            if len(self._journal) >= self.journal_size and self.manager is not None:
+                # called before the event is processed: the book is the one after `self.seq`
+                self._snapshot = _encode({'seq': self.seq, 'snapshot': self.manager.dump()})
+                self._journal = []
+                self._first = self.seq + 1
+            self.seq += 1
+            record['seq'] = self.seq
+            line = _encode(record)
+            self._journal.append(line)
+            for connection in self._connections:
+                connection.send(line)
+            return self.seq
+
+    def wait_for_ack(self, seq, replicas=1, timeout=None):
+        """Wait until `replicas` replicas acknowledged `seq`, return whether they did."""
+        with self._acked:
+            return self._acked.wait_for(
+                lambda: sum(c.acked >= seq for c in self._connections) >= replicas, timeout)
+
+    def close(self):
+        self._server.close()
+        with self._lock:
+            for connection in self._connections:
+                connection.close()
+                connection.sock.close()
+            self._connections = []
+
+    def _accept(self):
+        while True:
+            try:
+                sock, _ = self._server.accept()
+            except OSError:
+                break
+            threading.Thread(target=self._serve, args=(sock,), daemon=True).start()
+
+    def _serve(self, sock):
+        lines = sock.makefile('rb')
+        try:
+            hello = json.loads(lines.readline())['hello']
+        except (ValueError, KeyError):
+            LOG.warning('invalid replica handshake')
+            sock.close()
+            return
+        connection = _Connection(sock)
+        connection.acked = hello
+        with self._lock:
+            if hello < self._first - 1:
+                connection.send(self._snapshot)
+                hello = self._first - 1
+            for line in self._journal[hello - self._first + 1:]:
+                connection.send(line)
+            self._connections.append(connection)
+        try:
+            for line in lines:
+                with self._acked:
+                    connection.acked = json.loads(line)['ack']
+                    self._acked.notify_all()
+        except (OSError, ValueError, KeyError):
+            pass
+        with self._lock:
+            if connection in self._connections:
+                self._connections.remove(connection)
+        connection.close()
+
+
+class Replica(threading.Thread):
+    """Follow a primary, applying its events to a book of our own.
+
+    When the stream breaks, the replica connects again every `retry_interval`
+    seconds and resumes from the last event it applied.
+    """
+
+    def __init__(self, address, order_store=None, trade_store=None, retry_interval=1, **manager_kwargs):
+        super().__init__()
+        self.daemon = True
+        self.order_store = order_store or MemOrderStore()
+        self.trade_store = trade_store or MemTradeStore()
+        manager_kwargs.setdefault('trade_log_file', None)
+        manager_kwargs.setdefault('order_log_file', None)
+        manager_kwargs.setdefault('depth_log_file', None)
+        self.manager = TradeManager(None, self.trade_store, self.order_store, **manager_kwargs)
+        self.manager.following = True
+        self.seq = 0
+        self.address = address
+        self.retry_interval = retry_interval
+        self._promoted = False
+        self._lock = threading.Lock()  # between reconnecting and `promote`
+        self._connect()
+
+    def _connect(self):
+        self._sock = socket.create_connection(self.address)
+        self._sock.sendall(_encode({'hello': self.seq}))
+
+    def run(self):
+        while True:
+            try:
+                for line in self._sock.makefile('rb'):
+                    self.apply(json.loads(line))
+                    self._sock.sendall(_encode({'ack': self.seq}))
+            except (OSError, ValueError, KeyError, ReplicationError) as e:
+                if not self._promoted:
+                    LOG.warning('replication broken at seq %s: %s', self.seq, e, exc_info=True)
+            if not self._reconnect():
+                return
+
+    def _reconnect(self):
+        """Connect again to the primary, return False once promoted."""
+        self._sock.close()
+        while not self._promoted:
+            LOG.warning('primary lost at seq %s, reconnecting', self.seq)
+            time.sleep(self.retry_interval)
+            with self._lock:
+                if self._promoted:
+                    break
+                try:
+                    self._connect()
+                    return True
+                except OSError as e:
+                    LOG.warning('can not connect to the primary: %s', e)
+        return False
+
+    def apply(self, record):
+        if 'snapshot' in record:
+            if record['seq'] < self.seq:
+                raise ReplicationError('snapshot of seq %s behind %s' % (record['seq'], self.seq))
+            state = record['snapshot']
+            for data in state['orders']:
+                self.order_store.put(decode_order(data))
+            self.manager.load(state)
+            self.seq = record['seq']
+            return
+        if record['seq'] != self.seq + 1:
+            raise ReplicationError('expected seq %s, got: %s' % (self.seq + 1, record['seq']))
+        if 'order' in record:
+            self.order_store.put(decode_order(record['order']))
+        self.manager.handle_event(decode_event(record['event']))
+        self.seq = record['seq']
+
+    def promote(self, message_queue):
+        """Stop following the primary and start matching the events of `message_queue`.
+
+        Return the TradeManager, now the primary one.
+        """
+        with self._lock:
+            self._promoted = True
+            try:
+                self._sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self._sock.close()
+        self.join()
+        LOG.info('promoted to primary at seq %s', self.seq)
+        self.manager.following = False
+        self.manager.msg_queue = message_queue
+        self.manager.start()
+        return self.manager
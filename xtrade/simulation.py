@@ -0,0 +1,148 @@
+"""Randomized stress simulation of the matching logic.
+
+Every scenario is driven by its own seed through an isolated TradeManager with
+in-memory stores, so a failing seed can be replayed alone with `run_scenario`.
+"""
+from concurrent.futures import ProcessPoolExecutor
+import random
+import time
+
+from .clock import StepClock
+from .event import NewOrderEvent, CancelOrderEvent
+from .manager import TradeManager, MemTradeStore
+from .order import MemOrderStore
+
+
+class InvariantError(AssertionError):
+    pass
+
+
+class Scenario(object):
+    def __init__(self, seed, orders=1000, symbol='WSCN', price_range=(90, 110), cancel_rate=0.1,
+                 market_ratio=0.1, ioc_ratio=0.05, max_amount=999):
+        self.seed = seed
+        self.orders = orders
+        self.symbol = symbol
+        self.price_range = price_range
+        self.cancel_rate = cancel_rate
+        self.market_ratio = market_ratio
+        self.ioc_ratio = ioc_ratio
+        self.max_amount = max_amount
+
+    def __repr__(self):
+        return '%s<%s>' % (self.__class__.__name__, self.seed)
+
+    def generate(self):
+        """Yield the requests of this scenario, the same way `test_client.run_test` does."""
+        rand = random.Random(self.seed)
+        order_id = 0
+        for _ in range(self.orders):
+            if order_id and rand.random() < self.cancel_rate:
+                yield {'action': 'cancel', 'order_id': rand.randint(1, order_id)}
+            side = rand.choice(('buy', 'sell'))
+            kind = rand.random()
+            if kind < self.market_ratio:
+                type_ = 'market_' + side
+            elif kind < self.market_ratio + self.ioc_ratio:
+                type_ = rand.choice(('ioc_', 'fok_')) + side
+            else:
+                type_ = side
+            price = rand.randint(self.price_range[0] * 100, self.price_range[1] * 100) / 100.
+            order_id += 1
+            yield {'action': 'order', 'type': type_, 'symbol': self.symbol,
+                   'amount': rand.randint(1, self.max_amount), 'price': price}
+
+
+class Simulator(object):
+    """Drive one scenario and check the invariants after every request."""
+
+    def __init__(self, scenario):
+        self.scenario = scenario
+        clock = StepClock()
+        self.order_store = MemOrderStore(clock=clock)
+        self.trade_store = MemTradeStore(clock=clock)
+        self.manager = TradeManager(None, self.trade_store, self.order_store, trade_log_file=None,
+                                    order_log_file=None, depth_log_file=None, clock=clock)
+        self.fills = 0
+
+    def run(self):
+        for record in self.scenario.generate():
+            if record['action'] == 'cancel':
+                self.manager.handle_event(CancelOrderEvent(record['order_id']))
+            else:
+                self._new_order(record)
+            self.check_book()
+        self.check_amounts()
+
+    def _new_order(self, record):
+        order = self.order_store.create(record['type'], record['symbol'], record['amount'], record['price'])
+        other_side = 'sell' if order.is_buy else 'buy'
+        queued = [o.id for o in self.manager.resting_orders(order.symbol, other_side)]
+        report = self.manager.handle_event(NewOrderEvent(order.id))
+        if report is None:
+            raise InvariantError('%s: not processed' % (order,))
+        matched = [f.sell_order.id if order.is_buy else f.buy_order.id for f in report.fills]
+        # price-time priority: the orders matched are the first ones of the opposite side
+        if matched != queued[:len(matched)]:
+            raise InvariantError('%s matched %s, expected %s' % (order, matched, queued[:len(matched)]))
+        self.fills += len(report.fills)
+
+    def check_book(self):
+        symbol = self.scenario.symbol
+        buy_orders = self.manager.resting_orders(symbol, 'buy')
+        sell_orders = self.manager.resting_orders(symbol, 'sell')
+        if buy_orders and sell_orders and buy_orders[0].can_buy(sell_orders[0]):
+            raise InvariantError('crossed book: %s, %s' % (buy_orders[0], sell_orders[0]))
+        for order in buy_orders + sell_orders:
+            if not order.RESTING:
+                raise InvariantError('%s should never rest in the book' % (order,))
+
+    def check_amounts(self):
+        """Every order's amount is either traded, canceled or still resting."""
+        for order_id in range(1, self.order_store._id + 1):
+            order = self.order_store.get(order_id)
+            trades = self.trade_store.get(order_id)
+            done = sum(t.amount for t in trades if not t.is_canceled)
+            canceled = sum(t.amount for t in trades if t.is_canceled)
+            resting = self.manager._order_map.get(order_id)
+            left = resting.amount if resting else 0
+            if done + canceled + left != order.amount:
+                raise InvariantError('%s: %s done, %s canceled, %s left' % (order, done, canceled, left))
+            if order.ALL_OR_NONE and done not in (0, order.amount):
+                raise InvariantError('%s: partially filled, %s done' % (order, done))
+
+
+def run_scenario(scenario):
+    """Run one scenario, return its stats, and its error if an invariant broke."""
+    simulator = Simulator(scenario)
+    start = time.perf_counter()
+    error = None
+    try:
+        simulator.run()
+    except InvariantError as e:
+        error = str(e)
+    return {
+        'seed': scenario.seed,
+        'orders': scenario.orders,
+        'fills': simulator.fills,
+        'elapsed': time.perf_counter() - start,
+        'error': error,
+    }
+
+
+def run_simulation(scenarios, workers=None):
+    """Run the scenarios across a process pool and aggregate their stats."""
+    start = time.perf_counter()
+    with ProcessPoolExecutor(workers) as executor:
+        results = list(executor.map(run_scenario, scenarios, chunksize=4))
+    elapsed = time.perf_counter() - start
+    orders = sum(r['orders'] for r in results)
+    return {
+        'scenarios': len(results),
+        'orders': orders,
+        'fills': sum(r['fills'] for r in results),
+        'elapsed': elapsed,
+        'orders_per_second': orders / elapsed if elapsed else None,
+        'engine_seconds': sum(r['elapsed'] for r in results),
+        'failures': [{'seed': r['seed'], 'error': r['error']} for r in results if r['error']],
+    }